@@ -1,7 +1,9 @@
 import datetime
+import time
 from functools import partial
 
 from manageiq_client.api import APIException
+from sqlalchemy import text
 from widgetastic.widget import View, Text
 from widgetastic_patternfly import Input, Button
 
@@ -23,13 +25,20 @@ from utils.log import logger
 from utils.stats import tol_check
 from utils.update import Updateable
 from utils.varmeth import variable
-from utils.wait import wait_for, RefreshTimer
+from utils.wait import wait_for, RefreshTimer, TimedOutError
 from . import PolicyProfileAssignable, Taggable, SummaryMixin
 
 cfg_btn = partial(tb.select, 'Configuration')
 
 details_page = Region(infoblock_type='detail')
 
+# Seconds between the checks of wait_for_refresh, growing by the factor up to the maximum
+REFRESH_CHECK_DELAY = 1
+REFRESH_CHECK_MAX_DELAY = 15
+REFRESH_CHECK_BACKOFF = 1.5
+# Seconds after which wait_for_refresh requests a refresh when none is queued or running
+REFRESH_RETRIGGER_TIME = 300
+
 
 def base_types():
     from pkg_resources import iter_entry_points
@@ -51,10 +60,30 @@ def all_types():
     return all_types
 
 
+def db_count(table, condition=None, joins='', count='*'):
+    """Returns a SQL query counting the rows of a table which belong to a provider
+
+    The query is meant to be used as a subquery of :py:meth:`BaseProvider.stats_snapshot`, where
+    ``ems`` is the row of the provider in ``ext_management_systems``.
+
+    Args:
+        table: Name of the table with the ``ems_id`` column; e.g. 'vms' or 'hosts'
+        condition: Additional SQL condition for the rows of the table
+        joins: SQL joining further tables to ``table``, whose rows are counted then
+        count: What to count, e.g. 'DISTINCT hosts.id'
+    """
+    query = 'SELECT count({2}) FROM {0}{1} WHERE {0}.ems_id = ems.id'.format(table, joins, count)
+    if condition:
+        query = '{} AND {}'.format(query, condition)
+    return query
+
+
 class BaseProvider(Taggable, Updateable, SummaryMixin, Navigatable):
     # List of constants that every non-abstract subclass must have defined
     _param_name = ParamClassName('name')
     STATS_TO_MATCH = []
+    # Stats which are counted in the database by stats_snapshot, name to query from db_count
+    DB_STATS = {}
     string_name = ""
     page_name = ""
     edit_page_suffix = ""
@@ -358,15 +387,72 @@ class BaseProvider(Taggable, Updateable, SummaryMixin, Navigatable):
         else:
             return True
 
+    def _refresh_state(self):
+        """ Reads the refresh state of this provider from the database
+
+        Returns: A tuple of the seconds since the last refresh finished (``None`` if it was not
+            refreshed yet) and the number of its refresh queue items which are not done yet.
+        """
+        res = self.appliance.db.engine.execute(
+            text(
+                "SELECT extract(epoch FROM timezone('utc', now()) - ems.last_refresh_date) "
+                "AS age, "
+                "(SELECT count(*) FROM miq_queue "
+                "WHERE miq_queue.queue_name = 'ems_' || ems.id "
+                "AND miq_queue.class_name = 'EmsRefresh' "
+                "AND miq_queue.state IN ('ready', 'dequeue')) AS pending "
+                "FROM ext_management_systems ems WHERE ems.name = :name"),
+            name=self.name)
+        row = res.first()
+        if row is None:
+            return None, 0
+        return row['age'], int(row['pending'])
+
+    def wait_for_refresh(self, timeout=1000, max_age=600):
+        """ Waits until this provider is refreshed, watching the appliance database
+
+        The provider counts as refreshed when its last refresh finished at most ``max_age``
+        seconds before the call (or any time after it) and no other refresh of it is queued.
+        The checks start a second apart and slow down gradually. A refresh is requested when
+        the last one is too old and none is queued, and again every
+        :py:data:`REFRESH_RETRIGGER_TIME` seconds while none shows up.
+
+        Args:
+            timeout: Seconds to wait for the refresh
+            max_age: Seconds for which an already finished refresh is still good
+
+        Returns: The seconds it took until the refresh was finished
+
+        Raises:
+            TimedOutError: If the provider was not refreshed in time
+        """
+        start = time.time()
+        delay = REFRESH_CHECK_DELAY
+        next_trigger = start + REFRESH_RETRIGGER_TIME
+        triggered = False
+        while True:
+            age, pending = self._refresh_state()
+            waited = time.time() - start
+            if not pending and age is not None and age <= max_age + waited:
+                logger.info(
+                    'Provider %s refreshed, waited %.1f seconds', self.name, waited)
+                return waited
+            if waited >= timeout:
+                raise TimedOutError(
+                    'Provider {} was not refreshed in {} seconds'.format(self.name, timeout))
+            if not pending and (time.time() >= next_trigger or age is not None and not triggered):
+                # Nothing in progress, either the last refresh is too old or none came up
+                logger.info(' Time for a refresh!')
+                self.refresh_provider_relationships()
+                next_trigger = time.time() + REFRESH_RETRIGGER_TIME
+                triggered = True
+                max_age = 0
+            time.sleep(min(delay, timeout - waited))
+            delay = min(delay * REFRESH_CHECK_BACKOFF, REFRESH_CHECK_MAX_DELAY)
+
     def validate(self):
-        refresh_timer = RefreshTimer(time_for_refresh=300)
         try:
-            wait_for(self.is_refreshed,
-                     [refresh_timer],
-                     message="is_refreshed",
-                     num_sec=1000,
-                     delay=60,
-                     handle_exception=True)
+            self.wait_for_refresh(timeout=1000)
         except Exception:
             # To see the possible error.
             self.load_details(refresh=True)
@@ -439,17 +525,45 @@ class BaseProvider(Taggable, Updateable, SummaryMixin, Navigatable):
         Args:
             table_str: Name of the table; e.g. 'vms' or 'hosts'
         """
+        return self._db_stats({'count': db_count(table_str)})['count']
+
+    def _db_stats(self, queries):
+        """ Runs the count queries of :py:func:`db_count` in one statement
+
+        Returns: :py:class:`dict` of the names of ``queries`` to the counts, zeros if the
+            provider is not in the database.
+        """
+        names = sorted(queries)
+        columns = ', '.join('({}) AS {}'.format(queries[name], name) for name in names)
         res = self.appliance.db.engine.execute(
-            "SELECT count(*) "
-            "FROM ext_management_systems, {0} "
-            "WHERE {0}.ems_id=ext_management_systems.id "
-            "AND ext_management_systems.name='{1}'".format(table_str, self.name))
-        return int(res.first()[0])
+            text('SELECT {} FROM ext_management_systems ems WHERE ems.name = :name'.format(
+                columns)),
+            name=self.name)
+        row = res.first()
+        return {name: int(row[name]) if row is not None else 0 for name in names}
+
+    def stats_snapshot(self, stats=None):
+        """ Counts the inventory of this provider in the database with a single query
+
+        Args:
+            stats: Names of the stats to count, those not in :py:attr:`DB_STATS` are left out.
+                All of :py:attr:`DB_STATS` by default.
+
+        Returns: :py:class:`dict` of the stat names to their values
+        """
+        if stats is None:
+            stats = self.DB_STATS
+        queries = {stat: self.DB_STATS[stat] for stat in stats if stat in self.DB_STATS}
+        if not queries:
+            return {}
+        return self._db_stats(queries)
 
     def _do_stats_match(self, client, stats_to_match=None, refresh_timer=None, ui=False):
         """ A private function to match a set of statistics, with a Provider.
 
-        This function checks if the list of stats match, if not, the page is refreshed.
+        This function checks if the list of stats match, if not, the page is refreshed. Unless
+        matching against the UI, the stats in :py:attr:`DB_STATS` are taken from a single
+        :py:meth:`stats_snapshot`.
 
         Note: Provider mgmt_system uses the same key names as this Provider class to avoid
             having to map keyname/attributes e.g. ``num_template``, ``num_vm``.
@@ -474,9 +588,13 @@ class BaseProvider(Taggable, Updateable, SummaryMixin, Navigatable):
                 self.refresh_provider_relationships()
                 refresh_timer.reset()
 
+        snapshot = {} if ui else self.stats_snapshot(stats_to_match)
         for stat in stats_to_match:
             try:
-                cfme_stat = getattr(self, stat)(method=method)
+                if stat in snapshot:
+                    cfme_stat = snapshot[stat]
+                else:
+                    cfme_stat = getattr(self, stat)(method=method)
                 success, value = tol_check(host_stats[stat],
                                            cfme_stat,
                                            min_error=0.05,
@@ -647,6 +765,10 @@ class CloudInfraProvider(BaseProvider, PolicyProfileAssignable):
     edit_page_suffix = 'provider_edit'
     refresh_text = "Refresh Relationships and Power States"
     db_types = ["CloudManager", "InfraManager"]
+    DB_STATS = {
+        'num_template': db_count('vms', 'vms.template'),
+        'num_vm': db_count('vms', 'NOT vms.template'),
+    }
 
     def wait_for_creds_ok(self):
         """Waits for provider's credentials to become O.K. (circumvents the summary rails exc.)"""
@@ -3,7 +3,7 @@ from random import sample
 
 from navmazing import NavigateToSibling, NavigateToAttribute
 
-from cfme.common.provider import BaseProvider
+from cfme.common.provider import BaseProvider, db_count
 from cfme.fixtures import pytest_selenium as sel
 from cfme.web_ui import (
     Quadicon, Form, AngularSelect, form_buttons, Input, toolbar as tb,
@@ -100,6 +100,23 @@ class ContainersProvider(BaseProvider, Pretty):
         'num_image_registry',
         'num_container']
     # TODO add 'num_volume'
+    DB_STATS = {
+        'num_project': db_count('container_projects'),
+        'num_service': db_count('container_services'),
+        'num_replication_controller': db_count('container_replicators'),
+        'num_container_group': db_count('container_groups'),
+        'num_pod': db_count('container_groups'),
+        'num_node': db_count('container_nodes'),
+        # Containers are linked to providers through container definitions and then through pods
+        'num_container': db_count(
+            'container_groups',
+            joins=' JOIN container_definitions'
+                  ' ON container_definitions.container_group_id = container_groups.id'
+                  ' JOIN containers'
+                  ' ON containers.container_definition_id = container_definitions.id'),
+        'num_image': db_count('container_images'),
+        'num_image_registry': db_count('container_image_registries'),
+    }
     string_name = "Containers"
     page_name = "containers"
     detail_page_suffix = 'provider_detail'
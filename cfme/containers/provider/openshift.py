@@ -1,4 +1,5 @@
 from . import ContainersProvider
+from cfme.common.provider import db_count
 from utils.varmeth import variable
 from os import path
 from mgmtsystem.openshift import Openshift
@@ -15,6 +16,10 @@ class CustomAttribute(object):
 class OpenshiftProvider(ContainersProvider):
     num_route = ['num_route']
     STATS_TO_MATCH = ContainersProvider.STATS_TO_MATCH + num_route
+    DB_STATS = dict(
+        ContainersProvider.DB_STATS,
+        num_route=db_count('container_routes'),
+        num_template=db_count('container_templates'))
     type_name = "openshift"
     mgmt_class = Openshift
     db_types = ["Openshift::ContainerManager"]
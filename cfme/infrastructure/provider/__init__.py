@@ -7,7 +7,7 @@ from cached_property import cached_property
 from navmazing import NavigateToSibling, NavigateToObject
 
 from cfme.base.ui import Server
-from cfme.common.provider import CloudInfraProvider
+from cfme.common.provider import CloudInfraProvider, db_count
 from cfme.common.provider_views import (ProviderAddView,
                                         ProviderEditView,
                                         ProviderDetailsView,
@@ -56,6 +56,13 @@ class InfraProvider(Pretty, CloudInfraProvider, Fillable):
     category = "infra"
     pretty_attrs = ['name', 'key', 'zone']
     STATS_TO_MATCH = ['num_template', 'num_vm', 'num_datastore', 'num_host', 'num_cluster']
+    DB_STATS = dict(
+        CloudInfraProvider.DB_STATS,
+        num_datastore=db_count(
+            'hosts', joins=' JOIN host_storages ON host_storages.host_id = hosts.id',
+            count='DISTINCT host_storages.storage_id'),
+        num_host=db_count('hosts'),
+        num_cluster=db_count('ems_clusters'))
     string_name = "Infrastructure"
     page_name = "infrastructure"
     templates_destination_name = "Templates"
@@ -1,5 +1,6 @@
 import re
 
+from cfme.common.provider import db_count
 from cfme.common import TopologyMixin, TimelinesMixin
 from . import MiddlewareProvider
 from utils.appliance import Navigatable
@@ -33,6 +34,17 @@ class HawkularProvider(MiddlewareBase, TopologyMixin, TimelinesMixin, Middleware
     """
     STATS_TO_MATCH = MiddlewareProvider.STATS_TO_MATCH +\
         ['num_server', 'num_domain', 'num_deployment', 'num_datasource', 'num_messaging']
+    DB_STATS = dict(
+        MiddlewareProvider.DB_STATS,
+        num_deployment=db_count('middleware_deployments'),
+        num_server=db_count('middleware_servers'),
+        num_server_group=db_count(
+            'middleware_domains',
+            joins=' JOIN middleware_server_groups'
+                  ' ON middleware_server_groups.domain_id = middleware_domains.id'),
+        num_datasource=db_count('middleware_datasources'),
+        num_domain=db_count('middleware_domains'),
+        num_messaging=db_count('middleware_messagings'))
     property_tuples = MiddlewareProvider.property_tuples +\
         [('name', 'Name'), ('hostname', 'Host Name'), ('port', 'Port'), ('provider_type', 'Type')]
     type_name = "hawkular"
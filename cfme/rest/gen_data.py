@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import time
+
 import fauxfactory
+from manageiq_client.filters import Q
 
 from cfme.automate.service_dialogs import ServiceDialog
 from cfme.exceptions import OptionNotAvailable
@@ -10,10 +13,14 @@ from cfme.services.catalogs.service_catalogs import ServiceCatalogs
 from cfme.services import requests
 from fixtures.provider import setup_one_by_class_or_skip
 from utils.virtual_machines import deploy_template
-from utils.wait import wait_for
+from utils.wait import wait_for, TimedOutError
 from utils.log import logger
 from utils import version
 
+# Seconds between the checks for created entities, growing by the factor up to the maximum
+ENTITIES_CHECK_DELAY = 0.2
+ENTITIES_CHECK_MAX_DELAY = 5
+ENTITIES_CHECK_BACKOFF = 1.5
 
 _TEMPLATE_TORSO = """{
   "AWSTemplateFormatVersion" : "2010-09-09",
@@ -254,17 +261,13 @@ def service_templates(request, rest_api, service_dialog=None, service_catalog=No
 
     collection = rest_api.collections.service_templates
 
-    for new_name in new_names:
-        wait_for(lambda: collection.find_by(name=new_name) or False, num_sec=180, delay=10)
+    wait_for_entities(collection, 'name', new_names)
 
     s_tpls = [ent for ent in collection if ent.name in new_names]
 
     @request.addfinalizer
     def _finished():
-        collection.reload()
-        to_delete = [ent for ent in collection if ent.name in new_names]
-        if len(to_delete) != 0:
-            collection.action.delete(*to_delete)
+        delete_entities(collection, s_tpls)
 
     return s_tpls
 
@@ -368,6 +371,57 @@ def users(request, rest_api, num=1):
     return users
 
 
+def _filter_any(collection, field, values):
+    """Searches the entities whose ``field`` matches any of the ``values`` with one request.
+
+    Returns: list of the found entities, with ``id`` and ``field`` loaded
+    """
+    query = None
+    for value in values:
+        condition = Q(field, '=', value)
+        query = condition if query is None else query | condition
+    return collection.query_string(
+        **{'filter[]': query.as_filters, 'expand': 'resources', 'attributes': field}).resources
+
+
+def wait_for_entities(collection, field, values, substr_search=False, num_sec=180):
+    """Waits until entities matching all the ``values`` of ``field`` exist in the collection.
+
+    Every check looks up all the entities which were not found yet with a single filtered
+    query. The checks start a fraction of a second apart and slow down gradually.
+
+    Raises:
+        TimedOutError: If some of the entities did not show up in ``num_sec`` seconds.
+    """
+    search_str = '%{}%' if substr_search else '{}'
+    pending = set(values)
+    start = time.time()
+    delay = ENTITIES_CHECK_DELAY
+    while True:
+        found = [getattr(entity, field, None) or '' for entity in _filter_any(
+            collection, field, [search_str.format(value) for value in pending])]
+        pending = {value for value in pending if not any(
+            value in match if substr_search else value == match for match in found)}
+        if not pending:
+            return
+        waited = time.time() - start
+        if waited >= num_sec:
+            raise TimedOutError('{} with {} {} not found in {} seconds'.format(
+                collection.name, field, ', '.join(sorted(pending)), num_sec))
+        time.sleep(min(delay, num_sec - waited))
+        delay = min(delay * ENTITIES_CHECK_BACKOFF, ENTITIES_CHECK_MAX_DELAY)
+
+
+def delete_entities(collection, entities):
+    """Deletes those of the ``entities`` which still exist, with one query and one request."""
+    ids = [int(entity.id) for entity in entities]
+    if not ids:
+        return
+    existing = _filter_any(collection, 'id', ids)
+    if existing:
+        collection.action.delete(*existing)
+
+
 def _creating_skeleton(request, rest_api, col_name, col_data, col_action='create',
         substr_search=False):
     collection = getattr(rest_api.collections, col_name)
@@ -379,25 +433,19 @@ def _creating_skeleton(request, rest_api, col_name, col_data, col_action='create
 
     entities = action(*col_data)
     action_status = rest_api.response.status_code
-    search_str = '%{}%' if substr_search else '{}'
-    for entity in col_data:
-        if entity.get('name', None):
-            wait_for(lambda: collection.find_by(
-                name=search_str.format(entity.get('name'))) or False, num_sec=180, delay=10)
-        elif entity.get('description', None):
-            wait_for(lambda: collection.find_by(
-                description=search_str.format(entity.get('description'))) or False,
-                num_sec=180, delay=10)
-        else:
-            raise NotImplementedError
+    names = [entity['name'] for entity in col_data if entity.get('name', None)]
+    descriptions = [entity['description'] for entity in col_data
+        if not entity.get('name', None) and entity.get('description', None)]
+    if len(names) + len(descriptions) != len(col_data):
+        raise NotImplementedError
+    if names:
+        wait_for_entities(collection, 'name', names, substr_search=substr_search)
+    if descriptions:
+        wait_for_entities(collection, 'description', descriptions, substr_search=substr_search)
 
     @request.addfinalizer
     def _finished():
-        collection.reload()
-        ids = [e.id for e in entities]
-        delete_entities = [e for e in collection if e.id in ids]
-        if len(delete_entities) != 0:
-            collection.action.delete(*delete_entities)
+        delete_entities(collection, entities)
 
     # make sure action status code is preserved
     rest_api.response.status_code = action_status
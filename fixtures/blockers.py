@@ -14,6 +14,7 @@ import pytest
 
 from fixtures.pytest_store import store
 from utils.blockers import Blocker, BZ, GH
+from utils.log import logger
 
 
 @pytest.fixture(scope="function")
@@ -63,8 +64,33 @@ def pytest_addoption(parser):
                     help='Specify to list the blockers (takes some time though).')
 
 
+def prefetch_bugzilla_blockers(items):
+    """Fetch all bugs used as blockers by the collected items in one go, they end up cached."""
+    bug_ids = set([])
+    for item in items:
+        for blocker in item._metadata.get("blockers", []):
+            if isinstance(blocker, int):
+                bug_ids.add(blocker)
+                continue
+            try:
+                blocker_object = Blocker.parse(blocker)
+            except ValueError:
+                continue
+            if isinstance(blocker_object, BZ):
+                bug_ids.add(blocker_object.bug_id)
+    if not bug_ids:
+        return
+    try:
+        count = BZ.bugzilla.prefetch_bugs(bug_ids)
+    except Exception as e:
+        logger.warning("Could not prefetch the Bugzilla blockers: %s", e)
+    else:
+        logger.info("Prefetched %s Bugzilla bugs for %s blockers", count, len(bug_ids))
+
+
 @pytest.mark.trylast
 def pytest_collection_modifyitems(session, config, items):
+    prefetch_bugzilla_blockers(items)
     if not config.getvalue("list_blockers"):
         return
     store.terminalreporter.write("Loading blockers ...\n", bold=True)
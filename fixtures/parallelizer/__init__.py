@@ -14,26 +14,52 @@ The Workflow
 - Master runs collection, blocks until slaves report their collections
 - Slaves each run collection and submit them to the master, then block inside their runtest loop,
   waiting for tests to run
+
+  - With ``--parallel-collection-cache``, the master stores its collection in the pytest cache;
+    slaves which find it up to date skip their collection, and collect the cached test modules
+    only when the first tests are sent to them
 - Master diffs slave collections against its own; the test ids are verified to match
   across all nodes
 - Master enters main runtest loop, uses a generator to build lists of test groups which are then
   sent to slaves, one group at a time
+
+  - The generator is picked with ``--parallel-scheduler``; ``modscope`` (the default) hands out
+    groups in collection order, ``duration`` hands out the groups with the longest historical
+    runtime first, using per-test durations recorded in the pytest cache by previous runs
 - For each phase of each test, the slave serializes test reports, which are then unserialized on
   the master and handed to the normal pytest reporting hooks, which is able to deal with test
   reports arriving out of order
+
+  - By default every report waits for an ack from the master; with ``--parallel-batch-reports``
+    the slaves stream their reports in batches instead, and only ``need_tests`` gets a reply
 - Before running the last test in a group, the slave will request more tests from the master
 
   - If more tests are received, they are run
+  - If no tests are left in the pool, the master tries to steal not-yet-started tests from a busy
+    slave with the same provider allocation (slaves report their remaining queue length with
+    every logstart); the busy slave is asked to release them in the reply to its next report
+  - Stealing only starts once the slave has run its final test, so a slave asking for tests
+    while it still holds one is told to retry, and asks again after running it
   - If no tests are received, the slave will shut down after running its final test
 
+- While tests run, appliances can be attached to or detached from the session through the
+  master's control socket, see ``scripts/parallel_control.py``
+
+  - Attached appliances get a new slave, which takes its tests from the remaining pool
+  - Detached slaves are drained: they give their unstarted tests back to the master and shut
+    down after their current test, or are interrupted right away when forced
+
 - After all slaves are shut down, the master will do its end-of-session reporting as usual, and
   shut down
+- Test durations seen during the run are stored in the pytest cache for the ``duration`` scheduler,
+  and the predicted and actual distribution makespans are reported
 
 """
 from itertools import groupby
 
 
 import difflib
+import heapq
 import json
 import os
 import signal
@@ -43,6 +69,7 @@ from datetime import datetime
 from itertools import count
 
 import attr
+from cached_property import cached_property
 
 from threading import Thread
 from time import sleep, time
@@ -68,12 +95,31 @@ if not conf.runtime['env'].get('ts'):
     ts = str(time())
     conf.runtime['env']['ts'] = ts
 
+#: Available test group generators, see :py:meth:`ParallelSession._test_item_generator`
+SCHEDULERS = ('modscope', 'duration')
+#: pytest cache key holding the per-nodeid test durations of previous runs
+DURATIONS_CACHE_KEY = 'parallelize/durations'
+
 
 def pytest_addhooks(pluginmanager):
     import hooks
     pluginmanager.add_hookspecs(hooks)
 
 
+def pytest_addoption(parser):
+    group = parser.getgroup('cfme')
+    group.addoption('--parallel-scheduler', dest='parallel_scheduler', default='modscope',
+        choices=SCHEDULERS,
+        help='how the parallelizer orders test groups; "duration" sends the groups with the '
+             'longest recorded runtime first')
+    group.addoption('--parallel-batch-reports', dest='parallel_batch_reports',
+        action='store_true', default=False,
+        help='stream slave reports to the master in batches instead of acking every report')
+    group.addoption('--parallel-collection-cache', dest='parallel_collection_cache',
+        action='store_true', default=False,
+        help="let slaves reuse the master's collection instead of collecting all tests")
+
+
 @pytest.mark.trylast
 def pytest_configure(config):
     # configures the parallel session, then fires pytest_parallel_configured
@@ -109,9 +155,22 @@ class SlaveDetail(object):
 
     provider_allocation = attr.ib(default=attr.Factory(list), repr=False)
 
+    #: number of received tests the slave has not started yet, as reported by the slave
+    queue_len = attr.ib(default=0, init=False, repr=False)
+    #: idle slave waiting for tests that are being stolen from this slave
+    steal_for = attr.ib(default=None, init=False, repr=False)
+    #: whether the release request for the steal was already sent to this slave
+    steal_sent = attr.ib(default=False, init=False, repr=False)
+    #: sequence number of the last report batch received from the slave process, None once
+    #: reports were lost and the process was killed
+    batch_seq = attr.ib(default=0, init=False, repr=False)
+    #: set when the slave is being detached, it gets no more tests and gives its queue back
+    draining = attr.ib(default=False, init=False)
+
     def start(self):
         if self.forbid_restart:
             return
+        self.batch_seq = 0
         devnull = open(os.devnull, 'w')
         # worker output redirected to null; useful info comes via messages and logs
         self.process = subprocess.Popen(
@@ -149,7 +208,16 @@ class ParallelSession(object):
 
         self.failed_slave_test_groups = deque()
         self.slave_spawn_count = 0
-        self.appliances = self.config.option.appliances
+
+        # historical durations feed the duration scheduler, the run durations replace them
+        # in the cache at the end of the session
+        self.durations = config.cache.get(DURATIONS_CACHE_KEY, {})
+        self.run_durations = defaultdict(float)
+        self.predicted_makespan = None
+        self.distribution_start = None
+        self.distribution_end = None
+        self.appliances = list(self.config.option.appliances)
+        self.batch_reports = config.getoption('parallel_batch_reports')
 
         # set up the ipc socket
 
@@ -159,6 +227,12 @@ class ParallelSession(object):
         self.sock = ctx.socket(zmq.ROUTER)
         self.sock.bind(zmq_endpoint)
 
+        # set up the control socket, used to attach and detach appliances during the run
+        control_endpoint = 'ipc://{}'.format(
+            config.cache.makedir('parallelize').join('{}-control'.format(os.getpid())))
+        self.control_sock = ctx.socket(zmq.REP)
+        self.control_sock.bind(control_endpoint)
+
         # clean out old slave config if it exists
         slave_config = conf_path.join('slave_config.yaml')
         slave_config.check() and slave_config.remove()
@@ -168,6 +242,9 @@ class ParallelSession(object):
             'args': self.config.args,
             'options': self.config.option.__dict__,
             'zmq_endpoint': zmq_endpoint,
+            'batch_reports': self.batch_reports,
+            'control_endpoint': control_endpoint,
+            'collection_cache': config.getoption('parallel_collection_cache'),
         }
         if hasattr(self, "slave_appliances_data"):
             conf.runtime['slave_config']["appliance_data"] = self.slave_appliances_data
@@ -183,9 +260,8 @@ class ParallelSession(object):
                 slave, green=True)
 
     def _slave_audit(self):
-        # XXX: There is currently no mechanism to add or remove slave_urls, short of
-        #      firing up the debugger and doing it manually. This is making room for
-        #      planned future abilities to dynamically add and remove slaves via automation
+        # slaves added by add_slave are started here, slaves detached by remove_slave
+        # are removed here once their process is gone
 
         # check for unexpected slave shutdowns and redistribute tests
         for slave in self.slaves.values():
@@ -204,10 +280,18 @@ class ParallelSession(object):
                     msg += ' and redistributing {} tests'.format(num_failed_tests)
                     self.failed_slave_test_groups.append(failed_tests)
                 self.print_message(msg, purple=True)
+                self._cancel_steals(slave)
 
         # If a slave was terminated for any reason, kill that slave
         # the terminated flag implies the appliance has died :(
         for slave in list(self.slaves.values()):
+            if slave.draining:
+                if slave.poll() is None and slave.process is not None:
+                    # draining slaves shut down on their own once they get no more tests
+                    continue
+                # the drained slave has given its queue back and exited, don't restart it
+                slave.process = None
+                slave.forbid_restart = True
             if slave.forbid_restart:
                 if slave.process is None:
                     self.config.hook.pytest_miq_node_shutdown(
@@ -223,6 +307,96 @@ class ParallelSession(object):
                     slave.start()
                     self.slave_spawn_count += 1
 
+    def handle_control(self):
+        """Handle a pending command from the control socket, if there is one
+
+        Commands are JSON objects with a ``command`` key (``add``, ``remove`` or ``list``),
+        the other keys are passed to the matching method as keyword arguments.
+
+        """
+        if not self.control_sock.poll(0):
+            return
+        try:
+            command = self.control_sock.recv_json()
+            method = {
+                'add': self.add_slave,
+                'remove': self.remove_slave,
+                'list': self.list_slaves,
+            }[command.pop('command')]
+            reply = {'result': method(**command)}
+        except Exception as ex:
+            self.log.exception(ex)
+            reply = {'error': str(ex)}
+        self.control_sock.send_json(reply)
+
+    def add_slave(self, url, template=None, provider=None):
+        """Attach an appliance to the running session
+
+        The slave for the appliance is started by the next slave audit, and then gets its tests
+        from the remaining pool like every other slave.
+
+        Args:
+            url: The base URL of the appliance
+            template: Sprout template the appliance was provisioned from, if any
+            provider: Provider the appliance runs on, if provisioned from ``template``
+
+        Returns:
+            The id of the new slave
+
+        """
+        if any(slave.url == url for slave in self.slaves.values()):
+            raise ValueError('{} is already used by this session'.format(url))
+        if template and provider:
+            # slaves read their config when they start, so the new slave will see this
+            appliance_data = conf.runtime['slave_config'].setdefault('appliance_data', {})
+            appliance_data[urlparse(url).netloc] = [template, provider]
+            conf.save('slave_config')
+        slave = SlaveDetail(url=url)
+        self.slaves[slave.id] = slave
+        # make room for the new slave in the respawn limit
+        self.appliances.append(url)
+        self.print_message('attached appliance {}'.format(url), slave, green=True)
+        return slave.id
+
+    def remove_slave(self, url, force=False):
+        """Detach an appliance from the running session
+
+        By default the slave is drained: it gives its unstarted tests back to the master and
+        shuts down after the current test. Forcing it interrupts the slave right away, and its
+        unfinished tests are redistributed by the slave audit.
+
+        Args:
+            url: The base URL of the appliance
+            force: Interrupt the slave instead of draining it
+
+        Returns:
+            The id of the detached slave
+
+        """
+        for slave in self.slaves.values():
+            if slave.url == url:
+                break
+        else:
+            raise ValueError('{} is not used by this session'.format(url))
+        if force:
+            self.print_message('detaching appliance {} now'.format(url), slave, purple=True)
+            self.interrupt(slave)
+        else:
+            self.print_message('draining appliance {}'.format(url), slave, purple=True)
+            slave.draining = True
+        return slave.id
+
+    def list_slaves(self):
+        """Map the ids of the session's slaves to their appliance URL and state"""
+        return {
+            slave.id: {
+                'url': slave.url,
+                'tests': len(slave.tests),
+                'draining': slave.draining,
+                'running': slave.process is not None,
+            }
+            for slave in self.slaves.values()}
+
     def send(self, slave, event_data):
         """Send data to slave.
 
@@ -241,11 +415,19 @@ class ParallelSession(object):
         slaveid, _, event_json = self.sock.recv_multipart(flags=zmq.NOBLOCK)
         event_data = json.loads(event_json)
         event_name = event_data.pop('_event_name')
+        pid = event_data.pop('_pid', None)
         if slaveid not in self.slaves:
             self.log.error("message from terminated worker %s %s %s",
                            slaveid, event_name, event_data)
             return None, None, None
-        return self.slaves[slaveid], event_data, event_name
+        slave = self.slaves[slaveid]
+        if pid is not None and (slave.process is None or slave.process.pid != pid or
+                slave.batch_seq is None):
+            # streamed by a slave process that died or lost reports since, its tests were
+            # already redistributed or will be by the slave audit
+            self.log.warning("message from dead %s process %s %s", slaveid, pid, event_name)
+            return None, None, None
+        return slave, event_data, event_name
 
     def print_message(self, message, prefix='master', **markup):
         """Print a message from a node to the py.test console
@@ -267,8 +449,31 @@ class ParallelSession(object):
             '({})[{}] '.format(prefix, stamp), message, **markup)
 
     def ack(self, slave, event_name):
-        """Acknowledge a slave's message"""
-        self.send(slave, 'ack {}'.format(event_name))
+        """Acknowledge a slave's message
+
+        Slaves streaming batched reports don't wait for acks, so none are sent to them
+
+        """
+        if not self.batch_reports:
+            self.send(slave, 'ack {}'.format(event_name))
+
+    def ack_or_release(self, slave, event_name):
+        """Acknowledge a slave's report, or ask it to release tests if they're being stolen
+
+        The slave answers a release request with a ``released_tests`` event.
+
+        """
+        if slave.steal_sent:
+            self.ack(slave, event_name)
+        elif slave.steal_for is not None:
+            slave.steal_sent = True
+            self.send(slave, {'release': max(slave.queue_len // 2, 1)})
+        elif slave.draining and slave.queue_len:
+            # released tests without a waiting slave go back to the master's failed groups
+            slave.steal_sent = True
+            self.send(slave, {'release': len(slave.tests)})
+        else:
+            self.ack(slave, event_name)
 
     def monitor_shutdown(self, slave):
         # non-daemon so slaves get every opportunity to shut down cleanly
@@ -334,24 +539,100 @@ class ParallelSession(object):
             slave.process.kill()
             self.monitor_shutdown(slave, **kwargs)
 
-    def send_tests(self, slave):
-        """Send a slave a group of tests"""
-        try:
-            tests = list(self.failed_slave_test_groups.popleft())
-        except IndexError:
-            tests = self.get(slave)
+    def send_tests(self, slave, tests=None):
+        """Send a slave a group of tests
+
+        If ``tests`` isn't given, the group is taken from the failed slave groups or the pool
+
+        """
+        if tests is None:
+            try:
+                tests = list(self.failed_slave_test_groups.popleft())
+            except IndexError:
+                tests = self.get(slave)
         self.send(slave, tests)
         slave.tests.update(tests)
         collect_len = len(self.collection)
         tests_len = len(tests)
         self.sent_tests += tests_len
         if tests:
+            if self.distribution_start is None:
+                self.distribution_start = time()
             self.print_message('sent {} tests to {} ({}/{}, {:.1f}%)'.format(
                 tests_len, slave.id, self.sent_tests, collect_len,
                 self.sent_tests * 100. / collect_len
             ))
         return tests
 
+    def handle_need_tests(self, slave):
+        """Answer a slave's request for tests
+
+        When there's nothing left to send, tests are stolen from a busy slave instead,
+        in which case the reply is deferred until the busy slave has released them.
+        A slave asks for tests before it runs its last queued test, which it can't run without
+        knowing the next one; it's told to ``retry`` instead, so it runs that test and asks
+        again rather than waiting on the busy slave. Draining slaves get no more tests, so they
+        shut down.
+
+        """
+        if slave.draining:
+            self.send_tests(slave, [])
+            return
+        if not self.failed_slave_test_groups and not self.pool_has_tests():
+            victim = self._steal_victim(slave)
+            if victim is not None and slave.tests:
+                self.send(slave, 'retry')
+                return
+            if victim is not None:
+                self.log.info('stealing tests for %s from %s', slave.id, victim.id)
+                victim.steal_for = slave
+                return
+        self.send_tests(slave)
+
+    def pool_has_tests(self):
+        if not self._pool:
+            self._fill_pool()
+        return bool(self._pool)
+
+    def _steal_victim(self, slave):
+        # only steal from slaves whose provider is already set up on the idle slave
+        candidates = [
+            victim for victim in self.slaves.values()
+            if victim is not slave and victim.process is not None and
+            not victim.draining and victim.steal_for is None and victim.queue_len >= 2 and
+            set(victim.provider_allocation) <= set(slave.provider_allocation)]
+        if candidates:
+            return max(candidates, key=lambda victim: victim.queue_len)
+
+    def tests_released(self, victim, node_ids):
+        """Hand tests released by a busy slave to the idle slave they were stolen for"""
+        slave, victim.steal_for, victim.steal_sent = victim.steal_for, None, False
+        victim.tests.difference_update(node_ids)
+        # a draining slave always releases its whole queue
+        victim.queue_len = 0 if victim.draining else victim.queue_len - len(node_ids)
+        self.sent_tests -= len(node_ids)
+        if slave is None:
+            # the idle slave died in the meantime, treat the tests like a failed slave's tests
+            if node_ids:
+                self.failed_slave_test_groups.append(node_ids)
+        elif node_ids:
+            self.print_message('stole {} tests from {}'.format(len(node_ids), victim.id), slave)
+            self.send_tests(slave, node_ids)
+        else:
+            # the busy slave started its tests in the meantime, try again
+            self.handle_need_tests(slave)
+
+    def _cancel_steals(self, slave):
+        # called when a slave stops asking for tests or dies, so no slave waits forever on it
+        for victim in self.slaves.values():
+            if victim.steal_for is slave:
+                # a release in flight will be put back into the failed test groups
+                victim.steal_for = None
+        if slave.steal_for is not None:
+            waiting_slave, slave.steal_for, slave.steal_sent = slave.steal_for, None, False
+            if waiting_slave.process is not None:
+                self.handle_need_tests(waiting_slave)
+
     def pytest_sessionstart(self, session):
         """pytest sessionstart hook
 
@@ -382,6 +663,8 @@ class ParallelSession(object):
         """
         # Build master collection for slave diffing and distribution
         self.collection = [item.nodeid for item in self.session.items]
+        if self.config.getoption('parallel_collection_cache'):
+            remote.save_collection_cache(self.config, self.collection)
 
         # Fire up the workers after master collection is complete
         # master and the first slave share an appliance, this is a workaround to prevent a slave
@@ -397,6 +680,9 @@ class ParallelSession(object):
             terminalreporter.disable()
 
             while True:
+                # attach/detach appliances if asked to
+                self.handle_control()
+
                 # spawn/kill/replace slaves if needed
                 self._slave_audit()
 
@@ -409,53 +695,10 @@ class ParallelSession(object):
                     break
 
                 slave, event_data, event_name = self.recv()
-                if event_name == 'message':
-                    message = event_data.pop('message')
-                    markup = event_data.pop('markup')
-                    # messages are special, handle them immediately
-                    self.print_message(message, slave, **markup)
-                    self.ack(slave, event_name)
-                elif event_name == 'collectionfinish':
-                    slave_collection = event_data['node_ids']
-                    # compare slave collection to the master, all test ids must be the same
-                    self.log.debug('diffing {} collection'.format(slave.id))
-                    diff_err = report_collection_diff(
-                        slave.id, self.collection, slave_collection)
-                    if diff_err:
-                        self.print_message(
-                            'collection differs, respawning', slave.id,
-                            purple=True)
-                        self.print_message(diff_err, purple=True)
-                        self.log.error('{}'.format(diff_err))
-                        self.kill(slave)
-                        slave.start()
-                    else:
-                        self.ack(slave, event_name)
-                elif event_name == 'need_tests':
-                    self.send_tests(slave)
-                    self.log.info('starting master test distribution')
-                elif event_name == 'runtest_logstart':
-                    self.ack(slave, event_name)
-                    self.trdist.runtest_logstart(
-                        slave.id,
-                        event_data['nodeid'],
-                        event_data['location'])
-                elif event_name == 'runtest_logreport':
-                    self.ack(slave, event_name)
-                    report = unserialize_report(event_data['report'])
-                    if report.when in ('call', 'teardown'):
-                        slave.tests.discard(report.nodeid)
-                    self.trdist.runtest_logreport(slave.id, report)
-                elif event_name == 'internalerror':
-                    self.ack(slave, event_name)
-                    self.print_message(event_data['message'], slave, purple=True)
-                    self.kill(slave)
-                elif event_name == 'shutdown':
-                    self.config.hook.pytest_miq_node_shutdown(
-                        config=self.config, nodeinfo=slave.url)
-                    self.ack(slave, event_name)
-                    del self.slaves[slave.id]
-                    self.monitor_shutdown(slave)
+                if event_name == 'batch':
+                    self.handle_batch(slave, event_data)
+                elif event_name is not None:
+                    self.handle_event(slave, event_name, event_data)
 
                 # total slave spawn count * 3, to allow for each slave's initial spawn
                 # and then each slave (on average) can fail two times
@@ -475,10 +718,131 @@ class ParallelSession(object):
         # Suppress other runtestloop calls
         return True
 
+    def handle_event(self, slave, event_name, event_data):
+        """Handle a single event sent by a slave"""
+        if event_name == 'message':
+            message = event_data.pop('message')
+            markup = event_data.pop('markup')
+            # messages are special, handle them immediately
+            self.print_message(message, slave, **markup)
+            self.ack(slave, event_name)
+        elif event_name == 'collectionfinish':
+            slave_collection = event_data['node_ids']
+            # compare slave collection to the master, all test ids must be the same
+            self.log.debug('diffing {} collection'.format(slave.id))
+            diff_err = report_collection_diff(
+                slave.id, self.collection, slave_collection)
+            if diff_err:
+                self.print_message(
+                    'collection differs, respawning', slave.id,
+                    purple=True)
+                self.print_message(diff_err, purple=True)
+                self.log.error('{}'.format(diff_err))
+                self.kill(slave)
+                slave.start()
+            else:
+                self.ack(slave, event_name)
+        elif event_name == 'need_tests':
+            # a slave asking for tests has no queue left to steal from
+            slave.queue_len = 0
+            self._cancel_steals(slave)
+            self.handle_need_tests(slave)
+            self.log.info('starting master test distribution')
+        elif event_name == 'released_tests':
+            self.ack(slave, event_name)
+            self.tests_released(slave, event_data['node_ids'])
+        elif event_name == 'runtest_logstart':
+            slave.queue_len = event_data.get('remaining', 0)
+            self.ack_or_release(slave, event_name)
+            self.trdist.runtest_logstart(
+                slave.id,
+                event_data['nodeid'],
+                event_data['location'])
+        elif event_name == 'runtest_logreport':
+            self.ack_or_release(slave, event_name)
+            report = unserialize_report(event_data['report'])
+            if report.when in ('call', 'teardown'):
+                slave.tests.discard(report.nodeid)
+            self._record_duration(report)
+            self.trdist.runtest_logreport(slave.id, report)
+        elif event_name == 'internalerror':
+            self.ack(slave, event_name)
+            self.print_message(event_data['message'], slave, purple=True)
+            self.kill(slave)
+        elif event_name == 'shutdown':
+            self.config.hook.pytest_miq_node_shutdown(
+                config=self.config, nodeinfo=slave.url)
+            self.ack(slave, event_name)
+            del self.slaves[slave.id]
+            self.monitor_shutdown(slave)
+
+    def handle_batch(self, slave, batch):
+        """Handle a batch of events streamed by a slave
+
+        Batches are numbered per slave process, a gap means reports were lost on the way.
+        Which tests the lost reports belong to can't be told, so the slave is killed, and its
+        unfinished tests are redistributed by the slave audit as if it had died.
+
+        """
+        if batch['seq'] != slave.batch_seq + 1:
+            self.log.warning('%s report batch %s out of sequence, expected %s',
+                slave.id, batch['seq'], slave.batch_seq + 1)
+            self.print_message('lost {} reports, killing slave'.format(slave.id), purple=True)
+            slave.process.kill()
+            slave.batch_seq = None
+            return
+        slave.batch_seq = batch['seq']
+        for event_data in batch['events']:
+            event_name = event_data.pop('_event_name')
+            self.handle_event(slave, event_name, event_data)
+
+    def pytest_sessionfinish(self):
+        if self.run_durations:
+            durations = dict(self.durations)
+            durations.update(self.run_durations)
+            self.config.cache.set(DURATIONS_CACHE_KEY, durations)
+        if self.predicted_makespan is not None and self.distribution_end is not None:
+            actual_makespan = self.distribution_end - self.distribution_start
+            self.print_message(
+                'makespan ({} scheduler): predicted {:.0f}s, actual {:.0f}s'.format(
+                    self.config.getoption('parallel_scheduler'),
+                    self.predicted_makespan, actual_makespan),
+                green=True)
+
+    def _record_duration(self, report):
+        # a respawned slave reruns its tests from setup, so setup resets the total
+        if report.when == 'setup':
+            self.run_durations[report.nodeid] = report.duration
+        else:
+            self.run_durations[report.nodeid] += report.duration
+        if report.when == 'teardown':
+            self.distribution_end = time()
+
     def _test_item_generator(self):
-        for tests in self._modscope_item_generator():
+        scheduler = self.config.getoption('parallel_scheduler')
+        item_generator = getattr(self, '_{}_item_generator'.format(scheduler))
+        for tests in item_generator():
+            yield tests
+
+    def _duration_item_generator(self):
+        # longest processing time first: the most expensive groups are handed out first,
+        # so the cheap groups can fill up the slaves that finish early
+        groups = list(self._modscope_item_generator())
+        groups.sort(key=self._group_duration, reverse=True)
+        for tests in groups:
             yield tests
 
+    @cached_property
+    def _default_duration(self):
+        # tests without history are assumed to take as long as the median known test
+        durations = sorted(self.durations.values())
+        if not durations:
+            return 1.0
+        return durations[len(durations) // 2]
+
+    def _group_duration(self, test_group):
+        return sum(self.durations.get(nodeid, self._default_duration) for nodeid in test_group)
+
     def _modscope_item_generator(self):
         # breaks out tests by module, can work just about any way we want
         # as long as it yields lists of tests id from the master collection
@@ -513,23 +877,30 @@ class ParallelSession(object):
                 self.log.info('sent tests with param {} {!r}'.format(id, tests))
                 yield tests
 
-    def get(self, slave):
+    def _provs_of_tests(self, test_group):
+        found = set()
+        for test in test_group:
+            found.update(pv for pv in self.provs
+                         if '[' in test and pv in test)
+        return sorted(found)
+
+    def _fill_pool(self):
+        for test_group in self.test_groups:
+            self._pool.append(test_group)
+            self.used_prov.update(self._provs_of_tests(test_group))
+        if self.used_prov:
+            self.ratio = float(len(self.slaves)) / len(self.used_prov)
+        else:
+            self.ratio = 0.0
+        if self._pool and self.predicted_makespan is None:
+            self.predicted_makespan = predict_makespan(
+                map(self._group_duration, self._pool), len(self.slaves))
 
-        def provs_of_tests(test_group):
-            found = set()
-            for test in test_group:
-                found.update(pv for pv in self.provs
-                             if '[' in test and pv in test)
-            return sorted(found)
+    def get(self, slave):
+        provs_of_tests = self._provs_of_tests
 
         if not self._pool:
-            for test_group in self.test_groups:
-                self._pool.append(test_group)
-                self.used_prov.update(provs_of_tests(test_group))
-            if self.used_prov:
-                self.ratio = float(len(self.slaves)) / len(self.used_prov)
-            else:
-                self.ratio = 0.0
+            self._fill_pool()
         if not self._pool:
             return []
         appliance_num_limit = 1
@@ -580,6 +951,30 @@ class ParallelSession(object):
         return []
 
 
+def predict_makespan(group_durations, num_slaves):
+    """Predict the wall-clock time needed to run test groups on a number of slaves
+
+    Groups are assigned in the given order, each to the slave that becomes idle first.
+
+    Note:
+
+        :py:meth:`ParallelSession.get` hands out groups by provider affinity, so a slave may
+        skip ahead in the pool; the prediction assumes an order which isn't guaranteed.
+
+    Args:
+        group_durations: Iterable of the expected duration of each test group, in seconds
+        num_slaves: Number of slaves running the groups
+
+    Returns:
+        The expected time in seconds until the last slave finishes its last group
+
+    """
+    slave_loads = [0.0] * max(num_slaves, 1)
+    for duration in group_durations:
+        heapq.heapreplace(slave_loads, slave_loads[0] + duration)
+    return max(slave_loads)
+
+
 def report_collection_diff(slaveid, from_collection, to_collection):
     """Report differences, if any exist, between master and a slave collection
 
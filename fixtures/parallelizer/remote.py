@@ -1,4 +1,9 @@
+import hashlib
+import json
+import os
 import signal
+from collections import deque
+from time import time
 from urlparse import urlparse
 
 import zmq
@@ -6,10 +11,28 @@ from py.path import local
 
 SLAVEID = None
 
+#: events which are queued up and streamed to the master in batches when batching reports
+BATCHED_EVENTS = ('message', 'runtest_logstart', 'runtest_logreport')
+#: batched events which are sent right away along with the queued events, so the master knows
+#: which test runs and how many tests are queued on the slave while a long test runs
+FLUSHED_EVENTS = ('runtest_logstart',)
+#: number of queued events after which a batch is sent; as every test start is flushed, and
+#: so is every test's teardown report, a test still costs two sends, only its setup and call
+#: reports and messages are batched, and the size and interval limits only come into play for
+#: tests sending lots of messages
+BATCH_SIZE = 50
+#: age in seconds of the oldest queued event after which a batch is sent
+BATCH_INTERVAL = 5
+#: number of unreceived messages after which sending blocks, throttling the slave
+BATCH_HWM = 100
+#: pytest cache key of the master's collection, see :py:func:`save_collection_cache`
+COLLECTION_CACHE_KEY = 'parallelize/collection'
+
 
 class SlaveManager(object):
     """SlaveManager which coordinates with the master process for parallel testing"""
-    def __init__(self, config, slaveid, base_url, zmq_endpoint):
+    def __init__(self, config, slaveid, base_url, zmq_endpoint, batch_reports=False,
+            collection_cache=False):
         self.config = config
         self.session = None
         self.collection = None
@@ -20,38 +43,131 @@ class SlaveManager(object):
         # Override the logger in utils.log
 
         ctx = zmq.Context.instance()
-        self.sock = ctx.socket(zmq.REQ)
-        self.sock.set_hwm(1)
+        self.batch_reports = batch_reports
+        if batch_reports:
+            # reports are streamed without waiting for acks, only need_tests gets a reply
+            self.sock = ctx.socket(zmq.DEALER)
+            self.sock.set_hwm(BATCH_HWM)
+        else:
+            self.sock = ctx.socket(zmq.REQ)
+            self.sock.set_hwm(1)
         self.sock.setsockopt_string(zmq.IDENTITY, u'{}'.format(self.slaveid))
         self.sock.connect(zmq_endpoint)
 
         self.messages = {}
+        # tests received from the master which haven't been started yet
+        self.queue = deque()
+
+        self.batch = []
+        self.batch_started = None
+        self.batch_seq = 0
+
+        self.collection_cache = collection_cache
+        # set when collection was skipped thanks to the master's collection cache
+        self.lazy_collection = False
+        # test modules of the cached collection, collected when the first test is run
+        self.cached_modules = None
 
         self.quit_signaled = False
 
     def send_event(self, name, **kwargs):
         kwargs['_event_name'] = name
         self.log.trace("sending {} {!r}".format(name, kwargs))
+        if self.batch_reports:
+            return self._stream_event(kwargs)
         self.sock.send_json(kwargs)
-        recv = self.sock.recv_json()
+        return self._handle_reply(self.sock.recv_json())
+
+    def _handle_reply(self, recv):
         if recv == 'die':
             self.log.info('Slave instructed to die by master; shutting down')
             raise SystemExit()
+        elif isinstance(recv, dict) and 'release' in recv:
+            # the master is stealing tests for an idle slave
+            self.release_tests(recv['release'])
         else:
             self.log.trace('received "{!r}" from master'.format(recv))
             if recv != 'ack':
                 return recv
 
+    def _stream_event(self, event):
+        # handle release requests the master sent since the last event
+        while self.sock.poll(0):
+            self._handle_reply(self._recv())
+
+        if event['_event_name'] in BATCHED_EVENTS:
+            if not self.batch:
+                self.batch_started = time()
+            self.batch.append(event)
+            if (event['_event_name'] in FLUSHED_EVENTS or len(self.batch) >= BATCH_SIZE or
+                    time() - self.batch_started >= BATCH_INTERVAL):
+                self.flush()
+            return
+
+        # everything queued so far has to reach the master first
+        self.flush()
+        self._send(event)
+        if event['_event_name'] == 'need_tests':
+            while True:
+                recv = self._recv()
+                if isinstance(recv, dict):
+                    # a release request sent before the master got need_tests
+                    self._handle_reply(recv)
+                else:
+                    return self._handle_reply(recv)
+
+    def flush(self):
+        """Send the queued events to the master as one batch"""
+        if not self.batch:
+            return
+        self.batch_seq += 1
+        self._send({'_event_name': 'batch', 'seq': self.batch_seq, 'events': self.batch})
+        self.batch = []
+
+    def _send(self, event):
+        # the pid lets the master drop messages from a process it already considers dead
+        event['_pid'] = os.getpid()
+        self.sock.send_multipart(['', json.dumps(event)])
+
+    def _recv(self):
+        return json.loads(self.sock.recv_multipart()[-1])
+
     def message(self, message, **kwargs):
         """Send a message to the master, which should get printed to the console"""
         self.send_event('message', message=message, markup=kwargs)  # message!
 
+    def pytest_collection(self, session):
+        """pytest collection hook
+
+        - Skips the collection if the master's collection cache is still valid, and sends the
+          cached collection to the master instead; the cached test modules are then collected
+          when the master sends the first tests
+
+        """
+        if not self.collection_cache:
+            return
+        node_ids = load_collection_cache(self.config)
+        if node_ids is None:
+            self.log.info('collection cache is outdated, collecting all tests')
+            return
+        self.log.debug('using the collection cache')
+        self.session = session
+        self.collection = {}
+        self.lazy_collection = True
+        self.cached_modules = sorted(set(nodeid.split('::')[0] for nodeid in node_ids))
+        terminalreporter.disable()
+        self.send_event("collectionfinish", node_ids=node_ids)
+        return True
+
     def pytest_collection_finish(self, session):
         """pytest collection hook
 
         - Sends collected tests to the master for comparison
 
         """
+        if self.lazy_collection:
+            # a test module was collected on demand, the master already has the collection
+            return
         self.log.debug('collection finished')
         self.session = session
         self.collection = {item.nodeid: item for item in session.items}
@@ -64,7 +180,8 @@ class SlaveManager(object):
         - sends logstart notice to the master
 
         """
-        self.send_event("runtest_logstart", nodeid=nodeid, location=location)
+        self.send_event(
+            "runtest_logstart", nodeid=nodeid, location=location, remaining=len(self.queue))
 
     def pytest_runtest_logreport(self, report):
         """pytest runtest logreport hook
@@ -73,6 +190,9 @@ class SlaveManager(object):
 
         """
         self.send_event("runtest_logreport", report=serialize_report(report))
+        if self.batch_reports and report.when == 'teardown':
+            # a finished test is a good point to let the master catch up
+            self.flush()
 
     def pytest_internalerror(self, excrepr):
         """pytest internal error hook
@@ -107,6 +227,13 @@ class SlaveManager(object):
     def pytest_sessionfinish(self):
         self.shutdown()
 
+    def release_tests(self, count):
+        """Give up to ``count`` not yet started tests at the end of the queue to the master"""
+        released = [self.queue.pop() for _ in range(min(count, len(self.queue)))]
+        released.reverse()
+        self.log.info('releasing {} tests to the master'.format(len(released)))
+        self.send_event('released_tests', node_ids=released)
+
     def handle_quit(self):
         self.message('shutting down after the current test due to QUIT signal')
         self.quit_signaled = True
@@ -117,22 +244,44 @@ class SlaveManager(object):
         self.quit_signaled = True
 
     def _test_generator(self):
-        node_iter = self._iter_nodes()
-        run_node = next(node_iter)
-
-        for next_node in node_iter:
-            yield run_node, next_node
+        run_node = None
+        for next_node in self._iter_nodes():
+            if run_node is not None:
+                yield run_node, next_node
             run_node = next_node
-        yield run_node, None
+        if run_node is not None:
+            yield run_node, None
 
     def _iter_nodes(self):
         while True:
             node_ids = self.send_event('need_tests')
+            if node_ids == 'retry':
+                # tests are being stolen for this slave, run the last queued test and ask again
+                yield None
+                continue
             if not node_ids:
                 break
-            for nodeid in node_ids:
+            self.queue.extend(node_ids)
+            while self.queue:
                 # TODO: take non-unique node ids into account
-                yield self.collection[nodeid]
+                yield self._get_item(self.queue.popleft())
+
+    def _get_item(self, nodeid):
+        if self.cached_modules:
+            # collect all modules at once, every collection fires the session-wide
+            # collection hooks of all plugins
+            modules, self.cached_modules = self.cached_modules, None
+            self.log.debug('collecting {} cached test modules'.format(len(modules)))
+            items = self.session.perform_collect(
+                [str(self.config.rootdir.join(fspath)) for fspath in modules])
+            self.collection.update((item.nodeid, item) for item in items)
+        if nodeid not in self.collection and self.lazy_collection:
+            # the modules' collection differs from the master's, fall back to collecting all
+            self.log.warning('{} not collected from its module, collecting all tests'
+                .format(nodeid))
+            items = self.session.perform_collect()
+            self.collection.update((item.nodeid, item) for item in items)
+        return self.collection[nodeid]
 
 
 def serialize_report(rep):
@@ -152,6 +301,56 @@ def serialize_report(rep):
     return d
 
 
+def _collection_sources(rootdir, node_ids):
+    # map the test modules and the conftests above them to their mtimes, None if missing
+    sources = {}
+    for fspath in set(nodeid.split('::')[0] for nodeid in node_ids):
+        module = rootdir.join(fspath)
+        conftests = [path.join('conftest.py') for path in module.parts()[:-1]
+                     if path == rootdir or path.relto(rootdir)]
+        for path in [module] + conftests:
+            source = path.relto(rootdir)
+            if source not in sources:
+                sources[source] = path.mtime() if path.check() else None
+    return sources
+
+
+def _config_hash(args):
+    # the yaml configuration affects testgen and uncollectif, the slave config changes every run
+    # imported here, the slave has to set up its logger before utils modules are imported
+    from utils.path import conf_path
+    digest = hashlib.sha1(json.dumps(args))
+    for path in sorted(conf_path.listdir(lambda path: path.ext in ('.yaml', '.eyaml'))):
+        if path.basename != 'slave_config.yaml':
+            digest.update(path.read('rb'))
+    return digest.hexdigest()
+
+
+def save_collection_cache(config, node_ids):
+    """Store the master's collection for the slaves in the pytest cache
+
+    Node ids carry the parametrization of the collected tests, and uncollected tests are
+    left out of them. The mtimes of the test modules and conftests, and a hash of the yaml
+    configuration are stored along with them to tell whether the collection is still valid.
+
+    """
+    config.cache.set(COLLECTION_CACHE_KEY, {
+        'node_ids': node_ids,
+        'sources': _collection_sources(config.rootdir, node_ids),
+        'config_hash': _config_hash(config.args),
+    })
+
+
+def load_collection_cache(config):
+    """Get the node ids stored by :py:func:`save_collection_cache`, None if they're outdated"""
+    cached = config.cache.get(COLLECTION_CACHE_KEY, None)
+    if not cached or cached['config_hash'] != _config_hash(config.args):
+        return None
+    if cached['sources'] != _collection_sources(config.rootdir, cached['node_ids']):
+        return None
+    return cached['node_ids']
+
+
 def _init_config(slave_options, slave_args):
     # Create a pytest Config based on options/args parsed in the master
     # This is a slightly modified form of _pytest.config.Config.fromdictargs
@@ -205,7 +404,8 @@ if __name__ == '__main__':
         conf.runtime["cfme_data"]["basic_info"]["appliances_provider"] = provider_name
     config = _init_config(slave_options, slave_args)
     slave_manager = SlaveManager(config, args.slaveid, args.base_url,
-        conf.slave_config['zmq_endpoint'])
+        conf.slave_config['zmq_endpoint'], conf.slave_config.get('batch_reports', False),
+        conf.slave_config.get('collection_cache', False))
     config.pluginmanager.register(slave_manager, 'slave_manager')
     config.hook.pytest_cmdline_main(config=config)
     signal.signal(signal.SIGQUIT, slave_manager.handle_quit)
@@ -21,4 +21,5 @@ def pytest_sessionfinish(session, exitstatus):
     for session in ssh._client_session:
         with diaper:
             session.close()
+    ssh.ssh_pool.close_all()
     yield
@@ -39,16 +39,19 @@ Post-testing (``pytest_unconfigure`` hook):
 1. Poll ``thing_toucher`` to make sure it completed; block if needed.
 2. Stop EVM, but nicely this time so the coverage atexit hooks run:
    ``systemctl stop evmserverd``
-3. Run ``coverage_merger.rb`` with the rails runner, which compiles all the individual process
-   reports and runs coverage again, additionally creating an rcov report
-4. Pull the coverage dir back for parsing and archiving
-5. For fun: Read the results from ``coverage/.last_run.json`` and print it to the test terminal/log
+3. Pull the coverage dir back for archiving
+4. Merge the individual process reports from the archive locally with
+   :py:class:`utils.simplecov.SimplecovMerger`, which writes ``merged/.resultset.json`` and
+   ``merged/.last_run.json`` to the coverage output dir
+5. For fun: Read the results from ``merged/.last_run.json`` and print it to the test
+   terminal/log
 
 Post-testing (e.g. ci environment):
 1. Use the generated rcov report with the ruby stats plugin to get a coverage graph
 2. Zip up and archive the entire coverage dir for review
 
 """
+import json
 import subprocess
 from threading import Thread
 
@@ -58,8 +61,9 @@ from py.path import local
 
 from fixtures.pytest_store import store
 from utils import conf, version
-from utils.log import create_sublogger
+from utils.log import create_sublogger, logger
 from utils.path import conf_path, log_path, scripts_data_path
+from utils.simplecov import SimplecovMerger
 from utils.wait import wait_for, TimedOutError
 
 # paths to all of the coverage-related files
@@ -80,6 +84,7 @@ coverage_merger = coverage_data.join('coverage_merger.rb')
 thing_toucher = coverage_data.join('thing_toucher.rb')
 coverage_output_dir = log_path.join('coverage')
 coverage_results_archive = coverage_output_dir.join('coverage-results.tgz')
+coverage_merged_dir = coverage_output_dir.join('merged')
 coverage_appliance_conf = conf_path.join('.ui-coverage')
 
 # This is set in sessionfinish, and should be reliably readable
@@ -154,14 +159,10 @@ class CoverageManager(object):
         self.print_message('merging reports')
         try:
             self._retrieve_coverage_reports()
-            # If the appliance runs out of memory, these can take *days* to complete,
-            # so for now we'll just collect the raw coverage data and figure the merging
-            # out later
-            # Edit, 10-Feb-2016:
-            # Currently, the reports are merged using the {stream}-reports job
-            # which utilizes the 'jjb/scripts/stream_reporter.sh' script instead
-            # self._merge_coverage_reports()
-            # self._retrieve_merged_reports()
+            # Merging on the appliance with coverage_merger.rb can take *days* if the appliance
+            # runs out of memory, so the raw reports are merged here instead. The html report
+            # can be generated from the merged resultset later, eg. by the {stream}-reports job.
+            self._merge_retrieved_reports()
         except Exception as exc:
             self.log.error('Error merging coverage reports')
             self.log.exception(exc)
@@ -253,6 +254,19 @@ class CoverageManager(object):
             'tar czf /tmp/ui-coverage-raw.tgz coverage/')
         ssh_client.get_file('/tmp/ui-coverage-raw.tgz', coverage_results_archive.strpath)
 
+    def _merge_retrieved_reports(self):
+        # Fold the per-process resultsets from the raw archive into one, streaming the archive
+        merger = SimplecovMerger()
+        merged = merger.add_archive(coverage_results_archive.strpath)
+        if not merged:
+            self.print_message('no reports found for merging')
+            return
+        coverage_merged_dir.ensure(dir=True)
+        merger.write_resultset(coverage_merged_dir.join('.resultset.json').strpath)
+        merger.write_last_run(coverage_merged_dir.join('.last_run.json').strpath)
+        self.print_message('merged {} reports, {}% covered'.format(
+            merged, merger.summary['covered_percent']))
+
     def _merge_coverage_reports(self):
         # run the merger on the appliance to generate the simplecov report
         # This has been failing, presumably due to oom errors :(
@@ -305,23 +319,22 @@ class UiCoveragePlugin(object):
         # on master/standalone, merge all the collected reports and bring them back
         manager().merge()
 
-# TODO
-# When the coverage reporting breaks out, we'll want to have this handy,
-# so I'm commenting it out instead of outright deleting it :)
-#         try:
-#             global ui_coverage_percent
-#             last_run = json.load(log_path.join('coverage', 'merged', '.last_run.json').open())
-#             ui_coverage_percent = last_run['result']['covered_percent']
-#             style = {'bold': True}
-#             if ui_coverage_percent > 40:
-#                 style['green'] = True
-#             else:
-#                 style['red'] = True
-#             store.write_line('UI Coverage Result: {}%'.format(ui_coverage_percent),
-#                 **style)
-#         except Exception as ex:
-#             logger.error('Error printing coverage report to terminal')
-#             logger.exception(ex)
+        if not coverage_merged_dir.join('.last_run.json').check():
+            return
+        try:
+            global ui_coverage_percent
+            last_run = json.load(coverage_merged_dir.join('.last_run.json').open())
+            ui_coverage_percent = last_run['result']['covered_percent']
+            style = {'bold': True}
+            if ui_coverage_percent > 40:
+                style['green'] = True
+            else:
+                style['red'] = True
+            store.write_line('UI Coverage Result: {}%'.format(ui_coverage_percent),
+                **style)
+        except Exception as ex:
+            logger.error('Error printing coverage report to terminal')
+            logger.exception(ex)
 
 
 def pytest_addoption(parser):
@@ -0,0 +1,65 @@
+#!/usr/bin/env python2
+
+"""Attach or detach appliances of a running parallel test session
+
+The master of a parallel session listens on a control socket, which is written to
+conf/slave_config.yaml together with the rest of the slave config.
+
+Examples:
+
+    parallel_control.py list
+    parallel_control.py add https://10.0.0.5/ --template cfme-58-0101 --provider rhos11
+    parallel_control.py remove https://10.0.0.3/
+    parallel_control.py remove https://10.0.0.3/ --force
+
+"""
+import argparse
+import json
+import sys
+
+import zmq
+
+from utils import conf
+
+
+def main():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timeout', default=30, type=int,
+        help='Seconds to wait for the master to answer, default 30')
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('list', help='list the slaves of the session')
+
+    add = subparsers.add_parser('add', help='attach an appliance to the session')
+    add.add_argument('url', help='URL of the appliance, e.g. "https://ip_or_host/"')
+    add.add_argument('--template', default=None,
+        help='Sprout template the appliance was provisioned from')
+    add.add_argument('--provider', default=None,
+        help='Provider the appliance was provisioned on')
+
+    remove = subparsers.add_parser('remove', help='detach an appliance from the session')
+    remove.add_argument('url', help='URL of the appliance, e.g. "https://ip_or_host/"')
+    remove.add_argument('--force', action='store_true', default=False,
+        help='Interrupt the slave now instead of letting it finish its current test')
+
+    args = parser.parse_args()
+    command = {key: value for key, value in vars(args).items() if key != 'timeout'}
+
+    ctx = zmq.Context.instance()
+    sock = ctx.socket(zmq.REQ)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.connect(conf.slave_config['control_endpoint'])
+    sock.send_json(command)
+    if not sock.poll(args.timeout * 1000):
+        print('No answer from the parallel session master')
+        return 1
+    reply = sock.recv_json()
+    if 'error' in reply:
+        print('Error: {}'.format(reply['error']))
+        return 1
+    print(json.dumps(reply['result'], indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
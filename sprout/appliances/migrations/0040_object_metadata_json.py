@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import yaml
+
+from django.db import migrations
+
+import appliances.models
+
+
+MODELS = [
+    'appliance', 'appliancepool', 'delayedprovisiontask', 'group', 'groupshepherd', 'provider',
+    'template']
+
+
+def metadata_forwards(apps, schema_editor):
+    for model_name in MODELS:
+        model = apps.get_model('appliances', model_name)
+        for obj in model.objects.using(schema_editor.connection.alias).all():
+            obj.object_metadata = yaml.load(obj.object_meta_data) or {}
+            obj.save()
+
+
+def metadata_backwards(apps, schema_editor):
+    for model_name in MODELS:
+        model = apps.get_model('appliances', model_name)
+        for obj in model.objects.using(schema_editor.connection.alias).all():
+            obj.object_meta_data = yaml.dump(obj.object_metadata)
+            obj.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appliances', '0039_auto_20170403_0918'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name=model_name,
+            name='object_metadata',
+            field=appliances.models.JSONField(default=dict),
+        )
+        for model_name in MODELS
+    ] + [
+        migrations.RunPython(metadata_forwards, metadata_backwards),
+    ] + [
+        migrations.RemoveField(
+            model_name=model_name,
+            name='object_meta_data',
+        )
+        for model_name in MODELS
+    ]
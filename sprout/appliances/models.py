@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import base64
+import json
 import re
-import yaml
+import threading
 
 try:
     import cPickle as pickle
@@ -14,11 +15,13 @@ from cached_property import cached_property
 from celery import chain
 from contextlib import contextmanager
 from datetime import timedelta, date
+from django import forms
 from django.contrib.auth.models import User, Group as DjangoGroup
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.db import models, transaction
-from django.db.models import Q
-from django.db.models.signals import pre_save
+from django.db.models import Case, Count, IntegerField, Q, Sum, Transform, Value, When
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 
@@ -57,10 +60,124 @@ def apply_if_not_none(o, meth, *args, **kwargs):
     return getattr(o, meth)(*args, **kwargs)
 
 
+# How many rows are written by a single UPDATE in bulk_update
+BULK_UPDATE_BATCH_SIZE = 100
+
+
+def bulk_update(objects, fields, batch_size=BULK_UPDATE_BATCH_SIZE):
+    """Writes the fields of already saved model instances using one UPDATE per batch.
+
+    Args:
+        objects: List of instances of the same model.
+        fields: Names of the fields to write.
+        batch_size: How many rows to write with one UPDATE.
+    Returns:
+        Number of updated rows.
+    """
+    if not objects or not fields:
+        return 0
+    model = type(objects[0])
+    updated = 0
+    for i in range(0, len(objects), batch_size):
+        batch = objects[i:i + batch_size]
+        values = {}
+        for field_name in fields:
+            field = model._meta.get_field(field_name)
+            values[field.attname] = Case(
+                *[
+                    When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field))
+                    for obj in batch],
+                output_field=field)
+        updated += model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+    return updated
+
+
+class JSONFormField(forms.CharField):
+    widget = forms.Textarea
+
+    def prepare_value(self, value):
+        if isinstance(value, basestring):
+            return value
+        return json.dumps(value, indent=2, sort_keys=True)
+
+    def to_python(self, value):
+        value = super(JSONFormField, self).to_python(value)
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise ValidationError("Enter a valid JSON.")
+
+
+class JSONKeyTransform(Transform):
+    """Text value of a top-level key of a :py:class:`JSONField`. Only works on PostgreSQL."""
+    output_field = models.TextField()
+
+    def __init__(self, key_name, *args, **kwargs):
+        super(JSONKeyTransform, self).__init__(*args, **kwargs)
+        self.key_name = key_name
+
+    def as_sql(self, compiler, connection):
+        if connection.vendor != 'postgresql':
+            raise NotImplementedError("JSON key lookups are supported only on PostgreSQL")
+        lhs, params = compiler.compile(self.lhs)
+        return "({} ->> %s)".format(lhs), list(params) + [self.key_name]
+
+
+class JSONKeyTransformFactory(object):
+    def __init__(self, key_name):
+        self.key_name = key_name
+
+    def __call__(self, *args, **kwargs):
+        return JSONKeyTransform(self.key_name, *args, **kwargs)
+
+
+class JSONField(models.TextField):
+    """Field holding JSON serializable data.
+
+    It is a ``jsonb`` column on PostgreSQL, so it can be queried by the top-level keys
+    (eg. ``object_metadata__temporary_name="foo"``), and a text column elsewhere. The value is
+    decoded once, when the row is loaded.
+    """
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'jsonb'
+        return super(JSONField, self).db_type(connection)
+
+    def from_db_value(self, value, expression, connection, context):
+        # psycopg2 decodes jsonb on its own
+        if isinstance(value, basestring):
+            return json.loads(value)
+        return value
+
+    def to_python(self, value):
+        if isinstance(value, basestring):
+            return json.loads(value)
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return json.dumps(value)
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj))
+
+    def get_transform(self, name):
+        transform = super(JSONField, self).get_transform(name)
+        if transform is not None:
+            return transform
+        return JSONKeyTransformFactory(name)
+
+    def formfield(self, **kwargs):
+        defaults = {'form_class': JSONFormField}
+        defaults.update(kwargs)
+        return super(JSONField, self).formfield(**defaults)
+
+
 class MetadataMixin(models.Model):
     class Meta:
         abstract = True
-    object_meta_data = models.TextField(default=yaml.dump({}))
+    object_metadata = JSONField(default=dict)
     created_on = models.DateTimeField(default=timezone.now, editable=False)
     modified_on = models.DateTimeField(default=timezone.now)
 
@@ -79,33 +196,35 @@ class MetadataMixin(models.Model):
         new_self = type(self).objects.get(pk=self.pk)
         self.__dict__.update(new_self.__dict__)
 
-    @property
-    @contextmanager
-    def metadata_lock(self):
-        with critical_section("metadata-({})[{}]".format(type(self).__name__, str(self.pk))):
-            yield
-
     @property
     def metadata(self):
-        return yaml.load(self.object_meta_data)
+        return self.object_metadata
 
     @metadata.setter
     def metadata(self, value):
         if not isinstance(value, dict):
             raise TypeError("You can store only dict in metadata!")
-        self.object_meta_data = yaml.dump(value)
+        self.object_metadata = value
 
     @property
     @contextmanager
     def edit_metadata(self):
+        """Edits the metadata as they are in the database. The row is locked for the duration of
+        the block and only the metadata get written back."""
         with transaction.atomic():
-            with self.metadata_lock:
-                o = type(self).objects.get(pk=self.pk)
-                metadata = o.metadata
-                yield metadata
-                o.metadata = metadata
-                o.save()
-        self.reload()
+            objects = type(self).objects
+            metadata = objects.select_for_update().values_list(
+                'object_metadata', flat=True).get(pk=self.pk)
+            yield metadata
+            modified_on = timezone.now()
+            objects.filter(pk=self.pk).update(object_metadata=metadata, modified_on=modified_on)
+        self.object_metadata = metadata
+        self.modified_on = modified_on
+
+    def update_metadata(self, **values):
+        """Atomically sets the passed metadata keys, the other keys are left untouched."""
+        with self.edit_metadata as metadata:
+            metadata.update(values)
 
     @property
     def logger(self):
@@ -128,6 +247,61 @@ class DelayedProvisionTask(MetadataMixin):
             self.provider_to_avoid.id if self.provider_to_avoid is not None else "---")
 
 
+class ProviderCapacity(object):
+    """Snapshot of the capacity counters of all providers.
+
+    The counters are fetched with two aggregate queries for all the providers at once. While a
+    snapshot is activated with :py:meth:`snapshot`, the capacity properties of :py:class:`Provider`
+    read from it instead of querying the database per provider.
+    """
+    _active = threading.local()
+
+    def __init__(self):
+        self.provisioning = {}
+        self.managing = {}
+        self.templates_preparing = {}
+        self.refresh()
+
+    def refresh(self):
+        provisioning = Case(
+            When(ready=False, marked_for_deletion=False, ip_address=None, then=1),
+            default=0, output_field=IntegerField())
+        appliances = Appliance.objects.order_by().values('template__provider').annotate(
+            managing=Count('id'), provisioning=Sum(provisioning))
+        self.managing = {row['template__provider']: row['managing'] for row in appliances}
+        self.provisioning = {
+            row['template__provider']: row['provisioning'] or 0 for row in appliances}
+        templates = Template.objects.filter(ready=False).order_by().values('provider').annotate(
+            preparing=Count('id'))
+        self.templates_preparing = {row['provider']: row['preparing'] for row in templates}
+
+    def appliance_added(self, provider_id):
+        """Account for an appliance that was created on the provider after the snapshot was taken,
+        so the subsequent scheduling decisions see the provider as loaded."""
+        self.managing[provider_id] = self.managing.get(provider_id, 0) + 1
+        self.provisioning[provider_id] = self.provisioning.get(provider_id, 0) + 1
+
+    @classmethod
+    def current(cls):
+        """Returns the active snapshot or None."""
+        return getattr(cls._active, 'capacity', None)
+
+    @classmethod
+    @contextmanager
+    def snapshot(cls):
+        """Activates a capacity snapshot for the duration of the block. Nested blocks reuse the
+        outer snapshot."""
+        capacity = cls.current()
+        if capacity is not None:
+            yield capacity
+            return
+        capacity = cls._active.capacity = cls()
+        try:
+            yield capacity
+        finally:
+            cls._active.capacity = None
+
+
 class Provider(MetadataMixin):
     id = models.CharField(max_length=32, primary_key=True, help_text="Provider's key in YAML.")
     working = models.BooleanField(default=False, help_text="Whether provider is available.")
@@ -196,13 +370,19 @@ class Provider(MetadataMixin):
 
     @property
     def num_currently_provisioning(self):
-        return len(
-            Appliance.objects.filter(
-                ready=False, marked_for_deletion=False, template__provider=self, ip_address=None))
+        capacity = ProviderCapacity.current()
+        if capacity is not None:
+            return capacity.provisioning.get(self.id, 0)
+        return Appliance.objects.filter(
+            ready=False, marked_for_deletion=False, template__provider=self,
+            ip_address=None).count()
 
     @property
     def num_templates_preparing(self):
-        return len(Template.objects.filter(provider=self, ready=False))
+        capacity = ProviderCapacity.current()
+        if capacity is not None:
+            return capacity.templates_preparing.get(self.id, 0)
+        return Template.objects.filter(provider=self, ready=False).count()
 
     @property
     def remaining_configuring_slots(self):
@@ -222,7 +402,10 @@ class Provider(MetadataMixin):
 
     @property
     def num_currently_managing(self):
-        return len(Appliance.objects.filter(template__provider=self))
+        capacity = ProviderCapacity.current()
+        if capacity is not None:
+            return capacity.managing.get(self.id, 0)
+        return Appliance.objects.filter(template__provider=self).count()
 
     @property
     def currently_managed_appliances(self):
@@ -288,8 +471,7 @@ class Provider(MetadataMixin):
 
     @templates.setter
     def templates(self, value):
-        with self.edit_metadata as metadata:
-            metadata["templates"] = value
+        self.update_metadata(templates=value)
 
     @property
     def template_name_length(self):
@@ -297,8 +479,7 @@ class Provider(MetadataMixin):
 
     @template_name_length.setter
     def template_name_length(self, value):
-        with self.edit_metadata as metadata:
-            metadata["template_name_length"] = value
+        self.update_metadata(template_name_length=value)
 
     @property
     def appliances_manage_this_provider(self):
@@ -306,8 +487,7 @@ class Provider(MetadataMixin):
 
     @appliances_manage_this_provider.setter
     def appliances_manage_this_provider(self, value):
-        with self.edit_metadata as metadata:
-            metadata["appliances_manage_this_provider"] = value
+        self.update_metadata(appliances_manage_this_provider=value)
 
     @property
     def g_appliances_manage_this_provider(self):
@@ -603,8 +783,7 @@ class Template(MetadataMixin):
 
     @temporary_name.setter
     def temporary_name(self, name):
-        with self.edit_metadata as metadata:
-            metadata["temporary_name"] = name
+        self.update_metadata(temporary_name=name)
 
     @temporary_name.deleter
     def temporary_name(self):
@@ -1032,8 +1211,7 @@ class Appliance(MetadataMixin):
 
     @managed_providers.setter
     def managed_providers(self, value):
-        with self.edit_metadata as metadata:
-            metadata["managed_providers"] = value
+        self.update_metadata(managed_providers=value)
 
     @property
     def vnc_link(self):
@@ -1043,6 +1221,69 @@ class Appliance(MetadataMixin):
             return None
 
 
+# Fields that decide whether an appliance or a template counts in a shepherd
+SHEPHERD_FIELDS = {
+    'Appliance': ('template_id', 'appliance_pool_id', 'ready', 'marked_for_deletion'),
+    'Template': ('template_group_id', 'ready', 'usable', 'exists', 'preconfigured', 'container'),
+}
+# Seconds to wait before running the shepherd, so a burst of changes is handled by one run
+SHEPHERD_KICK_DELAY = 5
+
+
+def kick_shepherd(*group_ids):
+    """Marks the template groups for the shepherd and schedules it once the current transaction
+    commits."""
+    group_ids = [group_id for group_id in group_ids if group_id is not None]
+    if not group_ids:
+        return
+
+    def kick():
+        redis.mark_shepherd_groups(*group_ids)
+        if cache.add("shepherd-kick", 'true', SHEPHERD_KICK_DELAY):
+            from appliances.tasks import free_appliance_shepherd
+            free_appliance_shepherd.apply_async(countdown=SHEPHERD_KICK_DELAY)
+    transaction.on_commit(kick)
+
+
+def shepherd_state(instance):
+    # Looking into __dict__ so deferred fields do not get loaded
+    return tuple(
+        instance.__dict__.get(field) for field in SHEPHERD_FIELDS[type(instance).__name__])
+
+
+def shepherd_group_id(instance):
+    if isinstance(instance, Template):
+        return instance.template_group_id
+    return Template.objects.filter(id=instance.template_id).values_list(
+        'template_group', flat=True).first()
+
+
+@receiver(post_init, sender=Appliance)
+@receiver(post_init, sender=Template)
+def remember_shepherd_state(sender, instance, **kwargs):
+    instance._shepherd_state = shepherd_state(instance)
+
+
+@receiver(post_save, sender=Appliance)
+@receiver(post_save, sender=Template)
+def shepherd_state_changed(sender, instance, created, **kwargs):
+    state = shepherd_state(instance)
+    if created or state != instance._shepherd_state:
+        instance._shepherd_state = state
+        kick_shepherd(shepherd_group_id(instance))
+
+
+@receiver(post_delete, sender=Appliance)
+@receiver(post_delete, sender=Template)
+def shepherd_object_deleted(sender, instance, **kwargs):
+    kick_shepherd(shepherd_group_id(instance))
+
+
+@receiver(post_save, sender=GroupShepherd)
+def shepherd_changed(sender, instance, **kwargs):
+    kick_shepherd(instance.template_group_id)
+
+
 class AppliancePool(MetadataMixin):
     total_count = models.IntegerField(help_text="How many appliances should be in this pool.")
     group = models.ForeignKey(
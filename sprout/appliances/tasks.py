@@ -28,7 +28,7 @@ import socket
 
 from appliances.models import (
     Provider, Group, Template, Appliance, AppliancePool, DelayedProvisionTask,
-    MismatchVersionMailer, User, GroupShepherd)
+    MismatchVersionMailer, User, GroupShepherd, ProviderCapacity, bulk_update)
 from sprout import settings, redis
 from sprout.irc_bot import send_message
 from sprout.log import create_logger
@@ -57,6 +57,9 @@ VERSION_REGEXPS = [
 VERSION_REGEXPS = map(re.compile, VERSION_REGEXPS)
 VERSION_REGEXP_UPSTREAM = re.compile(r'^miq-stable-([^-]+)-')
 TRACKERBOT_PAGINATE = 20
+# Appliance fields that refresh_appliances_provider synchronizes with the provider
+APPLIANCE_SYNC_FIELDS = (
+    'name', 'uuid', 'ip_address', 'power_state', 'power_state_changed', 'swap', 'ssh_failed')
 
 
 def retrieve_cfme_appliance_version(template_name):
@@ -142,6 +145,16 @@ def singleton_task(*args, **kwargs):
     return f
 
 
+def with_provider_capacity(task):
+    """Runs the task with a :py:class:`appliances.models.ProviderCapacity` snapshot active, so the
+    provider capacity checks in the scheduling loop do not hit the database per provider."""
+    @wraps(task)
+    def wrapped_task(self, *args, **kwargs):
+        with ProviderCapacity.snapshot():
+            return task(self, *args, **kwargs)
+    return wrapped_task
+
+
 @singleton_task()
 def kill_unused_appliances(self):
     """This is the watchdog, that guards the appliances that were given to users. If you forget
@@ -640,6 +653,7 @@ def apply_lease_times_after_pool_fulfilled(self, appliance_pool_id, time_minutes
 
 
 @singleton_task()
+@with_provider_capacity
 def process_delayed_provision_tasks(self):
     """This picks up the provisioning tasks that were delayed due to ocncurrency limit of provision.
 
@@ -713,6 +727,9 @@ def clone_template_to_pool(template_id, appliance_pool_id, time_minutes):
         new_appliance_name = "{}_{}".format(pool.owner.username, new_appliance_name)
         appliance = Appliance(template=template, name=new_appliance_name, appliance_pool=pool)
         appliance.save()
+        capacity = ProviderCapacity.current()
+        if capacity is not None:
+            capacity.appliance_added(template.provider_id)
         # Set pool to these params to keep the appliances with same versions/dates
         pool.version = template.version
         pool.date = template.date
@@ -1081,7 +1098,13 @@ def refresh_appliances_provider(self, provider_id):
         dict_vms[vm.name] = vm
         if vm.uuid:
             uuid_vms[vm.uuid] = vm
-    for appliance in Appliance.objects.filter(template__provider=provider):
+    changed_appliances = []
+    changed_fields = set()
+    orphaned = 0
+    appliances = Appliance.objects.filter(template__provider=provider).select_related(
+        'template__provider')
+    for appliance in appliances:
+        original = {field: getattr(appliance, field) for field in APPLIANCE_SYNC_FIELDS}
         if appliance.uuid is not None and appliance.uuid in uuid_vms:
             vm = uuid_vms[appliance.uuid]
             # Using the UUID and change the name if it changed
@@ -1089,7 +1112,6 @@ def refresh_appliances_provider(self, provider_id):
             appliance.ip_address = vm.ip
             appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
                 vm.power_state, Appliance.Power.UNKNOWN))
-            appliance.save()
         elif appliance.name in dict_vms:
             vm = dict_vms[appliance.name]
             # Using the name, and then retrieve uuid
@@ -1097,13 +1119,34 @@ def refresh_appliances_provider(self, provider_id):
             appliance.ip_address = vm.ip
             appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
                 vm.power_state, Appliance.Power.UNKNOWN))
-            appliance.save()
-            self.logger.info("Retrieved UUID for appliance {}/{}: {}".format(
-                appliance.id, appliance.name, appliance.uuid))
+            if appliance.uuid != original['uuid']:
+                self.logger.info("Retrieved UUID for appliance {}/{}: {}".format(
+                    appliance.id, appliance.name, appliance.uuid))
         else:
             # Orphaned :(
             appliance.set_power_state(Appliance.Power.ORPHANED)
-            appliance.save()
+            orphaned += 1
+        changed = [
+            field for field in APPLIANCE_SYNC_FIELDS
+            if getattr(appliance, field) != original[field]]
+        if changed:
+            appliance.modified_on = timezone.now()
+            changed_appliances.append(appliance)
+            changed_fields.update(changed)
+    if changed_appliances:
+        with transaction.atomic():
+            updated = bulk_update(
+                changed_appliances, sorted(changed_fields) + ['modified_on'])
+    else:
+        updated = 0
+    stats = {
+        'appliances': len(appliances), 'changed': len(changed_appliances), 'updated': updated,
+        'orphaned': orphaned, 'fields': sorted(changed_fields), 'refreshed_on': timezone.now()}
+    redis.set('refresh_appliances_provider-{}'.format(provider_id), stats)
+    self.logger.info(
+        "Refreshed appliances in {}: {} appliances, {} changed ({}), {} orphaned".format(
+            provider_id, stats['appliances'], stats['changed'],
+            ", ".join(stats['fields']) or "nothing", orphaned))
 
 
 @singleton_task()
@@ -1126,8 +1169,7 @@ def check_templates_in_provider(self, provider_id):
     else:
         provider.working = True
         provider.save()
-        with provider.edit_metadata as metadata:
-            metadata["templates"] = templates
+        provider.update_metadata(templates=templates)
     if not provider.working:
         return
     # Check Sprout template existence
@@ -1186,13 +1228,24 @@ def delete_nonexistent_appliances(self):
         Appliance.kill(appliance, force_delete=True)
 
 
-def generic_shepherd(self, preconfigured):
+@with_provider_capacity
+def generic_shepherd(self, preconfigured, group_ids=None):
     """This task takes care of having the required templates spinned into required number of
     appliances. For each template group, it keeps the last template's appliances spinned up in
     required quantity. If new template comes out of the door, it automatically kills the older
-    running template's appliances and spins up new ones. Sorts the groups by the fulfillment."""
-    for gs in sorted(
-            GroupShepherd.objects.all(), key=lambda g: g.get_fulfillment_percentage(preconfigured)):
+    running template's appliances and spins up new ones. Sorts the groups by the fulfillment.
+
+    Groups whose deficit could not be provisioned completely, because the providers are full,
+    are marked again so the next run retries them.
+
+    Args:
+        preconfigured: Whether to take care of the configured or unconfigured appliances.
+        group_ids: Template groups to evaluate, all of them if not specified.
+    """
+    shepherds = GroupShepherd.objects.all()
+    if group_ids is not None:
+        shepherds = shepherds.filter(template_group__in=group_ids)
+    for gs in sorted(shepherds, key=lambda g: g.get_fulfillment_percentage(preconfigured)):
         prov_filter = {'provider__user_groups': gs.user_group}
         group_versions = Template.get_versions(
             template_group=gs.template_group, ready=True, usable=True, preconfigured=preconfigured,
@@ -1248,26 +1301,35 @@ def generic_shepherd(self, preconfigured):
         pool_size = gs.template_pool_size if preconfigured else gs.unconfigured_template_pool_size
         if len(appliances) < pool_size and possible_templates_for_provision:
             # There must be some templates in order to run the provisioning
-            # Provision ONE appliance at time for each group, that way it is possible to maintain
-            # reasonable balancing
-            new_appliance_name = settings.APPLIANCE_FORMAT.format(
-                group=template.template_group.id,
-                date=template.date.strftime("%y%m%d"),
-                rnd=fauxfactory.gen_alphanumeric(8))
+            # Provision the whole deficit at once. Each appliance goes to the least loaded free
+            # provider, the capacity snapshot accounts for the appliances created here.
+            capacity = ProviderCapacity.current()
+            new_appliances = []
             with transaction.atomic():
-                # Now look for templates that are on non-busy providers
-                tpl_free = filter(
-                    lambda t: t.provider.free,
-                    possible_templates_for_provision)
-                if tpl_free:
+                for _ in range(pool_size - len(appliances)):
+                    # Now look for templates that are on non-busy providers
+                    tpl_free = filter(
+                        lambda t: t.provider.free,
+                        possible_templates_for_provision)
+                    if not tpl_free:
+                        break
+                    template = sorted(tpl_free, key=lambda t: t.provider.appliance_load)[0]
                     appliance = Appliance(
-                        template=sorted(tpl_free, key=lambda t: t.provider.appliance_load)[0],
-                        name=new_appliance_name)
+                        template=template,
+                        name=settings.APPLIANCE_FORMAT.format(
+                            group=template.template_group.id,
+                            date=template.date.strftime("%y%m%d"),
+                            rnd=fauxfactory.gen_alphanumeric(8)))
                     appliance.save()
-            if tpl_free:
+                    capacity.appliance_added(template.provider_id)
+                    new_appliances.append(appliance)
+            for appliance in new_appliances:
                 self.logger.info(
                     "Adding an appliance to shepherd: {}/{}".format(appliance.id, appliance.name))
                 clone_template_to_appliance.delay(appliance.id, None)
+            if len(appliances) + len(new_appliances) < pool_size:
+                # Providers freeing up do not mark the group, so retry it on the next run
+                redis.mark_shepherd_groups(gs.template_group_id)
         elif len(appliances) > pool_size:
             # Too many appliances, kill the surplus
             # Only kill those that are visible only for one group. This is necessary so the groups
@@ -1294,8 +1356,29 @@ def generic_shepherd(self, preconfigured):
 
 @singleton_task()
 def free_appliance_shepherd(self):
-    generic_shepherd(self, True)
-    generic_shepherd(self, False)
+    """Evaluates the shepherds of the template groups that changed since the last run, or of all
+    the groups once in ``SHEPHERD_FULL_RESCAN``. The groups get marked by the appliance, template
+    and group shepherd signals in :py:mod:`appliances.models`."""
+    group_ids = redis.pop_shepherd_groups()
+    state = redis.get("shepherd_state") or {}
+    now = timezone.now()
+    if (
+            state.get("full_rescan") is None or
+            now - state["full_rescan"] > timedelta(**settings.SHEPHERD_FULL_RESCAN)):
+        evaluate_group_ids = None
+        state["full_rescan"] = now
+    elif group_ids:
+        evaluate_group_ids = group_ids
+    else:
+        return
+    try:
+        generic_shepherd(self, True, evaluate_group_ids)
+        generic_shepherd(self, False, evaluate_group_ids)
+    except Exception:
+        # Let the next run pick the groups up again
+        redis.mark_shepherd_groups(*group_ids)
+        raise
+    redis.set("shepherd_state", state)
 
 
 @singleton_task()
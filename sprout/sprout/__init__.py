@@ -97,6 +97,19 @@ class RedisWrapper(object):
     def renaming_appliances(self):
         return self.get("renaming_appliances") or set([])
 
+    def mark_shepherd_groups(self, *group_ids):
+        """Marks the template groups whose shepherd needs to be re-evaluated."""
+        if group_ids:
+            self.client.sadd("shepherd_dirty_groups", *group_ids)
+
+    def pop_shepherd_groups(self):
+        """Returns the marked template groups and clears the marks."""
+        pipeline = self.client.pipeline()
+        pipeline.smembers("shepherd_dirty_groups")
+        pipeline.delete("shepherd_dirty_groups")
+        group_ids, _ = pipeline.execute()
+        return set(group_ids)
+
 
 redis = RedisWrapper(redis_client)
 sprout_path = project_path.join("sprout")
@@ -164,6 +164,11 @@ ORPHANED_APPLIANCE_GRACE_TIME = dict(
     minutes=45,
 )
 
+# The shepherd normally evaluates only the groups that changed, this forces evaluating all of them
+SHEPHERD_FULL_RESCAN = dict(
+    minutes=10,
+)
+
 # Celery beat
 CELERYBEAT_SCHEDULE = {
     'check-templates': {
@@ -847,9 +847,12 @@ class IPAppliance(object):
             value = None
         return value
 
-    def event_listener(self):
-        """Returns an instance of the event listening class pointed to this appliance."""
-        return EventListener(self)
+    def event_listener(self, **kwargs):
+        """Returns an instance of the event listening class pointed to this appliance.
+
+        Keyword arguments are passed to :py:class:`utils.events.EventListener`.
+        """
+        return EventListener(self, **kwargs)
 
     def diagnose_evm_failure(self):
         """Go through various EVM processes, trying to figure out what fails
@@ -1872,10 +1875,24 @@ class IPAppliance(object):
             self.log.exception(exc)
             return self.address
 
+    @cached_property
+    def db_schema_key(self):
+        """Identifies the database schema of the appliance for caching the reflected tables.
+
+        None on upstream appliances, the schema of those can change without the build changing.
+        """
+        try:
+            if self.build == 'master':
+                return None
+            return '{}-{}'.format(self.version, self.build)
+        except Exception as exc:
+            self.log.warning('Unable to determine the database schema key: %s', exc)
+            return None
+
     @cached_property
     def db(self):
         # slightly crappy: anything that changes self.db_address should also del(self.db)
-        return db.Db(self.db_address)
+        return db.Db(self.db_address, schema_key=self.db_schema_key)
 
     @property
     def is_db_enabled(self):
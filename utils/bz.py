@@ -1,15 +1,28 @@
 # -*- coding: utf-8 -*-
+import os
 import re
+import tempfile
+import time
 from bugzilla import Bugzilla as _Bugzilla
 from collections import Sequence
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from cached_property import cached_property
 from utils.conf import cfme_data, credentials
 from utils.log import logger
+from utils.path import project_path
 from utils.version import (
     LATEST, Version, current_version, appliance_build_datetime, appliance_is_downstream)
 
 NONE_FIELDS = {"---", "undefined", "unspecified"}
+# Where the bugs get cached on the disk, shared by all processes of a (parallelized) test run
+BUG_CACHE_DIR = project_path.join(".cache", "bugzilla").strpath
+# How many seconds a bug in the disk cache stays fresh
+BUG_CACHE_TTL = 60 * 60
 
 
 class Product(object):
@@ -45,9 +58,51 @@ class Product(object):
         return self.versions[-1]
 
 
+class BugCache(object):
+    """Disk cache of the bugs, one pickle per bug id.
+
+    The files are replaced atomically so the cache can be used by several processes at once.
+
+    Args:
+        path: Directory of the cache.
+        ttl: How many seconds a cached bug stays fresh.
+    """
+    def __init__(self, path, ttl=BUG_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    def _file(self, bug_id):
+        return os.path.join(self.path, "{}.pickle".format(bug_id))
+
+    def get(self, bug_id):
+        """Returns the cached bug or None if it is not cached or it is stale."""
+        bug_file = self._file(bug_id)
+        try:
+            if time.time() - os.path.getmtime(bug_file) > self.ttl:
+                return None
+            with open(bug_file, "rb") as f:
+                return pickle.load(f)
+        except (EnvironmentError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, bug_id, bug):
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            fd, tmp_file = tempfile.mkstemp(prefix=".{}-".format(bug_id), dir=self.path)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(bug, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, self._file(bug_id))
+        except (EnvironmentError, pickle.PicklingError) as e:
+            logger.warning("Could not cache bug %s: %s", bug_id, e)
+
+
 class Bugzilla(object):
     def __init__(self, **kwargs):
         self.__product = kwargs.pop("product", None)
+        cache_dir = kwargs.pop("cache_dir", None)
+        cache_ttl = kwargs.pop("cache_ttl", BUG_CACHE_TTL)
+        self.__disk_cache = BugCache(cache_dir, cache_ttl) if cache_dir else None
         self.__kwargs = kwargs
         self.__bug_cache = {}
         self.__product_cache = {}
@@ -86,7 +141,9 @@ class Bugzilla(object):
         password = credentials.get(cr_root, {}).get("password", None)
         return cls(
             url=url, user=username, password=password, cookiefile=None,
-            tokenfile=None, product=product)
+            tokenfile=None, product=product,
+            cache_dir=cfme_data.get("bugzilla", {}).get("cache_dir", BUG_CACHE_DIR),
+            cache_ttl=cfme_data.get("bugzilla", {}).get("cache_ttl", BUG_CACHE_TTL))
 
     @cached_property
     def bugzilla(self):
@@ -107,11 +164,69 @@ class Bugzilla(object):
         else:
             return Version(cfme_data.get("bugzilla", {}).get("upstream_version", "9.9"))
 
+    def _cached_bug(self, id):
+        """Looks the bug up in the memory and the disk cache."""
+        if id in self.__bug_cache:
+            return self.__bug_cache[id]
+        if self.__disk_cache is None:
+            return None
+        bug = self.__disk_cache.get(id)
+        if bug is None:
+            return None
+        # The connection is not pickled with the bug
+        bug.bugzilla = self.bugzilla
+        self.__bug_cache[id] = BugWrapper(self, bug)
+        return self.__bug_cache[id]
+
+    def _cache_bug(self, bug):
+        if self.__disk_cache is not None:
+            self.__disk_cache.set(bug.id, bug)
+        self.__bug_cache[bug.id] = BugWrapper(self, bug)
+        return self.__bug_cache[bug.id]
+
     def get_bug(self, id):
         id = int(id)
-        if id not in self.__bug_cache:
-            self.__bug_cache[id] = BugWrapper(self, self.bugzilla.getbug(id))
-        return self.__bug_cache[id]
+        bug = self._cached_bug(id)
+        if bug is None:
+            bug = self._cache_bug(self.bugzilla.getbug(id))
+        return bug
+
+    def get_bugs(self, ids):
+        """Returns multiple bugs, the ones that are not cached are fetched by one ``getbugs`` call.
+
+        Args:
+            ids: Iterable of bug ids.
+        Returns:
+            Dictionary of bug id and :py:class:`BugWrapper`. Bugs that do not exist or cannot be
+            accessed are left out.
+        """
+        ids = set(map(int, ids))
+        missing = [id for id in ids if self._cached_bug(id) is None]
+        if missing:
+            for bug in self.bugzilla.getbugs(missing, permissive=True):
+                if bug is not None:
+                    self._cache_bug(bug)
+        return {id: self.__bug_cache[id] for id in ids if id in self.__bug_cache}
+
+    def prefetch_bugs(self, ids):
+        """Fetches the bugs and the bugs they refer to (duplicates, clones and blocked bugs that
+        may be their copies) with two ``getbugs`` calls, so resolving the blockers does not
+        query the bugs one by one.
+
+        Args:
+            ids: Iterable of bug ids.
+        Returns:
+            Number of bugs cached.
+        """
+        bugs = self.get_bugs(ids)
+        related = set([])
+        for bug in bugs.itervalues():
+            for ref in (getattr(bug, "dupe_of", None), bug.copy_of):
+                if ref:
+                    related.add(ref)
+            related.update(getattr(bug, "blocks", None) or [])
+        bugs.update(self.get_bugs(related))
+        return len(bugs)
 
     def get_bug_variants(self, id):
         if isinstance(id, BugWrapper):
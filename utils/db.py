@@ -1,36 +1,112 @@
-from collections import Mapping
+import os
+import tempfile
+import time
+from collections import Counter, Mapping, defaultdict
 from contextlib import contextmanager
 from itertools import izip
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from cached_property import cached_property
 from sqlalchemy import MetaData, create_engine, event, inspect
 from sqlalchemy.exc import ArgumentError, DisconnectionError, InvalidRequestError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import Pool
 
 from fixtures.pytest_store import store
-from utils import conf, ports
+from utils import at_exit, conf, ports
 from utils.log import logger
+from utils.path import project_path
+
+# Where the reflected schemas get cached, shared by all processes of a (parallelized) test run
+SCHEMA_CACHE_DIR = project_path.join('.cache', 'db_schema')
+
+# Connection pool settings, can be overridden by the db_pool section of env.yaml or per Db
+POOL_DEFAULTS = {
+    # When to check the connection with SELECT 1 on checkout: 'always' (pessimistic), 'idle'
+    # (when it was not used for ping_idle_time seconds) or 'never'
+    'pre_ping': 'idle',
+    'ping_idle_time': 30,
+    'size': 5,
+    'max_overflow': 10,
+    # Seconds after which the connections are replaced, -1 to keep them
+    'recycle': -1,
+}
+
+#: Counters of checkouts, pings, reconnects and connects per database host
+pool_stats = defaultdict(Counter)
+
+
+def pool_options(**overrides):
+    """Returns the pool settings, :py:data:`POOL_DEFAULTS` updated from env.yaml and overrides"""
+    options = dict(POOL_DEFAULTS)
+    options.update(conf.env.get('db_pool', {}))
+    options.update(overrides)
+    if options['pre_ping'] not in {'always', 'idle', 'never'}:
+        raise ValueError('Unknown pre_ping mode {!r}'.format(options['pre_ping']))
+    return options
+
 
+def ping_connection(dbapi_connection, connection_record, stats, pre_ping='always',
+        ping_idle_time=0):
+    """ping_connection checkout hook, used to reconnect db sessions that time out
 
-@event.listens_for(Pool, "checkout")
-def ping_connection(dbapi_connection, connection_record, connection_proxy):
-    """ping_connection event hook, used to reconnect db sessions that time out
+    With ``pre_ping='idle'`` only the connections that were not used for ``ping_idle_time``
+    seconds are checked.
 
     Note:
 
         See also: :ref:`Connection Invalidation <sqlalchemy:pool_connection_invalidation>`
 
     """
+    stats['checkouts'] += 1
+    if pre_ping == 'never':
+        return
+    if pre_ping == 'idle':
+        last_used = connection_record.info.get('last_used')
+        if last_used is not None and time.time() - last_used < ping_idle_time:
+            return
+    stats['pings'] += 1
     cursor = dbapi_connection.cursor()
     try:
         cursor.execute("SELECT 1")
     except StandardError:
+        stats['reconnects'] += 1
         raise DisconnectionError
     cursor.close()
 
 
+def install_pool_health_check(pool, stats, pre_ping='idle', ping_idle_time=0):
+    """Hooks the connection checks and usage tracking to the pool of an engine"""
+    @event.listens_for(pool, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        stats['connects'] += 1
+        connection_record.info['last_used'] = time.time()
+
+    @event.listens_for(pool, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        ping_connection(dbapi_connection, connection_record, stats, pre_ping, ping_idle_time)
+
+    @event.listens_for(pool, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        connection_record.info['last_used'] = time.time()
+
+
+def log_pool_stats():
+    """Logs the pool counters of all the databases used by this process"""
+    for hostname, stats in sorted(pool_stats.items()):
+        logger.info(
+            '[DB] pool of %s: %d checkouts, %d pings, %d reconnects, %d connects',
+            hostname, stats['checkouts'], stats['pings'], stats['reconnects'],
+            stats['connects'])
+
+
+at_exit(log_pool_stats)
+
+
 class Db(Mapping):
     """Helper class for interacting with a CFME database using SQLAlchemy
 
@@ -38,6 +114,10 @@ class Db(Mapping):
         hostname: base url to be used (default is from current_appliance)
         credentials: name of credentials to use from :py:attr:`utils.conf.credentials`
             (default ``database``)
+        schema_key: identifies the database schema, eg. the appliance version and build. If
+            specified, the reflected tables are cached on the disk under this key and reused
+            by all Db objects with the same key, across processes.
+        pool: overrides of the connection pool settings, see :py:data:`POOL_DEFAULTS`
 
     Provides convient attributes to common sqlalchemy objects related to this DB,
     as well as a Mapping interface to access and reflect database tables. Where possible,
@@ -66,10 +146,11 @@ class Db(Mapping):
         Creating a table object requires a call to the database so that SQLAlchemy can do
         reflection to determine the table's structure (columns, keys, indices, etc). On
         a latent connection, this can be extremely slow, which will affect methods that return
-        tables, like the mapping interface or :py:meth:`values`.
+        tables, like the mapping interface or :py:meth:`values`. Pass ``schema_key`` to reflect
+        each table only once per schema.
 
     """
-    def __init__(self, hostname=None, credentials=None):
+    def __init__(self, hostname=None, credentials=None, schema_key=None, pool=None):
         self._table_cache = {}
         if hostname is None:
             self.hostname = store.current_appliance.db_address
@@ -77,6 +158,8 @@ class Db(Mapping):
             self.hostname = hostname
 
         self.credentials = credentials or conf.credentials['database']
+        self.schema_key = schema_key
+        self.pool_options = pool_options(**(pool or {}))
 
     def __getitem__(self, table_name):
         """Access tables as items contained in this db
@@ -135,7 +218,7 @@ class Db(Mapping):
 
     def copy(self):
         """Copy this database instance, keeping the same credentials and hostname"""
-        return type(self)(self.hostname, self.credentials)
+        return type(self)(self.hostname, self.credentials, self.schema_key, self.pool_options)
 
     def __eq__(self, other):
         """Check if this db is equal to another db"""
@@ -152,11 +235,19 @@ class Db(Mapping):
     def engine(self):
         """The :py:class:`Engine <sqlalchemy:sqlalchemy.engine.Engine>` for this database
 
-        It uses pessimistic disconnection handling, checking that the database is still
-        connected before executing commands.
+        Depending on the ``pre_ping`` pool setting, it checks that the database is still
+        connected before executing commands, either always (pessimistic disconnection handling)
+        or only for connections that were idle for a while.
 
         """
-        return create_engine(self.db_url, echo_pool=True)
+        options = self.pool_options
+        engine = create_engine(
+            self.db_url, echo_pool=True, pool_size=options['size'],
+            max_overflow=options['max_overflow'], pool_recycle=options['recycle'])
+        install_pool_health_check(
+            engine.pool, pool_stats[self.hostname], options['pre_ping'],
+            options['ping_idle_time'])
+        return engine
 
     @cached_property
     def sessionmaker(self):
@@ -188,7 +279,62 @@ class Db(Mapping):
             use :py:meth:`reflect_table`.
 
         """
-        return MetaData(bind=self.engine)
+        metadata = self._schema_cache.get('metadata')
+        if metadata is None:
+            return MetaData(bind=self.engine)
+        metadata.bind = self.engine
+        return metadata
+
+    @property
+    def _schema_cache_file(self):
+        if self.schema_key is None:
+            return None
+        return SCHEMA_CACHE_DIR.join('{}.pickle'.format(self.schema_key))
+
+    def _read_schema_cache(self):
+        """Reads the cached schema, a dictionary with ``metadata`` and ``table_names``"""
+        cache_file = self._schema_cache_file
+        if cache_file is None or not cache_file.check():
+            return {}
+        try:
+            with cache_file.open('rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.warning('[DB] Could not read the schema cache %s: %s', cache_file, e)
+            return {}
+
+    @cached_property
+    def _schema_cache(self):
+        return self._read_schema_cache()
+
+    def _write_schema_cache(self):
+        """Writes the reflected tables and table names to the schema cache
+
+        Tables cached by other processes in the meantime are kept.
+        """
+        cache_file = self._schema_cache_file
+        if cache_file is None:
+            return
+        cached = self._read_schema_cache()
+        if cached.get('metadata') is not None:
+            for table_name, table in cached['metadata'].tables.items():
+                if table_name not in self.metadata.tables:
+                    table.tometadata(self.metadata)
+        if 'table_names' in self.__dict__:
+            table_names = self.table_names
+        else:
+            table_names = cached.get('table_names')
+        try:
+            cache_file.dirpath().ensure(dir=True)
+            fd, tmp_file = tempfile.mkstemp(
+                prefix='.{}-'.format(cache_file.basename), dir=cache_file.dirname)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(
+                    {'metadata': self.metadata, 'table_names': table_names}, f,
+                    pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, cache_file.strpath)
+        except Exception as e:
+            logger.warning('[DB] Could not write the schema cache %s: %s', cache_file, e)
 
     @cached_property
     def db_url(self):
@@ -202,7 +348,12 @@ class Db(Mapping):
     def table_names(self):
         """A sorted list of table names available in this database."""
         # rails table names follow similar rules as pep8 identifiers; expose them as such
-        return sorted(inspect(self.engine).get_table_names())
+        table_names = self._schema_cache.get('table_names')
+        if table_names is None:
+            table_names = sorted(inspect(self.engine).get_table_names())
+            self.__dict__['table_names'] = table_names
+            self._write_schema_cache()
+        return table_names
 
     @cached_property
     def session(self):
@@ -248,7 +399,10 @@ class Db(Mapping):
             table_name: The name of a table to reflect
 
         """
+        if table_name in self.metadata.tables:
+            return
         self.metadata.reflect(only=[table_name])
+        self._write_schema_cache()
 
     def _table(self, table_name):
         """Retrieves, reflects, and caches table objects
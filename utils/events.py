@@ -4,19 +4,53 @@
 
 """
 
+import select
+import uuid
+
 from cached_property import cached_property
 from contextlib import contextmanager
-from collections import Iterable
+from collections import Iterable, defaultdict
 from datetime import datetime
 from numbers import Number
 from sqlalchemy.sql.expression import func
-from time import sleep
-from threading import Thread, Event as ThreadEvent
+from threading import Thread, Event as ThreadEvent, Lock
+
+import psycopg2
 
 from utils.log import create_sublogger
 
 logger = create_sublogger('events')
 
+# Polling intervals (seconds) of the listener. The interval doubles while nothing comes in and
+# drops back to the minimum as soon as a new event shows up.
+POLL_INTERVAL_MIN = 0.1
+POLL_INTERVAL_MAX = 2.0
+# Maximum number of event_streams rows fetched by one query
+PORTION_SIZE = 500
+# Columns which are always fetched, the rest is fetched only if some expected event checks it
+BASE_COLUMNS = ('id', 'event_type', 'target_type', 'target_id')
+# Attributes the expected events are indexed by
+INDEX_ATTRS = ('event_type', 'target_type')
+
+# Prefix of the LISTEN/NOTIFY channels, every listener gets its own channel and its own trigger
+# which notifies the channel about every new event_streams row
+NOTIFY_CHANNEL = 'cfme_tests_event_streams'
+NOTIFY_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION {channel}_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', NEW.id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER {channel}_trigger AFTER INSERT ON event_streams
+    FOR EACH ROW EXECUTE PROCEDURE {channel}_notify();
+"""
+# Removes the trigger and its function again when the listener stops
+NOTIFY_DROP_SQL = """
+DROP TRIGGER IF EXISTS {channel}_trigger ON event_streams;
+DROP FUNCTION IF EXISTS {channel}_notify();
+"""
+
 
 class EventTool(object):
     """EventTool serves as a wrapper to getting the events from the database.
@@ -215,6 +249,9 @@ class Event(object):
 
     def _parse_raw_event(self, evt):
         for attr in self._default_attrs:
+            if not hasattr(evt, attr):
+                # rows queried by column carry only the columns which were asked for
+                continue
             default_type = self._default_attrs[attr].type
             evt_value = getattr(evt, attr)
             evt_type = type(evt_value)
@@ -285,18 +322,41 @@ class Event(object):
             self._parse_raw_event(evt)
         return self
 
+    def build_from_row(self, row):
+        """
+        same as :py:meth:`build_from_raw_event` but takes a row of an event_streams column query,
+        only the queried columns end up in the event
+        """
+        self._parse_raw_event(row)
+        return self
+
 
 class EventListener(Thread):
     """
      accepts "expected" events, listens to db events and compares showed up events with expected
      events. Runs callback function if expected events have it.
+
+     By default the listener polls event_streams with a backoff between
+     :py:data:`POLL_INTERVAL_MIN` and :py:data:`POLL_INTERVAL_MAX`. With ``use_notify`` it installs
+     a trigger on the appliance's event_streams table and waits for postgres notifications
+     instead, falling back to polling if the trigger can't be set up. The trigger is dropped
+     again when the listener stops.
     """
-    def __init__(self, appliance):
+    def __init__(self, appliance, use_notify=False):
         super(EventListener, self).__init__()
+        self.daemon = True
         self._appliance = appliance
         self._tool = EventTool(self._appliance)
+        self.use_notify = use_notify
+        self._notify_conn = None
+        # listeners on the same appliance must not drop each other's triggers
+        self._notify_channel = '{}_{}'.format(NOTIFY_CHANNEL, uuid.uuid4().hex[:16])
 
         self._events_to_listen = []
+        # expected events keyed by (event_type, target_type), None stands for "any value"
+        self._index = defaultdict(list)
+        self._index_lock = Lock()
+        self._registered = 0
         # last_id is used to ignore already arrived messages the database
         # When database is "cleared" the id of the last event is placed here. That is then used
         # in queries to prevent events of this id and earlier to get in.
@@ -309,7 +369,7 @@ class EventListener(Thread):
         else:
             try:
                 self._last_processed_id = self._tool.query(
-                    func.max(self._tool.event_streams.id)).one()
+                    func.max(self._tool.event_streams.id)).scalar() or 0
             except IndexError:
                 # No events yet, so do nothing
                 pass
@@ -363,19 +423,96 @@ class EventListener(Thread):
             for evt in evts:
                 if isinstance(evt, Event):
                     logger.info("event {} is added to listening queue".format(evt))
-                    self._events_to_listen.append({'event': evt,
-                                                   'callback': callback,
-                                                   'matched_events': [],
-                                                   'first_event': first_event})
+                    exp_event = {'event': evt,
+                                 'callback': callback,
+                                 'matched_events': [],
+                                 'first_event': first_event}
+                    with self._index_lock:
+                        self._events_to_listen.append(exp_event)
+                        self._index[self._index_key(evt)].append((self._registered, exp_event))
+                        self._registered += 1
                 else:
                     raise ValueError("one of events doesn't belong to Event class")
         else:
             raise ValueError('incorrect is passed')
 
+    @staticmethod
+    def _index_key(evt):
+        """(event_type, target_type) of an expected event, None where it can match any value"""
+        key = []
+        for name in INDEX_ATTRS:
+            attr = evt.event_attrs.get(name)
+            if attr is None or attr.value is None or attr.cmp_func is not None:
+                key.append(None)
+            else:
+                key.append(attr.value)
+        return tuple(key)
+
+    def _candidates(self, row):
+        """expected events which may match the row, in the order they were registered"""
+        event_type, target_type = row.event_type, row.target_type
+        candidates = []
+        with self._index_lock:
+            for key in {(event_type, target_type), (event_type, None), (None, target_type),
+                        (None, None)}:
+                candidates.extend(self._index.get(key, []))
+        return [exp_event for _, exp_event in sorted(candidates, key=lambda c: c[0])]
+
+    def _columns(self):
+        """event_streams columns which have to be fetched to match the expected events"""
+        table = self._tool.event_streams
+        with self._index_lock:
+            if any(exp_event['callback'] for exp_event in self._events_to_listen):
+                # callbacks get the whole event
+                return [getattr(table, name) for name, _ in self._tool.event_streams_attributes]
+            names = set(BASE_COLUMNS)
+            for exp_event in self._events_to_listen:
+                names.update(exp_event['event'].event_attrs)
+        names.discard('target_name')
+        return [getattr(table, name) for name in sorted(names)]
+
+    def _setup_notify(self):
+        """installs the notify trigger and starts listening, returns whether it succeeded"""
+        try:
+            conn = psycopg2.connect(self._appliance.db.db_url)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor()
+            cursor.execute(NOTIFY_TRIGGER_SQL.format(channel=self._notify_channel))
+            cursor.execute('LISTEN {};'.format(self._notify_channel))
+        except psycopg2.Error as e:
+            logger.warning('Could not set up event notifications, polling instead: %s', e)
+            return False
+        self._notify_conn = conn
+        return True
+
+    def _teardown_notify(self):
+        """drops the notify trigger, so the appliance database is left as it was"""
+        if self._notify_conn is None:
+            return
+        try:
+            self._notify_conn.cursor().execute(
+                NOTIFY_DROP_SQL.format(channel=self._notify_channel))
+        except psycopg2.Error as e:
+            logger.warning('Could not drop the event notification trigger: %s', e)
+        finally:
+            self._notify_conn.close()
+            self._notify_conn = None
+
+    def _wait(self, timeout):
+        """waits for a notification if listening for them, for the whole timeout otherwise"""
+        if self._notify_conn is None:
+            self._stop_event.wait(timeout)
+            return
+        if select.select([self._notify_conn], [], [], timeout)[0]:
+            self._notify_conn.poll()
+            del self._notify_conn.notifies[:]
+
     def start(self):
         logger.info('Event Listener has been started')
         self.set_last_record()
         self._stop_event.clear()
+        if self.use_notify:
+            self._setup_notify()
         super(EventListener, self).start()
 
     def stop(self):
@@ -394,26 +531,39 @@ class EventListener(Thread):
         processes all new db events and compares them with expected events.
         processed events are ignored next time
         """
-        while not self._stop_event.is_set():
-            events = self.get_next_portion()
-            if len(events) == 0:
-                sleep(0.2)
-                continue
-            for got_event in events:
-                logger.debug("processing event id {}".format(got_event.id))
-                got_event = Event(event_tool=self._tool).build_from_raw_event(got_event)
-                for exp_event in self._events_to_listen:
-                    if exp_event['first_event'] and len(exp_event['matched_events']) > 0:
-                        continue
-
-                    if exp_event['event'].matches(got_event):
-                        if exp_event['callback']:
-                            exp_event['callback'](exp_event=exp_event['event'], got_event=got_event)
-                        exp_event['matched_events'].append(got_event)
-                self.set_last_record(got_event)
-
-                if self._stop_event.is_set():
-                    break
+        interval = POLL_INTERVAL_MIN
+        try:
+            while not self._stop_event.is_set():
+                rows = self.get_next_portion()
+                if len(rows) == 0:
+                    self._wait(interval)
+                    interval = min(interval * 2, POLL_INTERVAL_MAX)
+                    continue
+                interval = POLL_INTERVAL_MIN
+                for row in rows:
+                    logger.debug("processing event id {}".format(row.id))
+                    self.process_row(row)
+                    self._last_processed_id = row.id
+
+                    if self._stop_event.is_set():
+                        break
+        finally:
+            self._teardown_notify()
+
+    def process_row(self, row):
+        """
+        compares one event_streams row with the expected events it can match
+        """
+        candidates = [exp_event for exp_event in self._candidates(row)
+                      if not (exp_event['first_event'] and exp_event['matched_events'])]
+        if not candidates:
+            return
+        got_event = Event(event_tool=self._tool).build_from_row(row)
+        for exp_event in candidates:
+            if exp_event['event'].matches(got_event):
+                if exp_event['callback']:
+                    exp_event['callback'](exp_event=exp_event['event'], got_event=got_event)
+                exp_event['matched_events'].append(got_event)
 
     @property
     def got_events(self):
@@ -429,13 +579,15 @@ class EventListener(Thread):
             event['matched_events'] = []
 
     def reset_events(self):
-        self._events_to_listen = []
+        with self._index_lock:
+            self._events_to_listen = []
+            self._index = defaultdict(list)
 
     def get_next_portion(self):
         logger.debug("obtaining next portion of events")
-        return self._tool.query(self._tool.event_streams)\
+        return self._tool.query(*self._columns())\
             .filter(self._tool.event_streams.id > self._last_processed_id)\
-            .order_by(self._tool.event_streams.id).yield_per(100).all()
+            .order_by(self._tool.event_streams.id).limit(PORTION_SIZE).all()
 
     def check_expected_events(self):
         return all([len(event['matched_events']) for event in self.got_events])
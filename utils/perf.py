@@ -3,43 +3,100 @@ from fixtures.pytest_store import store
 from utils.ssh import SSHClient, SSHTail
 from utils.log import logger
 import numpy
+import os
 import time
 
+# Size of the chunks the current log is downloaded by in sync_logs
+SYNC_CHUNK_SIZE = 1024 * 1024
+
 
 def collect_log(ssh_client, log_prefix, local_file_name, strip_whitespace=False):
     """Collects all of the logs associated with a single log prefix (ex. evm or top_output) and
-    combines to single gzip log file.  The log file is then scp-ed back to the host.
+    combines to single gzip log file on the host.
+
+    The rotated logs and the current one are decompressed, concatenated, stripped of whitespace
+    if asked to and compressed again by a single remote pipeline, whose output is streamed
+    straight into the local file, so nothing is written to the appliance's disk.
     """
     log_dir = '/var/www/miq/vmdb/log/'
 
     log_file = '{}{}.log'.format(log_dir, log_prefix)
-    dest_file = '{}{}.perf.log'.format(log_dir, log_prefix)
-    dest_file_gz = '{}{}.perf.log.gz'.format(log_dir, log_prefix)
-
-    ssh_client.run_command('rm -f {}'.format(dest_file_gz))
+    if strip_whitespace:
+        strip = " | sed 's/^ *//; s/ *$//; /^$/d; /^\\s*$/d'"
+    else:
+        strip = ''
+    command = (
+        '(for lfile in $(ls -1 {log_file}-* 2>/dev/null | LC_ALL=C sort); do zcat -f "$lfile"; '
+        'done; cat {log_file}){strip} | gzip -c'.format(log_file=log_file, strip=strip))
+
+    starttime = time.time()
+    result = ssh_client.get_command_output(command, local_file_name)
+    timediff = time.time() - starttime
+    if result.rc != 0:
+        logger.error('Collecting %s logs failed: %s', log_prefix, result.output)
+    size = os.path.getsize(local_file_name)
+    logger.info('Collected %s logs, %d bytes in %.1f s (%.0f bytes/s)', log_prefix, size, timediff,
+        size / max(timediff, 0.001))
+
+
+def sync_logs(ssh_client, log_prefix, local_dir):
+    """Mirrors all of the logs associated with a single log prefix (ex. evm or top_output) to a
+    local directory, for an incremental analysis with
+    :py:func:`utils.perf_message_stats.perf_process_evm`.
+
+    Rotated logs already in the directory are not downloaded again and only what was appended to
+    the current log since the last sync is downloaded.
+
+    Returns: Paths of the local copies of the logs, oldest first
+    """
+    log_dir = '/var/www/miq/vmdb/log/'
+    log_file = '{}{}.log'.format(log_dir, log_prefix)
+    local_dir = str(local_dir)
+    if not os.path.isdir(local_dir):
+        os.makedirs(local_dir)
 
     status, out = ssh_client.run_command('ls -1 {}-*'.format(log_file))
-    if status == 0:
-        files = out.strip().split('\n')
-        for lfile in sorted(files):
-            ssh_client.run_command('cp {} {}-2.gz'.format(lfile, lfile))
-            ssh_client.run_command('gunzip {}-2.gz'.format(lfile))
-            if strip_whitespace:
-                ssh_client.run_command('sed -i  \'s/^ *//; s/ *$//; /^$/d; /^\s*$/d\' '
-                    '{}-2'.format(lfile))
-            ssh_client.run_command('cat {}-2 >> {}'.format(lfile, dest_file))
-            ssh_client.run_command('rm {}-2'.format(lfile))
-
-    ssh_client.run_command('cp {} {}-2'.format(log_file, log_file))
-    if strip_whitespace:
-        ssh_client.run_command('sed -i  \'s/^ *//; s/ *$//; /^$/d; /^\s*$/d\' '
-            '{}-2'.format(log_file))
-    ssh_client.run_command('cat {}-2 >> {}'.format(log_file, dest_file))
-    ssh_client.run_command('rm {}-2'.format(log_file))
-    ssh_client.run_command('gzip {}{}.perf.log'.format(log_dir, log_prefix))
-
-    ssh_client.get_file(dest_file_gz, local_file_name)
-    ssh_client.run_command('rm -f {}'.format(dest_file_gz))
+    rotated = sorted(out.strip().split('\n')) if status == 0 else []
+
+    local_files = []
+    sftp = ssh_client.open_sftp()
+    try:
+        for remote_file in rotated:
+            local_file = os.path.join(local_dir, os.path.basename(remote_file))
+            if not os.path.exists(local_file):
+                logger.info('Downloading %s', remote_file)
+                sftp.get(remote_file, '{}.part'.format(local_file))
+                os.rename('{}.part'.format(local_file), local_file)
+            local_files.append(local_file)
+
+        local_file = os.path.join(local_dir, os.path.basename(log_file))
+        offset = os.path.getsize(local_file) if os.path.exists(local_file) else 0
+        remote_size = sftp.stat(log_file).st_size
+        remote_log = sftp.open(log_file, 'r')
+        try:
+            if offset:
+                with open(local_file, 'rb') as local_log:
+                    local_first_line = local_log.readline()
+                if remote_size < offset or remote_log.readline() != local_first_line:
+                    logger.info('%s was rotated since the last sync', log_file)
+                    offset = 0
+            logger.info('Downloading %s from offset %s', log_file, offset)
+            remote_log.seek(offset)
+            with open(local_file, 'r+b' if offset else 'wb') as local_log:
+                local_log.seek(offset)
+                local_log.truncate()
+                while offset < remote_size:
+                    chunk = remote_log.read(min(SYNC_CHUNK_SIZE, remote_size - offset))
+                    if not chunk:
+                        break
+                    local_log.write(chunk)
+                    offset += len(chunk)
+        finally:
+            remote_log.close()
+        local_files.append(local_file)
+    finally:
+        sftp.close()
+    return local_files
 
 
 def convert_top_mem_to_mib(top_mem):
@@ -6,17 +6,37 @@ from utils.log import logger
 from utils.path import log_path
 from utils.perf import convert_top_mem_to_mib
 from utils.perf import generate_statistics
+from array import array
+from collections import OrderedDict
 from datetime import datetime
 import dateutil.parser as du_parser
 from datetime import timedelta
 from time import time
+import cPickle
 import csv
+import gzip
+import hashlib
+import multiprocessing
 import numpy
 import os
 import pygal
-import subprocess
 import re
 
+# Uncompressed logs are split into parts of about this size (bytes) which are parsed in parallel
+LOG_PART_SIZE = 256 * 1024 * 1024
+
+# int64 value of NaT (not a time) in datetime64 arrays
+NAT = numpy.iinfo(numpy.int64).min
+
+# Worker termination markers in evm.log, in the order they are checked, and the recorded reason
+WORKER_TERMINATIONS = OrderedDict([
+    ('evm_worker_uptime_exceeded', 'evm_worker_uptime_exceeded'),
+    ('evm_worker_memory_exceeded', 'evm_worker_memory_exceeded'),
+    ('evm_worker_stop', 'evm_worker_stop'),
+    ('Interrupt', 'Interrupted'),
+    ('Worker exiting.', 'Worker Exited'),
+])
+
 # Regular Expressions to capture relevant information from each log line:
 
 # [----] I, [2014-03-04T08:11:14.320377 #3450:b15814]  INFO -- : ....
@@ -59,182 +79,16 @@ miq_top = re.compile(r'([0-9]+)\s+[0-9]+\s+[A-Za-z0-9]+\s+[0-9]+\s+[0-9\-]+\s+([
     r'([0-9\.mg]+)\s+([0-9\.mg]+)\s+[SRDZ]\s+([0-9\.]+)\s+([0-9\.]+)')
 
 
-def evm_to_messages(evm_file, filters):
-    test_start = ''
-    test_end = ''
-    line_count = 0
-    messages = {}
-    msg_cmds = {}
+def evm_to_messages(evm_file, filters, processes=None):
+    (messages, ), line_count = parse_log(evm_file, [MessageAccumulator], processes)
+    messages.drop_orphans()
+    msg_cmds = messages_to_commands(messages.messages, filters)
+    return messages.messages, msg_cmds, messages.test_start, messages.test_end, line_count
 
-    runningtime = time()
-    evmlogfile = open(evm_file, 'r')
-    evm_log_line = evmlogfile.readline()
-    while evm_log_line:
-        line_count += 1
-        evm_log_line = evm_log_line.strip()
-
-        miqmsg_result = miqmsg.search(evm_log_line)
-        if miqmsg_result:
-
-            # Obtains the first timestamp in the log file
-            if test_start == '':
-                ts, pid = get_msg_timestamp_pid(evm_log_line)
-                test_start = ts
-
-            # A message was first put on the queue, this starts its queuing time
-            if (miqmsg_result.group(1) == 'MiqQueue.put'):
-
-                msg_cmd = get_msg_cmd(evm_log_line)
-                msg_id = get_msg_id(evm_log_line)
-                if msg_id:
-                    ts, pid = get_msg_timestamp_pid(evm_log_line)
-                    test_end = ts
-                    messages[msg_id] = MiqMsgStat()
-                    messages[msg_id].msg_id = msg_id
-                    messages[msg_id].msg_id = '\'' + msg_id + '\''
-                    messages[msg_id].msg_cmd = msg_cmd
-                    messages[msg_id].pid_put = pid
-                    messages[msg_id].puttime = ts
-                    msg_args = get_msg_args(evm_log_line)
-                    if msg_args is False:
-                        logger.debug('Could not obtain message args line #: %s', line_count)
-                    else:
-                        messages[msg_id].msg_args = msg_args
-                else:
-                    logger.error('Could not obtain message id, line #: %s', line_count)
-
-            elif (miqmsg_result.group(1) == 'MiqQueue.get_via_drb'):
-                msg_id = get_msg_id(evm_log_line)
-                if msg_id:
-                    if msg_id in messages:
-                        ts, pid = get_msg_timestamp_pid(evm_log_line)
-                        test_end = ts
-                        messages[msg_id].pid_get = pid
-                        messages[msg_id].gettime = ts
-                        messages[msg_id].deq_time = get_msg_deq(evm_log_line)
-                    else:
-                        logger.error('Message ID not in dictionary: %s', msg_id)
-                else:
-                    logger.error('Could not obtain message id, line #: %s', line_count)
-
-            elif (miqmsg_result.group(1) == 'MiqQueue.delivered'):
-                msg_id = get_msg_id(evm_log_line)
-                if msg_id:
-                    ts, pid = get_msg_timestamp_pid(evm_log_line)
-                    test_end = ts
-                    if msg_id in messages:
-                        messages[msg_id].del_time = get_msg_del(evm_log_line)
-                        messages[msg_id].total_time = messages[msg_id].deq_time + \
-                            messages[msg_id].del_time
-                    else:
-                        logger.error('Message ID not in dictionary: %s', msg_id)
-                else:
-                    logger.error('Could not obtain message id, line #: %s', line_count)
 
-        if (line_count % 100000) == 0:
-            timediff = time() - runningtime
-            runningtime = time()
-            logger.info('Count {} : Parsed 100000 lines in %s', line_count, timediff)
-
-        evm_log_line = evmlogfile.readline()
-
-    # I tried to avoid two loops but this reduced the complexity of filtering on messages.
-    # By filtering over messages, we can better display what is occuring under the covers, as a
-    # daily rollup is picked up off the queue different than a hourly rollup, etc
-    for msg in sorted(messages.keys()):
-        msg_args = messages[msg].msg_args
-        # Determine if the pattern matches and append to the command if it does
-        for p_filter in filters:
-            results = filters[p_filter].search(msg_args.strip())
-            if results:
-                messages[msg].msg_cmd = '{}{}'.format(messages[msg].msg_cmd, p_filter)
-                break
-        msg_cmd = messages[msg].msg_cmd
-        if msg_cmd not in msg_cmds:
-            msg_cmds[msg_cmd] = {}
-            msg_cmds[msg_cmd]['total'] = []
-            msg_cmds[msg_cmd]['queue'] = []
-            msg_cmds[msg_cmd]['execute'] = []
-        if messages[msg].total_time != 0:
-            msg_cmds[msg_cmd]['total'].append(round(messages[msg].total_time, 2))
-            msg_cmds[msg_cmd]['queue'].append(round(messages[msg].deq_time, 2))
-            msg_cmds[msg_cmd]['execute'].append(round(messages[msg].del_time, 2))
-
-    return messages, msg_cmds, test_start, test_end, line_count
-
-
-def evm_to_workers(evm_file):
-    # Use grep to reduce # of lines to sort through
-    p = subprocess.Popen(['grep', 'Interrupt\\|MIQ([A-Za-z]*) ID\\|"evm_worker_uptime_exceeded\\|'
-            '"evm_worker_memory_exceeded\\|"evm_worker_stop\\|Worker exiting.', evm_file],
-            stdout=subprocess.PIPE)
-    greppedevmlog, err = p.communicate()
-    greppedevmlog = greppedevmlog.strip()
-
-    evmlines = greppedevmlog.split('\n')
-
-    workers = {}
-    wkr_upt_exc = 0
-    wkr_mem_exc = 0
-    wkr_stp = 0
-    wkr_int = 0
-    wkr_ext = 0
-    for evm_log_line in evmlines:
-        ts, pid = get_msg_timestamp_pid(evm_log_line)
-
-        miqwkr_result = miqwkr.search(evm_log_line)
-        if miqwkr_result:
-            workerid = int(miqwkr_result.group(2))
-            if workerid not in workers:
-                workers[workerid] = MiqWorker()
-                workers[workerid].worker_type = miqwkr_result.group(1)
-                workers[workerid].pid = miqwkr_result.group(3)
-                workers[workerid].worker_id = int(workerid)
-                workers[workerid].start_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'evm_worker_uptime_exceeded' in evm_log_line:
-            miqwkr_id_result = miqwkr_id.search(evm_log_line)
-            if miqwkr_id_result:
-                workerid = int(miqwkr_id_result.group(1))
-                if workerid in workers:
-                    if not workers[workerid].terminated:
-                        wkr_upt_exc += 1
-                        workers[workerid].terminated = 'evm_worker_uptime_exceeded'
-                        workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'evm_worker_memory_exceeded' in evm_log_line:
-            miqwkr_id_result = miqwkr_id.search(evm_log_line)
-            if miqwkr_id_result:
-                workerid = int(miqwkr_id_result.group(1))
-                if workerid in workers:
-                    if not workers[workerid].terminated:
-                        wkr_mem_exc += 1
-                        workers[workerid].terminated = 'evm_worker_memory_exceeded'
-                        workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'evm_worker_stop' in evm_log_line:
-            miqwkr_id_result = miqwkr_id.search(evm_log_line)
-            if miqwkr_id_result:
-                workerid = int(miqwkr_id_result.group(1))
-                if workerid in workers:
-                    if not workers[workerid].terminated:
-                        wkr_stp += 1
-                        workers[workerid].terminated = 'evm_worker_stop'
-                        workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'Interrupt' in evm_log_line:
-            for workerid in workers:
-                if not workers[workerid].end_ts:
-                    wkr_int += 1
-                    workers[workerid].terminated = 'Interrupted'
-                    workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'Worker exiting.' in evm_log_line:
-            miqwkr_id_2_result = miqwkr_id_2.search(evm_log_line)
-            if miqwkr_id_2_result:
-                workerid = int(miqwkr_id_2_result.group(1))
-                if workerid in workers:
-                    if not workers[workerid].terminated:
-                        wkr_ext += 1
-                        workers[workerid].terminated = 'Worker Exited'
-                        workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-
-    return workers, wkr_mem_exc, wkr_upt_exc, wkr_stp, wkr_int, wkr_ext, len(evmlines)
+def evm_to_workers(evm_file, processes=None):
+    (workers, ), line_count = parse_log(evm_file, [WorkerAccumulator], processes)
+    return workers.replay() + (len(workers.events), )
 
 
 def split_appliance_charts(top_appliance, charts_dir):
@@ -394,11 +248,12 @@ def generate_worker_charts(workers, top_workers, charts_dir):
 
 def get_first_miqtop(top_log_file):
     # Find first miqtop log line
-    p = subprocess.Popen(['grep', '-m', '1', '^miqtop\:', top_log_file], stdout=subprocess.PIPE)
-    greppedtop, err = p.communicate()
-    str_start = greppedtop.index('is->')
-    miqtop_time = du_parser.parse(greppedtop[str_start:], fuzzy=True, ignoretz=True)
-    timezone_offset = int(greppedtop[str_start + 34:str_start + 37])
+    for top_line in iter_log_lines(top_log_file):
+        if top_line.startswith('miqtop:'):
+            break
+    str_start = top_line.index('is->')
+    miqtop_time = du_parser.parse(top_line[str_start:], fuzzy=True, ignoretz=True)
+    timezone_offset = int(top_line[str_start + 34:str_start + 37])
     miqtop_time = miqtop_time - timedelta(hours=timezone_offset)
     return miqtop_time, timezone_offset
 
@@ -453,6 +308,21 @@ def get_msg_timestamp_pid(log_line):
         return False, 0
 
 
+def group_rows(keys):
+    """Groups the rows of a column by value
+
+    Returns: A list of (value, indices of the rows with the value) pairs, sorted by value. The
+        indices keep their original order.
+    """
+    order = numpy.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    bounds = numpy.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    starts = numpy.concatenate(([0], bounds))
+    ends = numpy.concatenate((bounds, [len(keys)]))
+    return [(sorted_keys[start], order[start:end]) for start, end in zip(starts, ends)
+            if end > start]
+
+
 def hour_bucket_init(init):
     if init:
         return MiqMsgBucket()
@@ -460,6 +330,55 @@ def hour_bucket_init(init):
         return {}
 
 
+def hourly_statistics(cmd_ids, hours, values):
+    """Count, sum, minimum and maximum of values grouped by command and hour
+
+    The minimum is the smallest value which isn't zero, or zero if all of them are. When the
+    buckets were filled one message at a time, a zero became the minimum until a later value
+    replaced it, so the result depended on the order of the messages.
+
+    Returns: A list of ((cmd_id, 'YYYY-MM-DDTHH'), count, sum, minimum, maximum), messages
+        without the hour (NaT) are bucketed under ('', '')
+    """
+    if len(cmd_ids) == 0:
+        return []
+    # NaT is the smallest int64, unlike NaT it compares equal to itself
+    hours = hours.astype('datetime64[h]').view(numpy.int64)
+    order = numpy.lexsort((hours, cmd_ids))
+    cmd_ids, hours, values = cmd_ids[order], hours[order], values[order]
+    changes = (cmd_ids[1:] != cmd_ids[:-1]) | (hours[1:] != hours[:-1])
+    starts = numpy.concatenate(([0], numpy.flatnonzero(changes) + 1))
+    counts = numpy.diff(numpy.concatenate((starts, [len(values)])))
+    sums = numpy.add.reduceat(values, starts)
+    maximums = numpy.maximum.reduceat(values, starts)
+    minimums = numpy.minimum.reduceat(numpy.where(values == 0, numpy.inf, values), starts)
+    minimums[numpy.isinf(minimums)] = 0
+    statistics = []
+    for start, count, total, minimum, maximum in zip(starts, counts.tolist(), sums.tolist(),
+            minimums.tolist(), maximums.tolist()):
+        if hours[start] == NAT:
+            hour = ''
+        else:
+            hour = str(numpy.datetime64(int(hours[start]), 'h'))
+        statistics.append(((cmd_ids[start], hour), count, total, minimum, maximum))
+    return statistics
+
+
+def iter_log_lines(log_file, start=0, end=None):
+    """Yields the stripped lines of a log file which start between the start and end offsets"""
+    with open_log(log_file) as log:
+        position = start
+        if start > 0:
+            # The line crossing the start offset belongs to the previous part
+            log.seek(start - 1)
+            position = start - 1 + len(log.readline())
+        for log_line in iter(log.readline, ''):
+            if end is not None and position >= end:
+                break
+            position += len(log_line)
+            yield log_line.strip()
+
+
 def line_chart_render(title, xtitle, ytitle, x_labels, lines, fname, stacked=False):
     if stacked:
         line_chart = pygal.StackedLine()
@@ -478,75 +397,126 @@ def line_chart_render(title, xtitle, ytitle, x_labels, lines, fname, stacked=Fal
     line_chart.render_to_file(str(fname))
 
 
+def log_complete_size(log_file):
+    """Returns: Offset right after the last complete line of an uncompressed log, None for
+        gzipped logs, which are rotated and so complete
+    """
+    if str(log_file).endswith('.gz'):
+        return None
+    with open(str(log_file), 'rb') as log:
+        log.seek(0, os.SEEK_END)
+        size = log.tell()
+        position = size
+        while position > 0:
+            chunk_start = max(0, position - 65536)
+            log.seek(chunk_start)
+            newline = log.read(position - chunk_start).rfind('\n')
+            if newline >= 0:
+                return chunk_start + newline + 1
+            position = chunk_start
+    return 0
+
+
+def log_fingerprint(log_file):
+    """Identifies a log by the hash of its first line, which stays the same when it's rotated
+
+    Returns: The fingerprint or None if the log doesn't have a complete line yet
+    """
+    with open_log(log_file) as log:
+        first_line = log.readline()
+    if not first_line.endswith('\n'):
+        return None
+    return hashlib.sha1(first_line).hexdigest()
+
+
+def log_parts(log_file, processes=None, start=0, end=None):
+    """Splits a log file into (start, end) byte ranges of roughly :py:data:`LOG_PART_SIZE`
+
+    Compressed files can't be seeked in, so they are always parsed as one part.
+    """
+    if str(log_file).endswith('.gz'):
+        return [(start, end)]
+    if end is None:
+        end = os.path.getsize(str(log_file))
+    count = min(processes or multiprocessing.cpu_count(), (end - start) // LOG_PART_SIZE)
+    if count < 2:
+        return [(start, end)]
+    bounds = [start + (end - start) * i // count for i in range(count)] + [end]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def messages_to_commands(messages, filters):
+    messages.freeze()
+    # By filtering over messages, we can better display what is occuring under the covers, as a
+    # daily rollup is picked up off the queue different than a hourly rollup, etc
+    cmd_ids = messages.column('msg_cmd')
+    for row, msg_args in enumerate(messages.column('msg_args')):
+        # Determine if the pattern matches and append to the command if it does
+        for p_filter in filters:
+            results = filters[p_filter].search(msg_args.strip())
+            if results:
+                cmd_ids[row] = messages.command_id('{}{}'.format(
+                    messages.commands[cmd_ids[row]], p_filter))
+                break
+
+    msg_cmds = {}
+    order = messages.sorted_rows()
+    total_times = messages.column('total_time')[order]
+    deq_times = messages.column('deq_time')[order]
+    del_times = messages.column('del_time')[order]
+    timed = total_times != 0
+    for cmd_id, rows in group_rows(cmd_ids[order]):
+        rows = rows[timed[rows]]
+        msg_cmds[messages.commands[cmd_id]] = {
+            'total': [round(t, 2) for t in total_times[rows].tolist()],
+            'queue': [round(t, 2) for t in deq_times[rows].tolist()],
+            'execute': [round(t, 2) for t in del_times[rows].tolist()],
+        }
+    return msg_cmds
+
+
 def messages_to_hourly_buckets(messages, test_start, test_end):
+    messages.freeze()
     hr_bkt = {}
     # Hour buckets look like: hr_bkt[msg_cmd][msg_date][msg_hour] = MiqMsgBucket()
-    for msg in messages:
-        # put on queue, deals with queuing:
-        msg_cmd = messages[msg].msg_cmd
-        putdate = messages[msg].puttime[:10]
-        puthour = messages[msg].puttime[11:13]
-        if msg_cmd not in hr_bkt:
-            hr_bkt[msg_cmd] = provision_hour_buckets(test_start, test_end)
-
-        hr_bkt[msg_cmd][putdate][puthour].total_put += 1
-        hr_bkt[msg_cmd][putdate][puthour].sum_deq += messages[msg].deq_time
-        if (hr_bkt[msg_cmd][putdate][puthour].min_deq == 0 or
-                hr_bkt[msg_cmd][putdate][puthour].min_deq > messages[msg].deq_time):
-            hr_bkt[msg_cmd][putdate][puthour].min_deq = messages[msg].deq_time
-        if (hr_bkt[msg_cmd][putdate][puthour].max_deq == 0 or
-                hr_bkt[msg_cmd][putdate][puthour].max_deq < messages[msg].deq_time):
-            hr_bkt[msg_cmd][putdate][puthour].max_deq = messages[msg].deq_time
-        hr_bkt[msg_cmd][putdate][puthour].avg_deq = \
-            hr_bkt[msg_cmd][putdate][puthour].sum_deq / hr_bkt[msg_cmd][putdate][puthour].total_put
-
-        # Get time is when the message is delivered
-        getdate = messages[msg].gettime[:10]
-        gethour = messages[msg].gettime[11:13]
-
-        hr_bkt[msg_cmd][getdate][gethour].total_get += 1
-        hr_bkt[msg_cmd][getdate][gethour].sum_del += messages[msg].del_time
-        if (hr_bkt[msg_cmd][getdate][gethour].min_del == 0 or
-                hr_bkt[msg_cmd][getdate][gethour].min_del > messages[msg].del_time):
-            hr_bkt[msg_cmd][getdate][gethour].min_del = messages[msg].del_time
-        if (hr_bkt[msg_cmd][getdate][gethour].max_del == 0 or
-                hr_bkt[msg_cmd][getdate][gethour].max_del < messages[msg].del_time):
-            hr_bkt[msg_cmd][getdate][gethour].max_del = messages[msg].del_time
-
-        hr_bkt[msg_cmd][getdate][gethour].avg_del = \
-            hr_bkt[msg_cmd][getdate][gethour].sum_del / hr_bkt[msg_cmd][getdate][gethour].total_get
+    cmd_ids = messages.column('msg_cmd')
+    for cmd_id, rows in group_rows(cmd_ids):
+        hr_bkt[messages.commands[cmd_id]] = provision_hour_buckets(test_start, test_end)
+
+    # put on queue, deals with queuing:
+    puttimes = messages.column('puttime')
+    for (cmd_id, puthour), count, total, minimum, maximum in hourly_statistics(
+            cmd_ids, puttimes, messages.column('deq_time')):
+        bk = hr_bkt[messages.commands[cmd_id]][puthour[:10]][puthour[11:13]]
+        bk.total_put = count
+        bk.sum_deq = total
+        bk.min_deq = minimum
+        bk.max_deq = maximum
+        bk.avg_deq = total / count
+
+    # Get time is when the message is delivered
+    gettimes = messages.column('gettime')
+    for (cmd_id, gethour), count, total, minimum, maximum in hourly_statistics(
+            cmd_ids, gettimes, messages.column('del_time')):
+        bk = hr_bkt[messages.commands[cmd_id]][gethour[:10]][gethour[11:13]]
+        bk.total_get = count
+        bk.sum_del = total
+        bk.min_del = minimum
+        bk.max_del = maximum
+        bk.avg_del = total / count
     return hr_bkt
 
 
 def messages_to_statistics_csv(messages, statistics_file_name):
+    messages.freeze()
+    deq_times = messages.column('deq_time')
+    del_times = messages.column('del_time')
+    total_times = messages.column('total_time')
     all_statistics = []
-    for msg_id in messages:
-        msg = messages[msg_id]
-
-        added = False
-        if len(all_statistics) > 0:
-            for msg_statistics in all_statistics:
-                if msg_statistics.cmd == msg.msg_cmd:
-
-                    if msg.del_time > 0:
-                        msg_statistics.delivertimes.append(float(msg.del_time))
-                        msg_statistics.gets += 1
-                    msg_statistics.dequeuetimes.append(float(msg.deq_time))
-                    msg_statistics.totaltimes.append(float(msg.total_time))
-                    msg_statistics.puts += 1
-                    added = True
-                    break
-
-        if not added:
-            msg_statistics = MiqMsgLists()
-            msg_statistics.cmd = msg.msg_cmd
-            if msg.del_time > 0:
-                msg_statistics.delivertimes.append(float(msg.del_time))
-                msg_statistics.gets = 1
-            msg_statistics.dequeuetimes.append(float(msg.deq_time))
-            msg_statistics.totaltimes.append(float(msg.total_time))
-            msg_statistics.puts = 1
-            all_statistics.append(msg_statistics)
+    for cmd_id, rows in group_rows(messages.column('msg_cmd')):
+        delivertimes = del_times[rows]
+        all_statistics.append((messages.commands[cmd_id], deq_times[rows],
+            delivertimes[delivertimes > 0], total_times[rows]))
 
     csvdata_path = log_path.join('csv_output', statistics_file_name)
     outputfile = csvdata_path.open('w', ensure=True)
@@ -563,23 +533,104 @@ def messages_to_statistics_csv(messages, statistics_file_name):
         csvfile.writerow(headers)
 
         # Contents of CSV
-        for msg_statistics in sorted(all_statistics, key=lambda x: x.cmd):
-            if msg_statistics.gets > 1:
+        for cmd, dequeuetimes, delivertimes, totaltimes in sorted(all_statistics):
+            if len(delivertimes) > 1:
                 logger.debug('Samples/Avg/90th/Std: %s: %s : %s : %s,Cmd: %s',
-                    str(len(msg_statistics.totaltimes)).rjust(7),
-                    str(round(numpy.average(msg_statistics.totaltimes), 3)).rjust(7),
-                    str(round(numpy.percentile(msg_statistics.totaltimes, 90), 3)).rjust(7),
-                    str(round(numpy.std(msg_statistics.totaltimes), 3)).rjust(7),
-                    msg_statistics.cmd)
-            stats = [msg_statistics.cmd, msg_statistics.puts, msg_statistics.gets]
-            stats.extend(generate_statistics(msg_statistics.dequeuetimes, 3))
-            stats.extend(generate_statistics(msg_statistics.delivertimes, 3))
-            stats.extend(generate_statistics(msg_statistics.totaltimes, 3))
+                    str(len(totaltimes)).rjust(7),
+                    str(round(numpy.average(totaltimes), 3)).rjust(7),
+                    str(round(numpy.percentile(totaltimes, 90), 3)).rjust(7),
+                    str(round(numpy.std(totaltimes), 3)).rjust(7),
+                    cmd)
+            stats = [cmd, len(dequeuetimes), len(delivertimes)]
+            stats.extend(generate_statistics(dequeuetimes, 3))
+            stats.extend(generate_statistics(delivertimes, 3))
+            stats.extend(generate_statistics(totaltimes, 3))
             csvfile.writerow(stats)
     finally:
         outputfile.close()
 
 
+def open_log(log_file):
+    """Opens a log file for reading, gzipped files (``*.gz``) are decompressed on the fly"""
+    if str(log_file).endswith('.gz'):
+        return gzip.open(str(log_file), 'rb')
+    return open(str(log_file), 'r')
+
+
+def _log_files(log_file):
+    if isinstance(log_file, (list, tuple)):
+        return log_file
+    return [log_file]
+
+
+def parse_log(log_file, accumulator_types, processes=None, start=0, end=None):
+    """Parses a log file in a single pass, feeding each line to a set of accumulators
+
+    Big uncompressed files are split into parts which are parsed by a pool of processes, the
+    accumulators of the parts are then merged in the order of the parts.
+
+    Args:
+        log_file: Path to the log file, may be gzipped
+        accumulator_types: Accumulator classes, see :py:class:`MessageAccumulator`
+        processes: Number of processes to parse with, defaults to the number of CPUs
+        start: Offset to start parsing at
+        end: Offset to stop parsing at, lines starting after it are left out
+    Returns: A list of merged accumulators in the order of ``accumulator_types`` and the number
+        of lines parsed
+    """
+    parts = log_parts(log_file, processes, start, end)
+    merged = [accumulator_type() for accumulator_type in accumulator_types]
+    line_count = 0
+    if len(parts) == 1:
+        results = [parse_log_part(log_file, accumulator_types, start, end)]
+        pool = None
+    else:
+        logger.info('Parsing %s in %d parts', log_file, len(parts))
+        pool = multiprocessing.Pool(len(parts))
+        results = pool.imap(_parse_log_part,
+            [(log_file, accumulator_types, part_start, part_end) for part_start, part_end in parts])
+    try:
+        for accumulators, part_line_count in results:
+            line_count += part_line_count
+            for total, accumulator in zip(merged, accumulators):
+                total.merge(accumulator)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return merged, line_count
+
+
+def parse_log_part(log_file, accumulator_types, start=0, end=None):
+    """Parses the lines of a log file starting between the start and end offsets
+
+    Every accumulator gets only the lines containing one of its ``markers``.
+
+    Returns: A list of accumulators in the order of ``accumulator_types`` and the number of lines
+        parsed
+    """
+    accumulators = [accumulator_type() for accumulator_type in accumulator_types]
+    line_count = 0
+    runningtime = time()
+    for log_line in iter_log_lines(log_file, start, end):
+        line_count += 1
+        for accumulator in accumulators:
+            for marker in accumulator.markers:
+                if marker in log_line:
+                    accumulator.feed(log_line, line_count)
+                    break
+
+        if (line_count % 100000) == 0:
+            timediff = time() - runningtime
+            runningtime = time()
+            logger.info('Count %s : Parsed 100000 lines in %s', line_count, timediff)
+    return accumulators, line_count
+
+
+def _parse_log_part(args):
+    return parse_log_part(*args)
+
+
 def provision_hour_buckets(test_start, test_end, init=True):
     buckets = {}
     start_date = datetime.strptime(test_start[:10], '%Y-%m-%d')
@@ -614,188 +665,45 @@ def provision_hour_buckets(test_start, test_end, init=True):
 
 
 def top_to_appliance(top_file):
-    # Find first miqtop log line
-    miqtop_time, timezone_offset = get_first_miqtop(top_file)
+    top_app, top_workers, line_count = top_to_appliance_and_workers(top_file, {})
+    return top_app, line_count
 
-    runningtime = time()
-    grep_pattern = '^top\s\-\s\\|^miqtop\:\\|^Cpu(s)\:\\|^Mem\:\\|^Swap\:'
-    # Use grep to reduce # of lines to sort through
-    p = subprocess.Popen(['grep', grep_pattern, top_file], stdout=subprocess.PIPE)
-    greppedtop, err = p.communicate()
-    timediff = time() - runningtime
-    logger.info('Grepped top_output for CPU/Mem/Swap & time data in %s', timediff)
-
-    top_lines = greppedtop.strip().split('\n')
-    line_count = 0
 
-    top_keys = ['datetimes', 'cpuus', 'cpusy', 'cpuni', 'cpuid', 'cpuwa', 'cpuhi', 'cpusi', 'cpust',
-        'memtot', 'memuse', 'memfre', 'buffer', 'swatot', 'swause', 'swafre', 'cached']
-    top_app = dict((key, []) for key in top_keys)
+def top_to_appliance_and_workers(top_file, workers):
+    """Parses top_output in a single pass for both the appliance and the per worker metrics
 
-    cur_time = None
-    miqtop_ahead = True
+    Returns: Appliance metrics, metrics of the workers keyed by worker id, number of lines parsed
+    """
+    top = TopAccumulator()
+    top.prime(top_file)
+    top.set_workers(workers)
+    line_count = 0
     runningtime = time()
-    for top_line in top_lines:
+    for top_line in iter_log_lines(top_file):
         line_count += 1
-        if 'top - ' in top_line:
-            # top - 11:00:43
-            cur_hour = int(top_line[6:8])
-            cur_min = int(top_line[9:11])
-            cur_sec = int(top_line[12:14])
-            if miqtop_ahead:
-                # Have not found miqtop date/time yet so we must rely on miqtop date/time "ahead"
-                if cur_hour <= miqtop_time.hour:
-                    cur_time = miqtop_time.replace(hour=cur_hour, minute=cur_min, second=cur_sec) \
-                        - timedelta(hours=timezone_offset)
-                else:
-                    # miqtop_time is ahead by date
-                    logger.info('miqtop_time is ahead by one day')
-                    cur_time = miqtop_time - timedelta(days=1)
-                    cur_time = cur_time.replace(hour=cur_hour, minute=cur_min, second=cur_sec) \
-                        - timedelta(hours=timezone_offset)
-            else:
-                cur_time = miqtop_time.replace(hour=cur_hour, minute=cur_min, second=cur_sec) \
-                    - timedelta(hours=timezone_offset)
-        elif 'miqtop: ' in top_line:
-            miqtop_ahead = False
-            # miqtop: .* is-> Mon Jan 26 08:57:39 EST 2015 -0500
-            str_start = top_line.index('is->')
-            miqtop_time = du_parser.parse(top_line[str_start:], fuzzy=True, ignoretz=True)
-            # Time logged in top is the system's time which is ahead/behind by the timezone offset
-            timezone_offset = int(top_line[str_start + 34:str_start + 37])
-            miqtop_time = miqtop_time - timedelta(hours=timezone_offset)
-        elif 'Cpu(s): ' in top_line:
-            miq_cpu_result = miq_cpu.search(top_line)
-            if miq_cpu_result:
-                top_app['datetimes'].append(str(cur_time))
-                top_app['cpuus'].append(float(miq_cpu_result.group(1).strip()))
-                top_app['cpusy'].append(float(miq_cpu_result.group(2).strip()))
-                top_app['cpuni'].append(float(miq_cpu_result.group(3).strip()))
-                top_app['cpuid'].append(float(miq_cpu_result.group(4).strip()))
-                top_app['cpuwa'].append(float(miq_cpu_result.group(5).strip()))
-                top_app['cpuhi'].append(float(miq_cpu_result.group(6).strip()))
-                top_app['cpusi'].append(float(miq_cpu_result.group(7).strip()))
-                top_app['cpust'].append(float(miq_cpu_result.group(8).strip()))
-            else:
-                logger.error('Issue with miq_cpu regex: %s', top_line)
-        elif 'Mem: ' in top_line:
-            miq_mem_result = miq_mem.search(top_line)
-            if miq_mem_result:
-                top_app['memtot'].append(round(float(miq_mem_result.group(1).strip()) / 1024, 2))
-                top_app['memuse'].append(round(float(miq_mem_result.group(2).strip()) / 1024, 2))
-                top_app['memfre'].append(round(float(miq_mem_result.group(3).strip()) / 1024, 2))
-                top_app['buffer'].append(round(float(miq_mem_result.group(4).strip()) / 1024, 2))
-            else:
-                logger.error('Issue with miq_mem regex: %s', top_line)
-        elif 'Swap: ' in top_line:
-            miq_swap_result = miq_swap.search(top_line)
-            if miq_swap_result:
-                top_app['swatot'].append(round(float(miq_swap_result.group(1).strip()) / 1024, 2))
-                top_app['swause'].append(round(float(miq_swap_result.group(2).strip()) / 1024, 2))
-                top_app['swafre'].append(round(float(miq_swap_result.group(3).strip()) / 1024, 2))
-                top_app['cached'].append(round(float(miq_swap_result.group(4).strip()) / 1024, 2))
-            else:
-                logger.error('Issue with miq_swap regex: %s', top_line)
-        else:
-            logger.error('Issue with grepping of top file:%s', top_line)
-        if (line_count % 20000) == 0:
+        top.feed(top_line)
+        if (line_count % 100000) == 0:
             timediff = time() - runningtime
             runningtime = time()
-            logger.info('Count {} : Parsed 20000 lines in %s', line_count, timediff)
-    return top_app, len(top_lines)
+            logger.info('Count %s : Parsed 100000 lines in %s', line_count, timediff)
+    return top.top_app, top.top_workers, line_count
 
 
 def top_to_workers(workers, top_file):
-    # Find first miqtop log line
-    miqtop_time, timezone_offset = get_first_miqtop(top_file)
+    top_app, top_workers, line_count = top_to_appliance_and_workers(top_file, workers)
+    return top_workers, line_count
 
-    runningtime = time()
-    grep_pids = ''
-    for wkr in workers:
-        grep_pids = '{}^{}\s\\|'.format(grep_pids, workers[wkr].pid)
-    grep_pattern = '{}^top\s\-\s\\|^miqtop\:'.format(grep_pids)
-    # Use grep to reduce # of lines to sort through
-    p = subprocess.Popen(['grep', grep_pattern, top_file], stdout=subprocess.PIPE)
-    greppedtop, err = p.communicate()
-    timediff = time() - runningtime
-    logger.info('Grepped top_output for pids & time data in %s', timediff)
-
-    # This is very ugly because miqtop does include the date but top does not
-    # Also pids can be duplicated, so careful attention to detail on when a pid starts and ends
-    top_lines = greppedtop.strip().split('\n')
-    line_count = 0
-    top_workers = {}
-    cur_time = None
-    miqtop_ahead = True
-    runningtime = time()
-    for top_line in top_lines:
-        line_count += 1
-        if 'top - ' in top_line:
-            # top - 11:00:43
-            cur_hour = int(top_line[6:8])
-            cur_min = int(top_line[9:11])
-            cur_sec = int(top_line[12:14])
-            if miqtop_ahead:
-                # Have not found miqtop time yet so we must rely on miqtop time "ahead"
-                if cur_hour <= miqtop_time.hour:
-                    cur_time = miqtop_time.replace(hour=cur_hour, minute=cur_min, second=cur_sec) \
-                        - timedelta(hours=timezone_offset)
-                else:
-                    # miqtop_time is ahead by date
-                    logger.info('miqtop_time is ahead by one day')
-                    cur_time = miqtop_time - timedelta(days=1)
-                    cur_time = cur_time.replace(hour=cur_hour, minute=cur_min, second=cur_sec) \
-                        - timedelta(hours=timezone_offset)
-            else:
-                cur_time = miqtop_time.replace(hour=cur_hour, minute=cur_min, second=cur_sec) \
-                    - timedelta(hours=timezone_offset)
-        elif 'miqtop: ' in top_line:
-            miqtop_ahead = False
-            # miqtop: .* is-> Mon Jan 26 08:57:39 EST 2015 -0500
-            str_start = top_line.index('is->')
-            miqtop_time = du_parser.parse(top_line[str_start:], fuzzy=True, ignoretz=True)
-            # Time logged in top is the system's time which is ahead/behind by the timezone offset
-            timezone_offset = int(top_line[str_start + 34:str_start + 37])
-            miqtop_time = miqtop_time - timedelta(hours=timezone_offset)
-        else:
-            top_results = miq_top.search(top_line)
-            if top_results:
-                top_pid = top_results.group(1)
-                top_virt = convert_top_mem_to_mib(top_results.group(2))
-                top_res = convert_top_mem_to_mib(top_results.group(3))
-                top_share = convert_top_mem_to_mib(top_results.group(4))
-                top_cpu_per = float(top_results.group(5))
-                top_mem_per = float(top_results.group(6))
-                for worker in workers:
-                    if workers[worker].pid == top_pid:
-                        if cur_time > workers[worker].start_ts and \
-                                (workers[worker].end_ts == '' or cur_time < workers[worker].end_ts):
-                            w_id = workers[worker].worker_id
-                            if w_id not in top_workers:
-                                top_workers[w_id] = {}
-                                top_workers[w_id]['datetimes'] = []
-                                top_workers[w_id]['virt'] = []
-                                top_workers[w_id]['res'] = []
-                                top_workers[w_id]['share'] = []
-                                top_workers[w_id]['cpu_per'] = []
-                                top_workers[w_id]['mem_per'] = []
-                            top_workers[w_id]['datetimes'].append(str(cur_time))
-                            top_workers[w_id]['virt'].append(top_virt)
-                            top_workers[w_id]['res'].append(top_res)
-                            top_workers[w_id]['share'].append(top_share)
-                            top_workers[w_id]['cpu_per'].append(top_cpu_per)
-                            top_workers[w_id]['mem_per'].append(top_mem_per)
-                            break
-            else:
-                logger.error('Issue with miq_top regex or grepping of top file:%s', top_line)
-        if (line_count % 20000) == 0:
-            timediff = time() - runningtime
-            runningtime = time()
-            logger.info('Count %s : Parsed 20000 lines in %s', line_count, timediff)
-    return top_workers, len(top_lines)
 
+def perf_process_evm(evm_file, top_file, processes=None, checkpoint_file=None):
+    """Parses the evm and top_output logs and generates the csvs, charts and html report
 
-def perf_process_evm(evm_file, top_file):
+    Args:
+        evm_file: Path to evm.log or a list of paths to the rotated logs, oldest first
+        top_file: Path to top_output.log or a list of paths to the rotated logs, oldest first
+        processes: Number of processes to parse big logs with, defaults to the number of CPUs
+        checkpoint_file: Path to a :py:class:`PerfCheckpoint`, only what was logged since the
+            last run with the same checkpoint is parsed then
+    """
     msg_filters = {
         '-hourly': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"hourly\"'),
         '-daily': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"daily\"'),
@@ -808,22 +716,37 @@ def perf_process_evm(evm_file, top_file):
     starttime = time()
     initialtime = starttime
 
-    logger.info('----------- Parsing evm log file for messages -----------')
-    messages, msg_cmds, test_start, test_end, msg_lc = evm_to_messages(evm_file, msg_filters)
+    checkpoint = PerfCheckpoint.load(checkpoint_file)
+
+    logger.info('----------- Parsing evm log file for messages and workers -----------')
+    checkpoint.parse_evm(evm_file, processes)
+    checkpoint.messages.drop_orphans()
+    workers, wkr_mem_exc, wkr_upt_exc, wkr_stp, wkr_int, wkr_ext = checkpoint.workers.replay()
+    wkr_lc = len(checkpoint.workers.events)
+    msg_lc = checkpoint.msg_lc
     timediff = time() - starttime
     logger.info('----------- Completed Parsing evm log file -----------')
-    logger.info('Parsed %s lines of evm log file for messages in %s', msg_lc, timediff)
+    logger.info('Parsed %s lines of evm log file in %s', msg_lc, timediff)
+
+    logger.info('----------- Parsing top_output log file for Appliance/Worker Metrics -----------')
+    starttime = time()
+    checkpoint.parse_top(top_file, workers)
+    top_appliance, top_workers = checkpoint.top.top_app, checkpoint.top.top_workers
+    tp_lc = checkpoint.tp_lc
+    timediff = time() - starttime
+    logger.info('----------- Completed Parsing top_output log -----------')
+    logger.info('Parsed %s lines of top_output file in %s', tp_lc, timediff)
+
+    # Saved before the messages get filtered and frozen below
+    checkpoint.save()
+
+    messages = checkpoint.messages.messages
+    test_start, test_end = checkpoint.messages.test_start, checkpoint.messages.test_end
+    msg_cmds = messages_to_commands(messages, msg_filters)
     logger.info('Total # of Messages: %d', len(messages))
     logger.info('Total # of Commands: %d', len(msg_cmds))
     logger.info('Start Time: %s', test_start)
     logger.info('End Time: %s', test_end)
-
-    logger.info('----------- Parsing evm log file for workers -----------')
-    starttime = time()
-    workers, wkr_mem_exc, wkr_upt_exc, wkr_stp, wkr_int, wkr_ext, wkr_lc = evm_to_workers(evm_file)
-    timediff = time() - starttime
-    logger.info('----------- Completed Parsing evm log for workers -----------')
-    logger.info('Parsed %s lines of evm log file for workers in %s', wkr_lc, timediff)
     logger.info('Total # of Workers: %d', len(workers))
     logger.info('# Workers Memory Exceeded: %s', wkr_mem_exc)
     logger.info('# Workers Uptime Exceeded: %s', wkr_upt_exc)
@@ -831,21 +754,6 @@ def perf_process_evm(evm_file, top_file):
     logger.info('# Workers Stopped: %s', wkr_stp)
     logger.info('# Workers Interrupted: %s', wkr_int)
 
-    logger.info('----------- Parsing top_output log file for Appliance Metrics -----------')
-    starttime = time()
-    top_appliance, tp_lc = top_to_appliance(top_file)
-    timediff = time() - starttime
-    logger.info('----------- Completed Parsing top_output log -----------')
-    logger.info('Parsed %s lines of top_output file for Appliance Metrics in %s', tp_lc,
-        timediff)
-
-    logger.info('----------- Parsing top_output log file for worker CPU/Mem -----------')
-    starttime = time()
-    top_workers, tp_lc = top_to_workers(workers, top_file)
-    timediff = time() - starttime
-    logger.info('----------- Completed Parsing top_output log -----------')
-    logger.info('Parsed %s lines of top_output file for workers in %s', tp_lc, timediff)
-
     charts_dir = log_path.join('charts')
     if not os.path.exists(str(charts_dir)):
         os.mkdir(str(charts_dir))
@@ -1054,17 +962,6 @@ class MiqMsgStat(object):
             str(self.del_time) + ' : ' + str(self.total_time)
 
 
-class MiqMsgLists(object):
-
-    def __init__(self):
-        self.cmd = ''
-        self.puts = 0
-        self.gets = 0
-        self.dequeuetimes = []
-        self.delivertimes = []
-        self.totaltimes = []
-
-
 class MiqMsgBucket(object):
     def __init__(self):
         self.headers = ['date', 'hour', 'total_put', 'total_get', 'sum_deq', 'min_deq', 'max_deq',
@@ -1111,3 +1008,521 @@ class MiqWorker(object):
     def __str__(self):
         return self.worker_id + ' : ' + self.worker_type + ' : ' + self.pid + ' : ' + \
             str(self.start_ts) + ' : ' + str(self.end_ts) + ' : ' + self.terminated
+
+
+class MessageStore(object):
+    """Columnar store of queue messages, keyed by message id
+
+    Every column of :py:class:`MiqMsgStat` is kept in one array instead of an object per message,
+    commands are stored once in :py:attr:`commands` and referred to by index. While parsing, the
+    columns are growable arrays; :py:meth:`freeze` turns them into NumPy arrays for the
+    vectorized aggregations, after which no more messages can be added.
+    """
+    number_columns = (
+        ('msg_id', 'l'), ('msg_cmd', 'l'), ('pid_put', 'l'), ('pid_get', 'l'),
+        ('deq_time', 'd'), ('del_time', 'd'), ('total_time', 'd'))
+    # msg_args stay strings, timestamps are converted to datetime64 on freeze
+    list_columns = ('msg_args', 'puttime', 'gettime')
+
+    def __init__(self):
+        self.commands = []
+        self._command_ids = {}
+        self._rows = {}
+        self._columns = dict((name, array(typecode)) for name, typecode in self.number_columns)
+        self._columns.update((name, []) for name in self.list_columns)
+        self.frozen = False
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, msg_id):
+        return int(msg_id) in self._rows
+
+    def __getitem__(self, msg_id):
+        """Returns: :py:class:`MiqMsgStat` with the values of the message"""
+        row = self._rows[int(msg_id)]
+        msg = MiqMsgStat()
+        msg.msg_id = '\'{}\''.format(msg_id)
+        msg.msg_cmd = self.commands[self._columns['msg_cmd'][row]]
+        msg.msg_args = self._columns['msg_args'][row]
+        msg.pid_put = str(self._columns['pid_put'][row])
+        if self._columns['pid_get'][row] >= 0:
+            msg.pid_get = str(self._columns['pid_get'][row])
+        msg.puttime = self._timestamp(self._columns['puttime'][row])
+        msg.gettime = self._timestamp(self._columns['gettime'][row])
+        msg.deq_time = float(self._columns['deq_time'][row])
+        msg.del_time = float(self._columns['del_time'][row])
+        msg.total_time = float(self._columns['total_time'][row])
+        return msg
+
+    def _timestamp(self, value):
+        if not self.frozen:
+            return value
+        value = str(value)
+        return '' if value == 'NaT' else value.replace('T', ' ')
+
+    def keys(self):
+        return [str(msg_id) for msg_id in self._rows]
+
+    def command_id(self, cmd):
+        """Returns: index of the command in :py:attr:`commands`, adding it if it's new"""
+        if cmd not in self._command_ids:
+            self._command_ids[cmd] = len(self.commands)
+            self.commands.append(cmd)
+        return self._command_ids[cmd]
+
+    def column(self, name):
+        return self._columns[name]
+
+    def put(self, msg_id, msg_cmd, msg_args, pid, puttime):
+        """Adds a message, a message put again with the same id replaces the old one"""
+        self._set_row(int(msg_id), {
+            'msg_id': int(msg_id), 'msg_cmd': self.command_id(msg_cmd), 'msg_args': msg_args,
+            'pid_put': int(pid), 'pid_get': -1, 'puttime': puttime, 'gettime': '',
+            'deq_time': 0.0, 'del_time': 0.0, 'total_time': 0.0})
+
+    def get(self, msg_id, pid, gettime, deq_time):
+        row = self._rows[int(msg_id)]
+        self._columns['pid_get'][row] = int(pid)
+        self._columns['gettime'][row] = gettime
+        self._columns['deq_time'][row] = deq_time
+
+    def deliver(self, msg_id, del_time):
+        row = self._rows[int(msg_id)]
+        self._columns['del_time'][row] = del_time
+        self._columns['total_time'][row] = self._columns['deq_time'][row] + del_time
+
+    def _set_row(self, msg_id, values):
+        if self.frozen:
+            raise ValueError('Messages can not be added to a frozen store')
+        row = self._rows.get(msg_id)
+        if row is None:
+            self._rows[msg_id] = len(self._columns['msg_id'])
+            for name, column in self._columns.iteritems():
+                column.append(values[name])
+        else:
+            for name, column in self._columns.iteritems():
+                column[row] = values[name]
+
+    def extend(self, other):
+        """Adds the messages of another store, replacing those with the same ids"""
+        cmd_ids = [self.command_id(cmd) for cmd in other.commands]
+        if not any(msg_id in self._rows for msg_id in other._rows):
+            # No message was put again, so the columns can be appended as a whole
+            offset = len(self._columns['msg_id'])
+            self._rows.update((msg_id, row + offset) for msg_id, row in other._rows.iteritems())
+            for name, column in self._columns.iteritems():
+                if name == 'msg_cmd':
+                    column.extend(cmd_ids[cmd_id] for cmd_id in other._columns[name])
+                else:
+                    column.extend(other._columns[name])
+            return
+        for row in xrange(len(other._columns['msg_id'])):
+            values = dict((name, column[row]) for name, column in other._columns.iteritems())
+            values['msg_cmd'] = cmd_ids[values['msg_cmd']]
+            self._set_row(values['msg_id'], values)
+
+    def freeze(self):
+        """Turns the columns into NumPy arrays, the timestamps into datetime64[us]"""
+        if self.frozen:
+            return
+        for name, typecode in self.number_columns:
+            self._columns[name] = numpy.array(self._columns[name])
+        for name in ('puttime', 'gettime'):
+            self._columns[name] = numpy.array(self._columns[name], dtype='datetime64[us]')
+        self.frozen = True
+
+    def sorted_rows(self):
+        """Returns: row indices ordered by message id compared as strings, like the id keys"""
+        return numpy.argsort(self._columns['msg_id'].astype(str), kind='mergesort')
+
+
+class MessageAccumulator(object):
+    """Collects the queue messages of an evm.log, see :py:func:`parse_log`
+
+    Gets and deliveries of messages put in an earlier part of the log are kept aside and applied
+    when the part is merged after the earlier one.
+    """
+    markers = ('MIQ(', )
+
+    def __init__(self):
+        self.messages = MessageStore()
+        self.orphans = []
+        self.test_start = ''
+        self.test_end = ''
+
+    def feed(self, log_line, line_count):
+        miqmsg_result = miqmsg.search(log_line)
+        if not miqmsg_result:
+            return
+
+        # Obtains the first timestamp in the log file
+        if self.test_start == '':
+            ts, pid = get_msg_timestamp_pid(log_line)
+            self.test_start = ts
+
+        # A message was first put on the queue, this starts its queuing time
+        if miqmsg_result.group(1) == 'MiqQueue.put':
+            msg_id = get_msg_id(log_line)
+            if msg_id:
+                ts, pid = get_msg_timestamp_pid(log_line)
+                self.test_end = ts
+                msg_args = get_msg_args(log_line)
+                if msg_args is False:
+                    logger.debug('Could not obtain message args line #: %s', line_count)
+                    msg_args = ''
+                self.messages.put(msg_id, get_msg_cmd(log_line), msg_args, pid, ts)
+            else:
+                logger.error('Could not obtain message id, line #: %s', line_count)
+
+        elif miqmsg_result.group(1) == 'MiqQueue.get_via_drb':
+            msg_id = get_msg_id(log_line)
+            if msg_id:
+                ts, pid = get_msg_timestamp_pid(log_line)
+                self._get_or_defer(msg_id, ts, pid, get_msg_deq(log_line))
+            else:
+                logger.error('Could not obtain message id, line #: %s', line_count)
+
+        elif miqmsg_result.group(1) == 'MiqQueue.delivered':
+            msg_id = get_msg_id(log_line)
+            if msg_id:
+                ts, pid = get_msg_timestamp_pid(log_line)
+                self.test_end = ts
+                self._deliver_or_defer(msg_id, get_msg_del(log_line))
+            else:
+                logger.error('Could not obtain message id, line #: %s', line_count)
+
+    def drop_orphans(self):
+        """Drops the gets and deliveries of messages which were never put, once all is merged"""
+        for handler, msg_id, args in self.orphans:
+            logger.error('Message ID not in dictionary: %s', msg_id)
+        self.orphans = []
+
+    def _get(self, msg_id, ts, pid, deq_time):
+        self.test_end = max(self.test_end, ts)
+        self.messages.get(msg_id, pid, ts, deq_time)
+
+    def _deliver(self, msg_id, del_time):
+        self.messages.deliver(msg_id, del_time)
+
+    def _get_or_defer(self, msg_id, ts, pid, deq_time):
+        if msg_id in self.messages:
+            self._get(msg_id, ts, pid, deq_time)
+        else:
+            self.orphans.append(('_get', msg_id, (ts, pid, deq_time)))
+
+    def _deliver_or_defer(self, msg_id, del_time):
+        if msg_id in self.messages:
+            self._deliver(msg_id, del_time)
+        else:
+            self.orphans.append(('_deliver', msg_id, (del_time, )))
+
+    def merge(self, other):
+        """Folds in the accumulator of the part of the log following this one
+
+        Gets and deliveries of messages this one doesn't know either are kept aside further, the
+        messages may be in a part merged before this one later.
+        """
+        for handler, msg_id, args in other.orphans:
+            if msg_id in self.messages:
+                getattr(self, handler)(msg_id, *args)
+            else:
+                self.orphans.append((handler, msg_id, args))
+        self.messages.extend(other.messages)
+        self.test_start = self.test_start or other.test_start
+        self.test_end = max(self.test_end, other.test_end)
+
+
+class PerfCheckpoint(object):
+    """State of an incremental analysis of evm.log and top_output logs
+
+    Keeps the accumulators and, for every log seen, the offset it was parsed to. Logs are told
+    apart by :py:func:`log_fingerprint`, so a log parsed while it was current is resumed once it is
+    rotated. Only complete lines are parsed, so the logs can still be written to.
+    """
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self.version = self.VERSION
+        # fingerprint -> offset parsed to, None for rotated logs parsed to the end
+        self.offsets = {}
+        self.messages = MessageAccumulator()
+        self.workers = WorkerAccumulator()
+        self.top = TopAccumulator()
+        self.msg_lc = 0
+        self.tp_lc = 0
+
+    @classmethod
+    def load(cls, path):
+        """Loads a checkpoint, starts a new one if there is none at the path yet"""
+        if path is None or not os.path.exists(str(path)):
+            return cls(path)
+        with open(str(path), 'rb') as checkpoint_file:
+            checkpoint = cPickle.load(checkpoint_file)
+        if getattr(checkpoint, 'version', None) != cls.VERSION:
+            logger.warning('Checkpoint %s is of another version, starting over', path)
+            return cls(path)
+        checkpoint.path = path
+        logger.info('Resuming from checkpoint %s', path)
+        return checkpoint
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'wb') as checkpoint_file:
+            cPickle.dump(self, checkpoint_file, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, str(self.path))
+
+    def pending(self, log_file):
+        """Returns: (fingerprint, start, end) of the part of a log which wasn't parsed yet or
+            None if there's nothing new
+        """
+        fingerprint = log_fingerprint(log_file)
+        if fingerprint is None:
+            return None
+        start = self.offsets.get(fingerprint, 0)
+        if start is None:
+            return None
+        end = log_complete_size(log_file)
+        if end is not None and end <= start:
+            return None
+        return fingerprint, start, end
+
+    def parsed(self, fingerprint, end):
+        self.offsets[fingerprint] = end
+
+    def parse_evm(self, evm_file, processes=None):
+        """Folds what was logged to the evm logs since the last run into the accumulators
+
+        Args:
+            evm_file: Path to evm.log or a list of paths to the rotated logs, oldest first
+            processes: Number of processes to parse big logs with, see :py:func:`parse_log`
+        """
+        for log_file in _log_files(evm_file):
+            pending = self.pending(log_file)
+            if pending is None:
+                logger.info('Nothing new in %s', log_file)
+                continue
+            fingerprint, start, end = pending
+            logger.info('Parsing %s from offset %s', log_file, start)
+            (msg_acc, wkr_acc), line_count = parse_log(log_file,
+                [MessageAccumulator, WorkerAccumulator], processes, start, end)
+            self.messages.merge(msg_acc)
+            self.workers.merge(wkr_acc)
+            self.msg_lc += line_count
+            self.parsed(fingerprint, end)
+
+    def parse_top(self, top_file, workers):
+        """Folds what was logged to the top_output logs since the last run into the accumulators
+
+        Args:
+            top_file: Path to top_output.log or a list of paths to the rotated logs, oldest first
+            workers: Workers keyed by worker id, as replayed from the evm logs
+        """
+        self.top.set_workers(workers)
+        for log_file in _log_files(top_file):
+            pending = self.pending(log_file)
+            if pending is None:
+                logger.info('Nothing new in %s', log_file)
+                continue
+            fingerprint, start, end = pending
+            if self.top.miqtop_time is None:
+                self.top.prime(log_file)
+            logger.info('Parsing %s from offset %s', log_file, start)
+            for top_line in iter_log_lines(log_file, start, end):
+                self.tp_lc += 1
+                self.top.feed(top_line)
+            self.parsed(fingerprint, end)
+
+
+class TopAccumulator(object):
+    """Collects the appliance and the per worker metrics of a top_output log
+
+    Lines have to be fed in order, as top only logs the time and the date comes from the
+    preceding miqtop lines.
+    """
+    top_keys = ['datetimes', 'cpuus', 'cpusy', 'cpuni', 'cpuid', 'cpuwa', 'cpuhi', 'cpusi',
+        'cpust', 'memtot', 'memuse', 'memfre', 'buffer', 'swatot', 'swause', 'swafre', 'cached']
+
+    def __init__(self):
+        self.top_app = dict((key, []) for key in self.top_keys)
+        self.top_workers = {}
+        self.worker_pids = {}
+        self.cur_time = None
+        self.miqtop_time = None
+        self.timezone_offset = None
+        self.miqtop_ahead = True
+
+    def prime(self, top_file):
+        """Takes the date from the first miqtop line of the log, for the top lines before it"""
+        self.miqtop_time, self.timezone_offset = get_first_miqtop(top_file)
+
+    def set_workers(self, workers):
+        # pids can be duplicated, so each pid maps to all the workers which ever had it
+        self.worker_pids = {}
+        for worker in workers.itervalues():
+            self.worker_pids.setdefault(worker.pid, []).append(worker)
+
+    def feed(self, top_line):
+        # This is very ugly because miqtop does include the date but top does not
+        # Also pids can be duplicated, so careful attention to detail on when a pid starts and ends
+        top_app = self.top_app
+        if top_line.startswith('top - '):
+            # top - 11:00:43
+            cur_hour = int(top_line[6:8])
+            cur_min = int(top_line[9:11])
+            cur_sec = int(top_line[12:14])
+            if self.miqtop_ahead:
+                # Have not found miqtop date/time yet so we must rely on miqtop date/time "ahead"
+                if cur_hour <= self.miqtop_time.hour:
+                    self.cur_time = self.miqtop_time.replace(
+                        hour=cur_hour, minute=cur_min, second=cur_sec) \
+                        - timedelta(hours=self.timezone_offset)
+                else:
+                    # miqtop_time is ahead by date
+                    logger.info('miqtop_time is ahead by one day')
+                    self.cur_time = self.miqtop_time - timedelta(days=1)
+                    self.cur_time = self.cur_time.replace(
+                        hour=cur_hour, minute=cur_min, second=cur_sec) \
+                        - timedelta(hours=self.timezone_offset)
+            else:
+                self.cur_time = self.miqtop_time.replace(
+                    hour=cur_hour, minute=cur_min, second=cur_sec) \
+                    - timedelta(hours=self.timezone_offset)
+        elif top_line.startswith('miqtop:'):
+            self.miqtop_ahead = False
+            # miqtop: .* is-> Mon Jan 26 08:57:39 EST 2015 -0500
+            str_start = top_line.index('is->')
+            self.miqtop_time = du_parser.parse(top_line[str_start:], fuzzy=True, ignoretz=True)
+            # Time logged in top is the system's time which is ahead/behind by the timezone offset
+            self.timezone_offset = int(top_line[str_start + 34:str_start + 37])
+            self.miqtop_time = self.miqtop_time - timedelta(hours=self.timezone_offset)
+        elif top_line.startswith('Cpu(s):'):
+            miq_cpu_result = miq_cpu.search(top_line)
+            if miq_cpu_result:
+                top_app['datetimes'].append(str(self.cur_time))
+                top_app['cpuus'].append(float(miq_cpu_result.group(1).strip()))
+                top_app['cpusy'].append(float(miq_cpu_result.group(2).strip()))
+                top_app['cpuni'].append(float(miq_cpu_result.group(3).strip()))
+                top_app['cpuid'].append(float(miq_cpu_result.group(4).strip()))
+                top_app['cpuwa'].append(float(miq_cpu_result.group(5).strip()))
+                top_app['cpuhi'].append(float(miq_cpu_result.group(6).strip()))
+                top_app['cpusi'].append(float(miq_cpu_result.group(7).strip()))
+                top_app['cpust'].append(float(miq_cpu_result.group(8).strip()))
+            else:
+                logger.error('Issue with miq_cpu regex: %s', top_line)
+        elif top_line.startswith('Mem:'):
+            miq_mem_result = miq_mem.search(top_line)
+            if miq_mem_result:
+                top_app['memtot'].append(round(float(miq_mem_result.group(1).strip()) / 1024, 2))
+                top_app['memuse'].append(round(float(miq_mem_result.group(2).strip()) / 1024, 2))
+                top_app['memfre'].append(round(float(miq_mem_result.group(3).strip()) / 1024, 2))
+                top_app['buffer'].append(round(float(miq_mem_result.group(4).strip()) / 1024, 2))
+            else:
+                logger.error('Issue with miq_mem regex: %s', top_line)
+        elif top_line.startswith('Swap:'):
+            miq_swap_result = miq_swap.search(top_line)
+            if miq_swap_result:
+                top_app['swatot'].append(round(float(miq_swap_result.group(1).strip()) / 1024, 2))
+                top_app['swause'].append(round(float(miq_swap_result.group(2).strip()) / 1024, 2))
+                top_app['swafre'].append(round(float(miq_swap_result.group(3).strip()) / 1024, 2))
+                top_app['cached'].append(round(float(miq_swap_result.group(4).strip()) / 1024, 2))
+            else:
+                logger.error('Issue with miq_swap regex: %s', top_line)
+        elif top_line.split(' ', 1)[0] in self.worker_pids:
+            top_results = miq_top.search(top_line)
+            if top_results:
+                top_pid = top_results.group(1)
+                for worker in self.worker_pids.get(top_pid, []):
+                    if self.cur_time > worker.start_ts and \
+                            (worker.end_ts == '' or self.cur_time < worker.end_ts):
+                        w_id = worker.worker_id
+                        if w_id not in self.top_workers:
+                            self.top_workers[w_id] = {}
+                            self.top_workers[w_id]['datetimes'] = []
+                            self.top_workers[w_id]['virt'] = []
+                            self.top_workers[w_id]['res'] = []
+                            self.top_workers[w_id]['share'] = []
+                            self.top_workers[w_id]['cpu_per'] = []
+                            self.top_workers[w_id]['mem_per'] = []
+                        self.top_workers[w_id]['datetimes'].append(str(self.cur_time))
+                        self.top_workers[w_id]['virt'].append(convert_top_mem_to_mib(
+                            top_results.group(2)))
+                        self.top_workers[w_id]['res'].append(convert_top_mem_to_mib(
+                            top_results.group(3)))
+                        self.top_workers[w_id]['share'].append(convert_top_mem_to_mib(
+                            top_results.group(4)))
+                        self.top_workers[w_id]['cpu_per'].append(float(top_results.group(5)))
+                        self.top_workers[w_id]['mem_per'].append(float(top_results.group(6)))
+                        break
+            else:
+                logger.error('Issue with miq_top regex of top file:%s', top_line)
+
+
+class WorkerAccumulator(object):
+    """Collects the worker start and stop lines of an evm.log, see :py:func:`parse_log`
+
+    The lines are few, so they are only picked out while parsing and :py:meth:`replay` runs them
+    through in order once all the parts are merged.
+    """
+    markers = (') ID [', '"evm_worker_', 'Interrupt', 'Worker exiting')
+
+    def __init__(self):
+        self.events = []
+
+    def feed(self, log_line, line_count):
+        miqwkr_result = miqwkr.search(log_line)
+        if miqwkr_result:
+            event, data = 'start', miqwkr_result.groups()
+        else:
+            for event in WORKER_TERMINATIONS:
+                if event in log_line:
+                    data = log_line
+                    break
+            else:
+                return
+        ts, pid = get_msg_timestamp_pid(log_line)
+        self.events.append((event, ts, data))
+
+    def merge(self, other):
+        """Folds in the accumulator of the part of the log following this one"""
+        self.events.extend(other.events)
+
+    def replay(self):
+        """Returns: workers keyed by worker id and the numbers of workers whose memory was
+            exceeded, uptime was exceeded, were stopped, interrupted and exited
+        """
+        workers = {}
+        counts = dict((termination, 0) for termination in WORKER_TERMINATIONS)
+        for event, ts, data in self.events:
+            if event == 'start':
+                worker_type, workerid, pid = data
+                workerid = int(workerid)
+                if workerid not in workers:
+                    workers[workerid] = MiqWorker()
+                    workers[workerid].worker_type = worker_type
+                    workers[workerid].pid = pid
+                    workers[workerid].worker_id = workerid
+                    workers[workerid].start_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
+            elif event == 'Interrupt':
+                for workerid in workers:
+                    if not workers[workerid].end_ts:
+                        counts[event] += 1
+                        workers[workerid].terminated = 'Interrupted'
+                        workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
+            else:
+                id_regex = miqwkr_id_2 if event == 'Worker exiting.' else miqwkr_id
+                miqwkr_id_result = id_regex.search(data)
+                if miqwkr_id_result:
+                    workerid = int(miqwkr_id_result.group(1))
+                    if workerid in workers:
+                        if not workers[workerid].terminated:
+                            counts[event] += 1
+                            workers[workerid].terminated = WORKER_TERMINATIONS[event]
+                            workers[workerid].end_ts = datetime.strptime(ts,
+                                '%Y-%m-%d %H:%M:%S.%f')
+        return (workers, counts['evm_worker_memory_exceeded'],
+            counts['evm_worker_uptime_exceeded'], counts['evm_worker_stop'], counts['Interrupt'],
+            counts['Worker exiting.'])
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Merging of simplecov results.
+
+Every appliance process covered by simplecov writes its own ``.resultset.json``, which looks
+like::
+
+    {"<command name>": {"timestamp": 1234567890,
+                        "coverage": {"/path/to/file.rb": [null, 1, 0, 3, ...], ...}}}
+
+Each list holds the hits of the lines of the file, ``null`` for lines that are not relevant
+(comments, blank lines, ...). Merging the results sums the hits line by line.
+
+:py:class:`SimplecovMerger` folds the resultsets one by one into a line hit array per file, so
+the memory it needs depends on the size of the covered code base, not on the number of
+processes. The merged result can be written back as a resultset which simplecov can format.
+"""
+import json
+import numpy
+import tarfile
+import time
+
+from utils.log import logger
+
+# Hits value of a line which is not relevant for the coverage (null in the resultset)
+NOT_RELEVANT = -1
+
+# Name of the resultset files written by simplecov
+RESULTSET_NAME = '.resultset.json'
+
+
+def _hits_array(lines):
+    return numpy.array(
+        [NOT_RELEVANT if hits is None else hits for hits in lines], dtype=numpy.int64)
+
+
+def _fold(merged, hits):
+    """Sums two line hit arrays, a line stays not relevant only if it is in both of them."""
+    if len(merged) < len(hits):
+        merged, hits = hits, merged
+    if len(hits) < len(merged):
+        hits = numpy.concatenate(
+            [hits, numpy.full(len(merged) - len(hits), NOT_RELEVANT, dtype=numpy.int64)])
+    result = numpy.maximum(merged, 0) + numpy.maximum(hits, 0)
+    result[(merged == NOT_RELEVANT) & (hits == NOT_RELEVANT)] = NOT_RELEVANT
+    return result
+
+
+class SimplecovMerger(object):
+    """Accumulates simplecov line hits of any number of resultsets.
+
+    Args:
+        command_name: Command name of the merged resultset.
+    """
+    def __init__(self, command_name='merged'):
+        self.command_name = command_name
+        self.files = {}
+        self.resultsets = 0
+
+    def add_coverage(self, coverage):
+        """Folds the ``coverage`` part of a result (file name to list of line hits) in."""
+        for file_name, lines in coverage.iteritems():
+            hits = _hits_array(lines)
+            if file_name in self.files:
+                self.files[file_name] = _fold(self.files[file_name], hits)
+            else:
+                self.files[file_name] = hits
+
+    def add_resultset(self, resultset_file):
+        """Folds a resultset in.
+
+        Args:
+            resultset_file: Path or file-like object of a ``.resultset.json``.
+        """
+        if isinstance(resultset_file, basestring):
+            with open(resultset_file, 'rb') as f:
+                resultset = json.load(f)
+        else:
+            resultset = json.load(resultset_file)
+        for result in resultset.itervalues():
+            self.add_coverage(result['coverage'])
+        self.resultsets += 1
+
+    def add_archive(self, archive):
+        """Folds in all resultsets in a (compressed) tar archive, reading it as a stream so
+        nothing gets extracted on the disk.
+
+        Returns:
+            Number of resultsets merged from the archive.
+        """
+        merged = 0
+        with tarfile.open(archive, 'r|*') as tar:
+            for member in tar:
+                if not member.isfile() or not member.name.endswith(RESULTSET_NAME):
+                    continue
+                try:
+                    self.add_resultset(tar.extractfile(member))
+                except ValueError as e:
+                    logger.warning('Skipping %s, no valid JSON: %s', member.name, e)
+                else:
+                    merged += 1
+        return merged
+
+    @property
+    def summary(self):
+        """Dictionary with the numbers of covered and relevant lines and the covered percent."""
+        covered = relevant = 0
+        for hits in self.files.itervalues():
+            covered += int(numpy.count_nonzero(hits > 0))
+            relevant += int(numpy.count_nonzero(hits != NOT_RELEVANT))
+        percent = round(100.0 * covered / relevant, 2) if relevant else 0.0
+        return {'covered_lines': covered, 'relevant_lines': relevant, 'covered_percent': percent}
+
+    def write_resultset(self, path):
+        """Writes the merged result as a simplecov ``.resultset.json``, file by file."""
+        with open(path, 'wb') as f:
+            f.write('{{{}: {{"timestamp": {}, "coverage": {{'.format(
+                json.dumps(self.command_name), int(time.time())))
+            for i, file_name in enumerate(sorted(self.files)):
+                lines = [None if hits == NOT_RELEVANT else hits
+                    for hits in self.files[file_name].tolist()]
+                f.write('{}{}: {}'.format(', ' if i else '', json.dumps(file_name),
+                    json.dumps(lines)))
+            f.write('}}}')
+
+    def write_last_run(self, path):
+        """Writes the summary in the format of simplecov's ``.last_run.json``."""
+        with open(path, 'wb') as f:
+            json.dump({'result': self.summary}, f)
+
+    def save(self, path):
+        """Saves the accumulated hits to a ``.npz`` file, see :py:meth:`load`."""
+        names = sorted(self.files)
+        numpy.savez_compressed(
+            path,
+            names=numpy.array(names),
+            lengths=numpy.array([len(self.files[name]) for name in names], dtype=numpy.int64),
+            hits=(numpy.concatenate([self.files[name] for name in names])
+                if names else numpy.array([], dtype=numpy.int64)),
+            resultsets=numpy.array([self.resultsets]))
+
+    @classmethod
+    def load(cls, path, command_name='merged'):
+        """Loads hits saved by :py:meth:`save`, more resultsets can be folded in then."""
+        merger = cls(command_name)
+        data = numpy.load(path)
+        offsets = numpy.cumsum(numpy.concatenate([[0], data['lengths']]))
+        hits = data['hits']
+        for i, name in enumerate(data['names']):
+            merger.files[unicode(name)] = hits[offsets[i]:offsets[i + 1]].copy()
+        merger.resultsets = int(data['resultsets'][0])
+        return merger
@@ -2,18 +2,23 @@
 import fauxfactory
 import iso8601
 import re
+import select
 import socket
 import sys
-from collections import namedtuple
+import threading
+from collections import defaultdict, deque, namedtuple
+from contextlib import contextmanager
 from os import path as os_path
 from subprocess import check_call
+from time import time
 from urlparse import urlparse
 
 import paramiko
+from concurrent import futures
 from scp import SCPClient
 import diaper
 
-from utils import conf, ports, version
+from utils import at_exit, conf, ports, version
 from utils.log import logger
 from utils.net import net_check
 from fixtures.pytest_store import store
@@ -26,6 +31,21 @@ from utils.timeutil import parsetime
 # in seconds (float)
 RUNCMD_TIMEOUT = 1200.0
 
+# Size of the chunks read from a command's output channel, in bytes
+RECV_CHUNK_SIZE = 32768
+
+# How often to check for a command's exit status when no output arrives, in seconds
+EXIT_POLL_INTERVAL = 1.0
+
+# Interval of the keepalive packets sent on pooled transports, in seconds
+KEEPALIVE_INTERVAL = 30
+
+# How many commands can run on one pooled transport at once, sshd allows 10 sessions by default
+MAX_CHANNELS = 8
+
+# How many hosts SSHClient.run_many runs a command on at once by default
+RUN_MANY_WORKERS = 10
+
 
 class SSHResult(namedtuple("SSHResult", ["rc", "output"])):
     """Allows rich comparison for more convenient testing.
@@ -84,6 +104,194 @@ class SSHResult(namedtuple("SSHResult", ["rc", "output"])):
         return self.rc != 0
 
 
+class OutputBuffer(object):
+    """Ring buffer keeping the last ``max_size`` characters of a command's output
+
+    Args:
+        max_size: How many characters to keep, None to keep everything
+    """
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.truncated = False
+        self._chunks = deque()
+        self._size = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        if self.max_size is None:
+            return
+        while self._size > self.max_size:
+            self.truncated = True
+            excess = self._size - self.max_size
+            if len(self._chunks[0]) <= excess:
+                self._size -= len(self._chunks.popleft())
+            else:
+                self._chunks[0] = self._chunks[0][excess:]
+                self._size -= excess
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+
+def iter_channel_chunks(session, timeout=RUNCMD_TIMEOUT):
+    """Read the output of a command from its channel as it arrives, until the command exits
+
+    The channel is waited on with select, so no CPU is burnt while the command runs quietly.
+
+    Args:
+        session: The paramiko channel the command was executed on
+        timeout: Seconds without any output after which :py:class:`socket.timeout` is raised,
+            None to wait forever
+
+    Yields:
+        ``(data, is_stderr)`` tuples of the raw output
+    """
+    streams = [
+        (False, session.recv_ready, session.recv),
+        (True, session.recv_stderr_ready, session.recv_stderr),
+    ]
+    last_output = time()
+    while True:
+        received = False
+        for is_stderr, ready, recv in streams:
+            while ready():
+                data = recv(RECV_CHUNK_SIZE)
+                if not data:
+                    break
+                received = True
+                yield data, is_stderr
+        if received:
+            last_output = time()
+        elif session.exit_status_ready() or session.closed:
+            # all output is received before the exit status, so this was the last of it
+            break
+        elif timeout and time() - last_output > timeout:
+            raise socket.timeout('No output for {} seconds'.format(timeout))
+        else:
+            # wakes up on stdout, stderr and eof, exit status alone has to be polled
+            select.select([session], [], [], EXIT_POLL_INTERVAL)
+
+
+def iter_channel_lines(session, timeout=RUNCMD_TIMEOUT):
+    """Read the output of a command from its channel line by line, until the command exits
+
+    Arguments are the same as for :py:func:`iter_channel_chunks`.
+
+    Yields:
+        ``(line, is_stderr)`` tuples; lines keep their line ending, the last one may lack it
+    """
+    partial_lines = {False: '', True: ''}
+    for data, is_stderr in iter_channel_chunks(session, timeout):
+        lines = (partial_lines[is_stderr] + data).split('\n')
+        partial_lines[is_stderr] = lines.pop()
+        for line in lines:
+            yield line + '\n', is_stderr
+    for is_stderr in (False, True):
+        if partial_lines[is_stderr]:
+            yield partial_lines[is_stderr], is_stderr
+
+
+class TransportPool(object):
+    """Process-wide pool of SSH transports
+
+    :py:class:`SSHClient` instances connecting to the same host and port as the same user share
+    one transport, so the key exchange and authentication happen once per process instead of
+    once per client. Commands and SFTP sessions open their own channels on the shared transport,
+    which works across threads. Containerized and podified appliances share the transport of
+    their host, as their commands are run through it anyway.
+
+    Pooled transports send keepalives, and dead ones are replaced on the next connect.
+
+    ``stats`` counts the ``handshakes`` done, the ``handshakes_saved`` by reusing a transport,
+    the ``reconnects`` of dead transports, and the ``channel_waits`` for a free channel along
+    with the ``channel_wait_time`` they took in seconds.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks = defaultdict(threading.Lock)
+        self._transports = {}
+        self._channel_slots = {}
+        self.stats = {
+            'handshakes': 0,
+            'handshakes_saved': 0,
+            'reconnects': 0,
+            'channel_waits': 0,
+            'channel_wait_time': 0.0,
+        }
+
+    def get_transport(self, key, handshake):
+        """Get the pooled transport for ``key``, calling ``handshake`` to make it if needed
+
+        Args:
+            key: ``(hostname, port, username)`` tuple
+            handshake: Callable connecting a new transport and returning it
+        """
+        with self._lock:
+            key_lock = self._key_locks[key]
+        with key_lock:
+            transport = self._transports.get(key)
+            if transport is not None:
+                if transport.is_active():
+                    self._count('handshakes_saved')
+                    return transport
+                logger.info('Pooled SSH transport to %s is dead, reconnecting', key[0])
+                self._count('reconnects')
+                self._discard(key)
+            transport = handshake()
+            transport.set_keepalive(KEEPALIVE_INTERVAL)
+            self._count('handshakes')
+            with self._lock:
+                self._transports[key] = transport
+                self._channel_slots[transport] = threading.BoundedSemaphore(MAX_CHANNELS)
+            return transport
+
+    def is_pooled(self, transport):
+        return transport in self._channel_slots
+
+    @contextmanager
+    def channel_slot(self, transport):
+        """Wait for a free channel on a pooled transport and hold it for the block"""
+        slot = self._channel_slots.get(transport)
+        if slot is None:
+            yield
+            return
+        if not slot.acquire(False):
+            started = time()
+            slot.acquire()
+            self._count('channel_waits')
+            self._count('channel_wait_time', time() - started)
+        try:
+            yield
+        finally:
+            slot.release()
+
+    def _count(self, stat, value=1):
+        # clients in many threads update the stats at once
+        with self._lock:
+            self.stats[stat] += value
+
+    def _discard(self, key):
+        with self._lock:
+            transport = self._transports.pop(key, None)
+            self._channel_slots.pop(transport, None)
+        if transport is not None:
+            with diaper:
+                transport.close()
+
+    def close_all(self):
+        """Close all pooled transports"""
+        for key in list(self._transports):
+            self._discard(key)
+        logger.debug('SSH transport pool stats: %r', self.stats)
+
+
+ssh_pool = TransportPool()
+at_exit(ssh_pool.close_all)
+
+#: Result of :py:meth:`SSHClient.run_many` for one host, ``duration`` being in seconds
+HostResult = namedtuple('HostResult', ['host', 'result', 'duration'])
+
 _ssh_key_file = project_path.join('.generated_ssh_key')
 _ssh_pubkey_file = project_path.join('.generated_ssh_key.pub')
 
@@ -146,6 +354,12 @@ class SSHClient(paramiko.SSHClient):
     def username(self):
         return self._connect_kwargs.get('username', None)
 
+    @property
+    def pool_key(self):
+        """Key of the transport this client shares in :py:data:`ssh_pool`"""
+        return (
+            self._connect_kwargs['hostname'], self._connect_kwargs.get('port', 22), self.username)
+
     def __repr__(self):
         return "<SSHClient hostname={} port={}>".format(
             repr(self._connect_kwargs.get("hostname")),
@@ -186,6 +400,10 @@ class SSHClient(paramiko.SSHClient):
     def close(self):
         with diaper:
             _client_session.remove(self)
+        if self._transport is not None and ssh_pool.is_pooled(self._transport):
+            # other clients may be using the transport, the pool closes it at exit
+            self._transport = None
+            return
         super(SSHClient, self).close()
 
     @property
@@ -200,9 +418,13 @@ class SSHClient(paramiko.SSHClient):
 
         if not self.connected:
             self._connect_kwargs.update(kwargs)
-            self._check_port()
-            # Only install ssh keys if they aren't installed (or currently being installed)
-            return super(SSHClient, self).connect(**self._connect_kwargs)
+            self._transport = ssh_pool.get_transport(self.pool_key, self._handshake)
+
+    def _handshake(self):
+        # connects a new transport for the pool
+        self._check_port()
+        super(SSHClient, self).connect(**self._connect_kwargs)
+        return self._transport
 
     def open_sftp(self, *args, **kwargs):
         if self.is_container:
@@ -216,22 +438,10 @@ class SSHClient(paramiko.SSHClient):
             self.connect()
         return super(SSHClient, self).get_transport(*args, **kwargs)
 
-    def run_command(
-            self, command, timeout=RUNCMD_TIMEOUT, reraise=False, ensure_host=False,
-            ensure_user=False):
-        """Run a command over SSH.
-
-        Args:
-            command: The command. Supports taking dicts as version picking.
-            timeout: Timeout after which the command execution fails.
-            reraise: Does not muffle the paramiko exceptions in the log.
-            ensure_host: Ensure that the command is run on the machine with the IP given, not any
-                container or such that we might be using by default.
-            ensure_user: Ensure that the command is run as the user we logged in, so in case we are
-                not root, setting this to True will prevent from running sudo.
+    def _exec_command(self, command, timeout, ensure_host, ensure_user):
+        """Start a command and return the channel it runs on
 
-        Returns:
-            A :py:class:`SSHResult` instance.
+        Wraps the command for containers, pods and sudo as described in :py:meth:`run_command`.
         """
         if isinstance(command, dict):
             command = version.pick(command)
@@ -256,34 +466,59 @@ class SSHClient(paramiko.SSHClient):
             logger.info("> Actually running command %r", command)
         command += '\n'
 
-        output = []
+        session = self.get_transport().open_session()
+        if uses_sudo:
+            # We need a pseudo-tty for sudo
+            session.get_pty()
+        if timeout:
+            session.settimeout(float(timeout))
+        session.exec_command(command)
+        return session
+
+    def run_command(
+            self, command, timeout=RUNCMD_TIMEOUT, reraise=False, ensure_host=False,
+            ensure_user=False, max_output=None, line_callback=None):
+        """Run a command over SSH.
+
+        Args:
+            command: The command. Supports taking dicts as version picking.
+            timeout: Timeout after which the command execution fails.
+            reraise: Does not muffle the paramiko exceptions in the log.
+            ensure_host: Ensure that the command is run on the machine with the IP given, not any
+                container or such that we might be using by default.
+            ensure_user: Ensure that the command is run as the user we logged in, so in case we are
+                not root, setting this to True will prevent from running sudo.
+            max_output: Keep only the last ``max_output`` characters of stdout and of stderr in
+                the result, None keeps everything.
+            line_callback: Called with ``(line, is_stderr)`` for every line of output as it
+                arrives, so the output can be processed without keeping it around.
+
+        Returns:
+            A :py:class:`SSHResult` instance, its output being stdout followed by stderr.
+        """
+        stdout = OutputBuffer(max_output)
+        stderr = OutputBuffer(max_output)
+
+        def output():
+            return stdout.getvalue() + stderr.getvalue()
+
         try:
-            session = self.get_transport().open_session()
-            if uses_sudo:
-                # We need a pseudo-tty for sudo
-                session.get_pty()
-            if timeout:
-                session.settimeout(float(timeout))
-            session.exec_command(command)
-            stdout = session.makefile()
-            stderr = session.makefile_stderr()
-            while True:
-                if session.recv_ready:
-                    for line in stdout:
-                        output.append(line)
-                        if self._streaming:
-                            self.f_stdout.write(line)
-
-                if session.recv_stderr_ready:
-                    for line in stderr:
-                        output.append(line)
-                        if self._streaming:
-                            self.f_stderr.write(line)
-
-                if session.exit_status_ready():
-                    break
-            exit_status = session.recv_exit_status()
-            return SSHResult(exit_status, ''.join(output))
+            with ssh_pool.channel_slot(self.get_transport()):
+                session = self._exec_command(command, timeout, ensure_host, ensure_user)
+                for line, is_stderr in iter_channel_lines(session, timeout):
+                    if is_stderr:
+                        stderr.write(line)
+                    else:
+                        stdout.write(line)
+                    if self._streaming:
+                        (self.f_stderr if is_stderr else self.f_stdout).write(line)
+                    if line_callback is not None:
+                        line_callback(line, is_stderr)
+                exit_status = session.recv_exit_status()
+            if stdout.truncated or stderr.truncated:
+                logger.info('Output of %r was truncated to its last %s characters',
+                    command, max_output)
+            return SSHResult(exit_status, output())
         except paramiko.SSHException:
             if reraise:
                 raise
@@ -293,12 +528,116 @@ class SSHClient(paramiko.SSHClient):
             logger.exception(
                 "Command %r timed out. Output before it failed was:\n%r",
                 command,
-                ''.join(output))
+                output())
             raise
 
         # Returning two things so tuple unpacking the return works even if the ssh client fails
         # Return whatever we have in the output
-        return SSHResult(1, ''.join(output))
+        return SSHResult(1, output())
+
+    def iter_command(self, command, timeout=RUNCMD_TIMEOUT, ensure_host=False, ensure_user=False):
+        """Run a command over SSH and yield its stdout line by line as it arrives
+
+        Useful for commands with huge output, like dumping logs, which can then be processed
+        incrementally. Arguments are the same as for :py:meth:`run_command`.
+
+        Stderr is not yielded; the end of it is logged if the command fails. Use
+        :py:meth:`run_command` with ``line_callback`` if the return code is needed.
+
+        The command keeps one of the transport's :py:data:`MAX_CHANNELS` channels until the
+        generator is exhausted or closed. Callers which stop iterating early have to close it,
+        e.g. with :py:func:`contextlib.closing`, otherwise the channel is only freed when the
+        generator is garbage collected, and other clients of the host may block waiting for one.
+        """
+        stderr = OutputBuffer(RECV_CHUNK_SIZE)
+        with ssh_pool.channel_slot(self.get_transport()):
+            session = self._exec_command(command, timeout, ensure_host, ensure_user)
+            try:
+                for line, is_stderr in iter_channel_lines(session, timeout):
+                    if is_stderr:
+                        stderr.write(line)
+                    else:
+                        yield line
+                exit_status = session.recv_exit_status()
+            finally:
+                session.close()
+        if exit_status != 0:
+            logger.warning('Command %r exited with status %s, stderr:\n%s',
+                command, exit_status, stderr.getvalue())
+
+    def get_command_output(self, command, local_file, timeout=RUNCMD_TIMEOUT, ensure_host=False,
+            ensure_user=False):
+        """Run a command over SSH and stream its stdout into a local file as it arrives
+
+        Meant for big or binary output, like a compressed dump, which then never has to be stored
+        on the remote side nor kept in memory. Binary output needs the command to run without
+        sudo, which allocates a pseudo-tty. Other arguments are the same as for
+        :py:meth:`run_command`.
+
+        Args:
+            local_file: Path of the file to write the output to, or a file-like object
+        Returns:
+            A :py:class:`SSHResult` instance, its output being the end of stderr.
+        """
+        stderr = OutputBuffer(RECV_CHUNK_SIZE)
+        if isinstance(local_file, basestring):
+            output_file = open(local_file, 'wb')
+        else:
+            output_file = local_file
+        try:
+            with ssh_pool.channel_slot(self.get_transport()):
+                session = self._exec_command(command, timeout, ensure_host, ensure_user)
+                for data, is_stderr in iter_channel_chunks(session, timeout):
+                    if is_stderr:
+                        stderr.write(data)
+                    else:
+                        output_file.write(data)
+                exit_status = session.recv_exit_status()
+        finally:
+            if output_file is not local_file:
+                output_file.close()
+        return SSHResult(exit_status, stderr.getvalue())
+
+    @classmethod
+    def run_many(cls, hosts, command, max_workers=RUN_MANY_WORKERS, **kwargs):
+        """Run the same command on many hosts at once
+
+        Args:
+            hosts: Iterable of hosts, each being an :py:class:`SSHClient`, an object with an
+                ``ssh_client`` (like an appliance) or a hostname to connect to with the
+                credentials from ``credentials.yaml``
+            command: The command, see :py:meth:`run_command`
+            max_workers: How many hosts to run the command on at once
+            **kwargs: Passed to :py:meth:`run_command`
+
+        Returns:
+            A list of :py:data:`HostResult` in the order of ``hosts``. A host the command
+            could not be run on gets an :py:class:`SSHResult` with return code 1 and the error.
+        """
+        hosts = list(hosts)
+
+        def run(host):
+            started = time()
+            try:
+                if isinstance(host, SSHClient):
+                    client = host
+                elif isinstance(host, basestring):
+                    client = cls(
+                        hostname=host,
+                        username=conf.credentials['ssh']['username'],
+                        password=conf.credentials['ssh']['password'])
+                else:
+                    client = host.ssh_client
+                result = client.run_command(command, **kwargs)
+            except Exception as e:
+                logger.exception('Running %r on %r failed', command, host)
+                result = SSHResult(1, str(e))
+            return HostResult(host, result, time() - started)
+
+        if not hosts:
+            return []
+        with futures.ThreadPoolExecutor(max_workers=min(max_workers, len(hosts))) as executor:
+            return list(executor.map(run, hosts))
 
     def cpu_spike(self, seconds=60, cpus=2, **kwargs):
         """Creates a CPU spike of specific length and processes.
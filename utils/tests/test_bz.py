@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from utils.bz import BugCache
+
+
+def test_bug_cache(tmpdir):
+    cache = BugCache(tmpdir.join("bugzilla").strpath, ttl=60)
+    assert cache.get(123456) is None
+    cache.set(123456, {"id": 123456, "status": "NEW"})
+    assert cache.get(123456) == {"id": 123456, "status": "NEW"}
+    # Another process sees the same cache
+    assert BugCache(cache.path, ttl=60).get(123456) == {"id": 123456, "status": "NEW"}
+    # No temporary files are left behind
+    assert os.listdir(cache.path) == ["123456.pickle"]
+
+
+def test_bug_cache_stale(tmpdir):
+    cache = BugCache(tmpdir.strpath, ttl=60)
+    cache.set(123456, {"id": 123456})
+    stale = time.time() - 120
+    os.utime(os.path.join(tmpdir.strpath, "123456.pickle"), (stale, stale))
+    assert cache.get(123456) is None
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+import json
+from collections import deque
+
+import mock
+import pytest
+
+from fixtures.parallelizer import ParallelSession, SlaveDetail, predict_makespan
+from fixtures.parallelizer.remote import SlaveManager
+
+
+def parallel_session(collection=(), durations=None, slaves=()):
+    # a session without sockets and slave processes, enough for the scheduling logic
+    session = ParallelSession.__new__(ParallelSession)
+    session.collection = list(collection)
+    session.durations = durations or {}
+    session.log = mock.Mock()
+    session.slaves = {slave.id: slave for slave in slaves}
+    session.test_groups = iter([])
+    session._pool = []
+    session.provs = []
+    session.used_prov = set()
+    session.predicted_makespan = None
+    session.distribution_start = None
+    session.failed_slave_test_groups = deque()
+    session.sent_tests = sum(len(slave.tests) for slave in slaves)
+    session.batch_reports = False
+    session.send = mock.Mock()
+    session.print_message = mock.Mock()
+    return session
+
+
+def slave_detail(tests=(), queue_len=0, provider_allocation=(), running=True):
+    slave = SlaveDetail(url='https://appliance', tests=set(tests),
+        process=mock.Mock() if running else None, provider_allocation=list(provider_allocation))
+    slave.queue_len = queue_len
+    return slave
+
+
+def test_duration_item_generator_longest_first():
+    session = parallel_session(
+        collection=[
+            'a.py::test_one', 'a.py::test_two',
+            'b.py::test_one',
+            'c.py::test_one[x]', 'c.py::test_two[x]'],
+        durations={
+            'a.py::test_one': 1, 'a.py::test_two': 1,
+            'b.py::test_one': 10,
+            'c.py::test_one[x]': 2, 'c.py::test_two[x]': 2})
+    assert list(session._duration_item_generator()) == [
+        ['b.py::test_one'],
+        ['c.py::test_one[x]', 'c.py::test_two[x]'],
+        ['a.py::test_one', 'a.py::test_two']]
+
+
+def test_duration_item_generator_unknown_tests():
+    # tests without history count as long as the median known test
+    session = parallel_session(
+        collection=['a.py::test_one', 'b.py::test_one', 'c.py::test_new', 'd.py::test_one'],
+        durations={'a.py::test_one': 1, 'b.py::test_one': 5, 'd.py::test_one': 9})
+    assert session._group_duration(['c.py::test_new']) == 5
+    assert list(session._duration_item_generator()) == [
+        ['d.py::test_one'], ['b.py::test_one'], ['c.py::test_new'], ['a.py::test_one']]
+
+
+def test_duration_item_generator_no_history():
+    # without any history every test counts the same, so the biggest groups go first
+    collection = ['a.py::test_one', 'b.py::test_one', 'b.py::test_two']
+    session = parallel_session(collection=collection)
+    assert list(session._duration_item_generator()) == [collection[1:], collection[:1]]
+
+
+@pytest.mark.parametrize(('durations', 'num_slaves', 'makespan'), [
+    ([], 2, 0),
+    ([5, 3, 3, 2, 2, 1], 1, 16),
+    ([5, 3, 3, 2, 2, 1], 2, 8),
+    ([5, 3, 3, 2, 2, 1], 3, 6),
+    ([1, 2, 3, 5], 2, 7),
+    ([5, 3], 0, 8),
+], ids=['empty', 'one_slave', 'two_slaves', 'three_slaves', 'shortest_first', 'no_slaves'])
+def test_predict_makespan(durations, num_slaves, makespan):
+    assert predict_makespan(durations, num_slaves) == makespan
+
+
+def test_steal_victim():
+    idle = slave_detail(provider_allocation=['rhevm'])
+    busy = slave_detail(queue_len=5)
+    same_provider = slave_detail(queue_len=3, provider_allocation=['rhevm'])
+    other_provider = slave_detail(queue_len=8, provider_allocation=['vsphere'])
+    draining = slave_detail(queue_len=10)
+    draining.draining = True
+    almost_done = slave_detail(queue_len=1)
+    dead = slave_detail(queue_len=20, running=False)
+    stolen_from = slave_detail(queue_len=30)
+    stolen_from.steal_for = busy
+    session = parallel_session(slaves=[
+        idle, busy, same_provider, other_provider, draining, almost_done, dead, stolen_from])
+    # the busiest slave whose providers are already set up on the idle slave
+    assert session._steal_victim(idle) is busy
+    busy.queue_len = 2
+    assert session._steal_victim(idle) is same_provider
+    assert session._steal_victim(slave_detail()) is busy
+
+
+def test_steal_tests():
+    collection = ['a.py::test_{}'.format(i) for i in range(5)]
+    idle = slave_detail()
+    busy = slave_detail(tests=collection, queue_len=4)
+    session = parallel_session(collection=collection, slaves=[idle, busy])
+
+    # nothing left in the pool, so the reply to the idle slave waits for the busy slave
+    session.handle_need_tests(idle)
+    assert busy.steal_for is idle
+    assert not session.send.called
+
+    # the busy slave is asked to release half of its queue in the reply to its next report
+    session.ack_or_release(busy, 'runtest_logstart')
+    session.send.assert_called_once_with(busy, {'release': 2})
+    session.ack_or_release(busy, 'runtest_logreport')
+    session.send.assert_called_with(busy, 'ack runtest_logreport')
+
+    session.send.reset_mock()
+    session.tests_released(busy, collection[3:])
+    session.send.assert_called_once_with(idle, collection[3:])
+    assert busy.steal_for is None and not busy.steal_sent
+    assert busy.queue_len == 2
+    assert busy.tests == set(collection[:3])
+    assert idle.tests == set(collection[3:])
+    assert session.sent_tests == len(collection)
+
+
+def test_steal_retry_with_queued_test():
+    collection = ['a.py::test_{}'.format(i) for i in range(5)]
+    idle = slave_detail(tests=collection[:1])
+    busy = slave_detail(tests=collection[1:], queue_len=3)
+    session = parallel_session(collection=collection, slaves=[idle, busy])
+
+    # the idle slave still holds its last test, it runs it instead of waiting on the busy slave
+    session.handle_need_tests(idle)
+    session.send.assert_called_once_with(idle, 'retry')
+    assert busy.steal_for is None
+
+    # and asks again once it's done
+    idle.tests.clear()
+    session.send.reset_mock()
+    session.handle_need_tests(idle)
+    assert busy.steal_for is idle
+    assert not session.send.called
+
+
+def test_slave_test_generator_retry():
+    slave = SlaveManager.__new__(SlaveManager)
+    slave.queue = deque()
+    slave.send_event = mock.Mock(side_effect=[['a', 'b'], 'retry', ['c'], []])
+    slave._get_item = lambda nodeid: nodeid
+    # the last queued test runs without a next item when the master says retry
+    assert list(slave._test_generator()) == [('a', 'b'), ('b', None), ('c', None)]
+    assert slave.send_event.call_count == 4
+
+
+def test_steal_nothing_released():
+    collection = ['a.py::test_{}'.format(i) for i in range(3)]
+    idle = slave_detail()
+    busy = slave_detail(tests=collection, queue_len=2)
+    session = parallel_session(collection=collection, slaves=[idle, busy])
+    session.handle_need_tests(idle)
+    session.ack_or_release(busy, 'runtest_logstart')
+    busy.queue_len = 0
+    session.send.reset_mock()
+    # the busy slave started its tests in the meantime, and has none left to steal
+    session.tests_released(busy, [])
+    session.send.assert_called_once_with(idle, [])
+
+
+def test_cancel_steals_idle_slave_died():
+    collection = ['a.py::test_{}'.format(i) for i in range(5)]
+    idle = slave_detail()
+    busy = slave_detail(tests=collection, queue_len=4)
+    session = parallel_session(collection=collection, slaves=[idle, busy])
+    session.handle_need_tests(idle)
+    session.ack_or_release(busy, 'runtest_logstart')
+
+    idle.process = None
+    session._cancel_steals(idle)
+    assert busy.steal_for is None
+    # the release in flight goes back to the master, to be sent to the next slave asking
+    session.tests_released(busy, collection[3:])
+    assert list(session.failed_slave_test_groups) == [collection[3:]]
+    assert busy.tests == set(collection[:3])
+    assert session.sent_tests == 3
+
+
+def test_cancel_steals_busy_slave_died():
+    collection = ['a.py::test_{}'.format(i) for i in range(5)]
+    idle = slave_detail()
+    busy = slave_detail(tests=collection, queue_len=4)
+    session = parallel_session(collection=collection, slaves=[idle, busy])
+    session.handle_need_tests(idle)
+
+    # the slave audit redistributes the tests of the dead slave, then cancels its steals
+    busy.process = None
+    session.failed_slave_test_groups.append(busy.tests)
+    busy.tests = set()
+    session.sent_tests = 0
+    session._cancel_steals(busy)
+    assert busy.steal_for is None and not busy.steal_sent
+    (slave, tests), _ = session.send.call_args
+    assert slave is idle
+    assert sorted(tests) == collection
+    assert idle.tests == set(collection)
+
+
+def test_release_while_draining():
+    collection = ['a.py::test_{}'.format(i) for i in range(4)]
+    draining = slave_detail(tests=collection, queue_len=3)
+    draining.draining = True
+    session = parallel_session(collection=collection, slaves=[draining])
+
+    # a draining slave gives its whole queue back, and gets no more tests
+    session.ack_or_release(draining, 'runtest_logstart')
+    session.send.assert_called_once_with(draining, {'release': 4})
+    session.tests_released(draining, collection[1:])
+    assert list(session.failed_slave_test_groups) == [collection[1:]]
+    assert draining.queue_len == 0
+    assert draining.tests == set(collection[:1])
+    assert session.sent_tests == 1
+
+    session.send.reset_mock()
+    session.handle_need_tests(draining)
+    session.send.assert_called_once_with(draining, [])
+
+
+def test_drain_slave():
+    draining = slave_detail()
+    draining.process.poll.return_value = None
+    session = parallel_session(slaves=[draining])
+    session.config = mock.Mock()
+    session.interrupt = mock.Mock()
+    session.remove_slave(draining.url)
+
+    # the slave keeps running its current test
+    session._slave_audit()
+    assert not session.interrupt.called
+    assert not draining.forbid_restart
+    assert session.slaves == {draining.id: draining}
+
+    # and is removed without a restart once it has exited
+    draining.process.poll.return_value = 0
+    session._slave_audit()
+    assert not session.interrupt.called
+    assert draining.forbid_restart
+    assert session.slaves == {}
+
+
+def test_handle_control_malformed():
+    session = parallel_session()
+    session.control_sock = mock.Mock()
+    session.control_sock.recv_json.side_effect = ValueError('No JSON object could be decoded')
+    session.handle_control()
+    session.control_sock.send_json.assert_called_once_with(
+        {'error': 'No JSON object could be decoded'})
+
+
+def test_handle_batch():
+    slave = slave_detail()
+    session = parallel_session(slaves=[slave])
+    session.handle_event = mock.Mock()
+    session.handle_batch(slave, {'seq': 1, 'events': [
+        {'_event_name': 'message', 'message': 'collecting'},
+        {'_event_name': 'runtest_logstart', 'nodeid': 'a.py::test_one', 'remaining': 0}]})
+    assert session.handle_event.call_args_list == [
+        mock.call(slave, 'message', {'message': 'collecting'}),
+        mock.call(slave, 'runtest_logstart', {'nodeid': 'a.py::test_one', 'remaining': 0})]
+    assert slave.batch_seq == 1
+
+
+def test_handle_batch_lost_reports():
+    slave = slave_detail(tests=['a.py::test_one'], queue_len=1)
+    session = parallel_session(slaves=[slave])
+    session.handle_event = mock.Mock()
+    session.handle_batch(slave, {'seq': 1, 'events': []})
+
+    # batch 2 got lost, the slave is killed and its tests are left to the slave audit
+    session.handle_batch(slave, {'seq': 3, 'events': [
+        {'_event_name': 'runtest_logstart', 'nodeid': 'a.py::test_one', 'remaining': 0}]})
+    slave.process.kill.assert_called_once_with()
+    assert not session.handle_event.called
+    assert slave.batch_seq is None
+    assert slave.tests == {'a.py::test_one'}
+    assert slave.queue_len == 1
+
+
+@pytest.mark.parametrize(('pid', 'batch_seq', 'received'), [
+    (None, 0, True),
+    (1000, 0, True),
+    (999, 0, False),
+    (1000, None, False),
+], ids=['acked_reports', 'current_process', 'dead_process', 'lost_reports'])
+def test_recv(pid, batch_seq, received):
+    slave = slave_detail()
+    slave.process.pid = 1000
+    slave.batch_seq = batch_seq
+    session = parallel_session(slaves=[slave])
+    event = {'_event_name': 'need_tests'}
+    if pid is not None:
+        event['_pid'] = pid
+    session.sock = mock.Mock()
+    session.sock.recv_multipart.return_value = [slave.id, '', json.dumps(event)]
+    with mock.patch('fixtures.parallelizer.zmq') as zmq:
+        zmq.zmq_poll.return_value = [(session.sock, zmq.POLLIN)]
+        if received:
+            assert session.recv() == (slave, {}, 'need_tests')
+        else:
+            assert session.recv() == (None, None, None)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+
+from utils.perf import sync_logs
+
+REMOTE_LOG_DIR = '/var/www/miq/vmdb/log/'
+
+
+class LocalSFTP(object):
+    """Serves the appliance's log directory from a local one
+
+    The name and the start offset of every download are recorded in ``downloaded``.
+    """
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.downloaded = []
+
+    def _local(self, remote_path):
+        assert remote_path.startswith(REMOTE_LOG_DIR)
+        return self.log_dir.join(remote_path[len(REMOTE_LOG_DIR):]).strpath
+
+    def get(self, remote_path, local_path):
+        self.downloaded.append((os.path.basename(remote_path), 0))
+        shutil.copy(self._local(remote_path), local_path)
+
+    def stat(self, remote_path):
+        return os.stat(self._local(remote_path))
+
+    def open(self, remote_path, mode):
+        sftp = self
+
+        class RemoteFile(file):
+            def seek(self, offset, *args):
+                sftp.downloaded.append((os.path.basename(remote_path), offset))
+                return super(RemoteFile, self).seek(offset, *args)
+
+        return RemoteFile(self._local(remote_path), 'rb')
+
+    def close(self):
+        pass
+
+
+class LocalSSHClient(object):
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.sftp = LocalSFTP(log_dir)
+
+    def run_command(self, command):
+        assert command == 'ls -1 {}evm.log-*'.format(REMOTE_LOG_DIR)
+        rotated = sorted(path.basename for path in self.log_dir.listdir('evm.log-*'))
+        return (0 if rotated else 2), ''.join(
+            '{}{}\n'.format(REMOTE_LOG_DIR, name) for name in rotated)
+
+    def open_sftp(self):
+        return self.sftp
+
+
+def test_sync_logs(tmpdir):
+    remote_dir = tmpdir.mkdir('remote')
+    local_dir = tmpdir.join('local')
+    ssh_client = LocalSSHClient(remote_dir)
+    sftp = ssh_client.sftp
+
+    remote_dir.join('evm.log').write('first\nsecond\n')
+    assert sync_logs(ssh_client, 'evm', local_dir) == [local_dir.join('evm.log').strpath]
+    assert local_dir.join('evm.log').read() == 'first\nsecond\n'
+
+    # only what was appended since is downloaded
+    del sftp.downloaded[:]
+    remote_dir.join('evm.log').write('third\n', mode='a')
+    sync_logs(ssh_client, 'evm', local_dir)
+    assert sftp.downloaded == [('evm.log', len('first\nsecond\n'))]
+    assert local_dir.join('evm.log').read() == 'first\nsecond\nthird\n'
+
+    # the log is rotated, the rotated log is downloaded once and the new log from the start
+    remote_dir.join('evm.log').move(remote_dir.join('evm.log-20170301.gz'))
+    remote_dir.join('evm.log').write('fourth\n')
+    del sftp.downloaded[:]
+    assert sync_logs(ssh_client, 'evm', local_dir) == [
+        local_dir.join('evm.log-20170301.gz').strpath, local_dir.join('evm.log').strpath]
+    assert sftp.downloaded == [('evm.log-20170301.gz', 0), ('evm.log', 0)]
+    assert local_dir.join('evm.log-20170301.gz').read() == 'first\nsecond\nthird\n'
+    assert local_dir.join('evm.log').read() == 'fourth\n'
+
+    # the rotated log isn't downloaded again
+    del sftp.downloaded[:]
+    sync_logs(ssh_client, 'evm', local_dir)
+    assert sftp.downloaded == [('evm.log', len('fourth\n'))]
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+import csv
+import gzip
+import io
+import re
+
+import pytest
+
+from utils import perf_message_stats
+from utils.perf import generate_statistics
+from utils.perf_message_stats import (PerfCheckpoint, evm_to_messages,
+    messages_to_hourly_buckets, messages_to_statistics_csv, provision_hour_buckets)
+
+MSG_FILTERS = {
+    '-hourly': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"hourly\"'),
+    '-daily': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"daily\"'),
+}
+
+
+def evm_line(ts, pid, text):
+    return '[----] I, [2017-03-01T{} #{}:2ad4e7c]  INFO -- : {}\n'.format(ts, pid, text)
+
+
+def put(ts, msg_id, cmd, args=''):
+    return evm_line(ts, 1200, 'MIQ(MiqQueue.put) Message id: [{}],  Zone: [default], '
+        'Command: [{}], Timeout: [600], Priority: [100], Args: [{}]'.format(msg_id, cmd, args))
+
+
+def get(ts, msg_id, deq_time):
+    return evm_line(ts, 1300, 'MIQ(MiqQueue.get_via_drb) Message id: [{}], MiqWorker id: [7], '
+        'Dequeued in: [{}] seconds'.format(msg_id, deq_time))
+
+
+def delivered(ts, msg_id, del_time):
+    return evm_line(ts, 1300, 'MIQ(MiqQueue.delivered) Message id: [{}], State: [ok], '
+        'Delivered in [{}] seconds'.format(msg_id, del_time))
+
+
+EVM_LOG = ''.join([
+    evm_line('10:59:50.000001', 1100, 'MIQ(EmsRefresh.refresh) Refreshing all targets...'),
+    put('10:59:58.100000', 1, 'Storage.scan_timer'),
+    get('11:00:01.100000', 1, 3.0),
+    put('11:10:00.200000', 2, 'Storage.scan_timer'),
+    delivered('11:00:02.600000', 1, 1.5),
+    get('11:10:02.200000', 2, 2.0),
+    put('11:20:00.300000', 3, 'Metric::Rollup.perf_rollup',
+        '"2017-03-01T10:00:00Z", "hourly"'),
+    delivered('11:10:02.700000', 2, 0.5),
+    get('11:20:10.300000', 3, 10.0),
+    delivered('11:20:14.550000', 3, 4.25),
+    put('11:30:00.400000', 4, 'Storage.scan_timer'),
+    delivered('11:45:00.000000', 999, 2.0),
+    put('12:05:00.500000', 5, 'Metric::Rollup.perf_rollup', '"2017-03-01T00:00:00Z", "daily"'),
+    get('12:05:01.000000', 5, 0.5),
+    delivered('12:05:01.000000', 5, 0.0),
+    put('12:30:00.600000', 6, 'Metric::Rollup.perf_rollup',
+        '"2017-03-01T11:00:00Z", "hourly"'),
+    get('12:30:00.900000', 6, 0.25),
+    delivered('12:30:03.650000', 6, 2.75),
+])
+
+WORKER_LOG = ''.join([
+    evm_line('10:59:55.000000', 1000, 'MIQ(PriorityWorker) ID [7], PID [1300], GUID [3f1a], '
+        'Zone: [default], Active Roles: [] started'),
+    evm_line('12:50:00.000000', 1000, 'MIQ(MiqServer.stop_worker) Worker exiting. ID [7]'),
+])
+
+TOP_LOG = ''.join(
+    'miqtop: timesync: date time is-> Wed Mar 01 06:00:00 EST 2017 -0500\n'
+    'top - 06:{0:02d}:05 up 1 day,  2:03,  0 users,  load average: 0.20, 0.30, 0.40\n'
+    'Cpu(s): {0}.7%us,  1.2%sy,  2.1%ni, 80.0%id,  1.7%wa,  0.0%hi,  0.1%si,  1.3%st\n'
+    'Mem:   5990952k total,  4864016k used,  1126936k free,   441444k buffers\n'
+    'Swap:  9957368k total,        0k used,  9957368k free,  1153156k cached\n'
+    '1300 2320 root 30 10 324m {0}.8m 2444 S 0.0 0.2 0:09.38 worker.rb\n'.format(minute)
+    for minute in range(4))
+
+
+def old_commands(messages):
+    # how evm_to_messages grouped the times by command, one message at a time
+    msg_cmds = {}
+    for msg_id in sorted(messages.keys()):
+        msg = messages[msg_id]
+        times = msg_cmds.setdefault(msg.msg_cmd, {'total': [], 'queue': [], 'execute': []})
+        if msg.total_time != 0:
+            times['total'].append(round(msg.total_time, 2))
+            times['queue'].append(round(msg.deq_time, 2))
+            times['execute'].append(round(msg.del_time, 2))
+    return msg_cmds
+
+
+def old_statistics_csv(messages):
+    # how messages_to_statistics_csv collected the times, one message at a time
+    all_statistics = {}
+    for msg_id in messages.keys():
+        msg = messages[msg_id]
+        statistics = all_statistics.setdefault(
+            msg.msg_cmd, {'puts': 0, 'gets': 0, 'deq': [], 'del': [], 'total': []})
+        if msg.del_time > 0:
+            statistics['del'].append(float(msg.del_time))
+            statistics['gets'] += 1
+        statistics['deq'].append(float(msg.deq_time))
+        statistics['total'].append(float(msg.total_time))
+        statistics['puts'] += 1
+    output = io.BytesIO()
+    csvfile = csv.writer(output)
+    for cmd in sorted(all_statistics):
+        statistics = all_statistics[cmd]
+        row = [cmd, statistics['puts'], statistics['gets']]
+        row.extend(generate_statistics(statistics['deq'], 3))
+        row.extend(generate_statistics(statistics['del'], 3))
+        row.extend(generate_statistics(statistics['total'], 3))
+        csvfile.writerow(row)
+    return output.getvalue().splitlines()
+
+
+def old_hourly_buckets(messages, test_start, test_end):
+    # messages_to_hourly_buckets before the columnar store, verbatim, fed the messages in id order
+    messages = dict((msg_id, messages[msg_id]) for msg_id in messages.keys())
+    hr_bkt = {}
+    # Hour buckets look like: hr_bkt[msg_cmd][msg_date][msg_hour] = MiqMsgBucket()
+    for msg in sorted(messages, key=int):
+        # put on queue, deals with queuing:
+        msg_cmd = messages[msg].msg_cmd
+        putdate = messages[msg].puttime[:10]
+        puthour = messages[msg].puttime[11:13]
+        if msg_cmd not in hr_bkt:
+            hr_bkt[msg_cmd] = provision_hour_buckets(test_start, test_end)
+
+        hr_bkt[msg_cmd][putdate][puthour].total_put += 1
+        hr_bkt[msg_cmd][putdate][puthour].sum_deq += messages[msg].deq_time
+        if (hr_bkt[msg_cmd][putdate][puthour].min_deq == 0 or
+                hr_bkt[msg_cmd][putdate][puthour].min_deq > messages[msg].deq_time):
+            hr_bkt[msg_cmd][putdate][puthour].min_deq = messages[msg].deq_time
+        if (hr_bkt[msg_cmd][putdate][puthour].max_deq == 0 or
+                hr_bkt[msg_cmd][putdate][puthour].max_deq < messages[msg].deq_time):
+            hr_bkt[msg_cmd][putdate][puthour].max_deq = messages[msg].deq_time
+        hr_bkt[msg_cmd][putdate][puthour].avg_deq = \
+            hr_bkt[msg_cmd][putdate][puthour].sum_deq / hr_bkt[msg_cmd][putdate][puthour].total_put
+
+        # Get time is when the message is delivered
+        getdate = messages[msg].gettime[:10]
+        gethour = messages[msg].gettime[11:13]
+
+        hr_bkt[msg_cmd][getdate][gethour].total_get += 1
+        hr_bkt[msg_cmd][getdate][gethour].sum_del += messages[msg].del_time
+        if (hr_bkt[msg_cmd][getdate][gethour].min_del == 0 or
+                hr_bkt[msg_cmd][getdate][gethour].min_del > messages[msg].del_time):
+            hr_bkt[msg_cmd][getdate][gethour].min_del = messages[msg].del_time
+        if (hr_bkt[msg_cmd][getdate][gethour].max_del == 0 or
+                hr_bkt[msg_cmd][getdate][gethour].max_del < messages[msg].del_time):
+            hr_bkt[msg_cmd][getdate][gethour].max_del = messages[msg].del_time
+
+        hr_bkt[msg_cmd][getdate][gethour].avg_del = \
+            hr_bkt[msg_cmd][getdate][gethour].sum_del / hr_bkt[msg_cmd][getdate][gethour].total_get
+    return hr_bkt
+
+
+@pytest.fixture
+def evm_log(tmpdir):
+    log = tmpdir.join('evm.log')
+    log.write(EVM_LOG)
+    return log
+
+
+@pytest.mark.parametrize('processes', [1, 3], ids=['single_part', 'three_parts'])
+def test_evm_to_messages(evm_log, monkeypatch, processes):
+    # split the log into parts even though it's tiny
+    monkeypatch.setattr(perf_message_stats, 'LOG_PART_SIZE', len(EVM_LOG) // 3)
+    messages, msg_cmds, test_start, test_end, line_count = evm_to_messages(
+        evm_log.strpath, MSG_FILTERS, processes)
+    assert line_count == 18
+    assert test_start == '2017-03-01 10:59:50.000001'
+    assert test_end == '2017-03-01 12:30:03.650000'
+    assert sorted(messages.keys()) == ['1', '2', '3', '4', '5', '6']
+    assert dict(messages['3']) == {
+        'msg_id': "'3'", 'msg_cmd': 'Metric::Rollup.perf_rollup-hourly',
+        'msg_args': '"2017-03-01T10:00:00Z", "hourly"', 'pid_put': '1200', 'pid_get': '1300',
+        'puttime': '2017-03-01 11:20:00.300000', 'gettime': '2017-03-01 11:20:10.300000',
+        'deq_time': 10.0, 'del_time': 4.25, 'total_time': 14.25}
+    assert dict(messages['4'])['gettime'] == ''
+    assert dict(messages['4'])['pid_get'] == ''
+    assert msg_cmds == old_commands(messages)
+    assert msg_cmds['Storage.scan_timer'] == {
+        'total': [4.5, 2.5], 'queue': [3.0, 2.0], 'execute': [1.5, 0.5]}
+
+
+def test_messages_to_statistics_csv(evm_log, tmpdir, monkeypatch):
+    monkeypatch.setattr(perf_message_stats, 'log_path', tmpdir)
+    messages = evm_to_messages(evm_log.strpath, MSG_FILTERS, 1)[0]
+    messages_to_statistics_csv(messages, 'queue-statistics.csv')
+    lines = tmpdir.join('csv_output', 'queue-statistics.csv').read().splitlines()
+    assert lines[0].startswith('cmd,puts,gets,deq_time_samples,')
+    assert lines[1:] == old_statistics_csv(messages)
+
+
+def test_messages_to_hourly_buckets(evm_log):
+    messages, msg_cmds, test_start, test_end, line_count = evm_to_messages(
+        evm_log.strpath, MSG_FILTERS, 1)
+    hr_bkt = messages_to_hourly_buckets(messages, test_start, test_end)
+    old_hr_bkt = old_hourly_buckets(messages, test_start, test_end)
+    # the old loop let a zero become the minimum of a bucket until a later value replaced it,
+    # message 4 wasn't got yet and came after message 2 in the same hour
+    assert old_hr_bkt['Storage.scan_timer']['2017-03-01']['11'].min_deq == 0
+    assert hr_bkt['Storage.scan_timer']['2017-03-01']['11'].min_deq == 2.0
+    old_hr_bkt['Storage.scan_timer']['2017-03-01']['11'].min_deq = 2.0
+    assert sorted(hr_bkt) == sorted(old_hr_bkt) == sorted(msg_cmds)
+    for cmd in old_hr_bkt:
+        assert sorted(hr_bkt[cmd]) == sorted(old_hr_bkt[cmd]) == ['', '2017-03-01']
+        for date in old_hr_bkt[cmd]:
+            assert sorted(hr_bkt[cmd][date]) == sorted(old_hr_bkt[cmd][date])
+            for hour, bk in old_hr_bkt[cmd][date].items():
+                assert str(hr_bkt[cmd][date][hour]) == str(bk), (cmd, date, hour)
+    # message 4 wasn't got yet
+    assert hr_bkt['Storage.scan_timer'][''][''].total_get == 1
+    assert hr_bkt['Storage.scan_timer']['2017-03-01']['11'].total_put == 2
+
+
+def checkpoint_state(checkpoint):
+    messages = checkpoint.messages.messages
+    workers = checkpoint.workers.replay()[0]
+    return {
+        'messages': dict((msg_id, dict(messages[msg_id])) for msg_id in messages.keys()),
+        'orphans': checkpoint.messages.orphans,
+        'test_start': checkpoint.messages.test_start,
+        'test_end': checkpoint.messages.test_end,
+        'msg_lc': checkpoint.msg_lc,
+        'workers': dict((worker_id, dict(worker)) for worker_id, worker in workers.items()),
+        'top_app': checkpoint.top.top_app,
+        'top_workers': checkpoint.top.top_workers,
+        'tp_lc': checkpoint.tp_lc,
+    }
+
+
+def run_checkpoint(checkpoint_file, evm_file, top_file):
+    checkpoint = PerfCheckpoint.load(checkpoint_file)
+    checkpoint.parse_evm(evm_file, 1)
+    checkpoint.parse_top(top_file, checkpoint.workers.replay()[0])
+    checkpoint.save()
+    return checkpoint
+
+
+def test_perf_checkpoint_increments(tmpdir):
+    evm_lines = (WORKER_LOG + EVM_LOG).splitlines(True)
+    evm_lines.append(evm_lines.pop(1))
+    top_lines = TOP_LOG.splitlines(True)
+
+    full_dir = tmpdir.mkdir('full')
+    full_dir.join('evm.log').write(''.join(evm_lines))
+    full_dir.join('top_output.log').write(''.join(top_lines))
+    full = run_checkpoint(None, full_dir.join('evm.log').strpath,
+        full_dir.join('top_output.log').strpath)
+    assert len(full.messages.messages) == 6
+    assert len(full.top.top_app['datetimes']) == 4
+    assert len(full.top.top_workers[7]['res']) == 4
+
+    log_dir = tmpdir.mkdir('incremental')
+    checkpoint_file = log_dir.join('checkpoint.pickle').strpath
+    evm = log_dir.join('evm.log')
+    top = log_dir.join('top_output.log')
+    # the logs are still being written to, the incomplete lines are left for the next run
+    evm.write(''.join(evm_lines[:9]) + evm_lines[9][:30])
+    top.write(''.join(top_lines[:8]) + top_lines[8][:10])
+    first = run_checkpoint(checkpoint_file, evm.strpath, top.strpath)
+    assert first.msg_lc == 9
+    assert first.tp_lc == 8
+
+    # then evm.log is rotated and a new one is started, top_output.log is appended to
+    rotated = log_dir.join('evm.log-20170301.gz').strpath
+    with gzip.open(rotated, 'wb') as rotated_log:
+        rotated_log.write(''.join(evm_lines[:14]))
+    evm.write(''.join(evm_lines[14:]))
+    top.write(''.join(top_lines))
+    second = run_checkpoint(checkpoint_file, [rotated, evm.strpath], top.strpath)
+    assert checkpoint_state(second) == checkpoint_state(full)
+
+    # nothing new was logged since
+    assert PerfCheckpoint.load(checkpoint_file).pending(rotated) is None
+    assert PerfCheckpoint.load(checkpoint_file).pending(evm.strpath) is None
+    third = run_checkpoint(checkpoint_file, [rotated, evm.strpath], top.strpath)
+    assert checkpoint_state(third) == checkpoint_state(full)
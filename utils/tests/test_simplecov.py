@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import tarfile
+
+from utils.simplecov import SimplecovMerger
+
+
+def resultset(name, coverage):
+    return json.dumps({name: {'timestamp': 0, 'coverage': coverage}})
+
+
+def test_simplecov_merge(tmpdir):
+    archive = tmpdir.join('coverage.tgz').strpath
+    with tarfile.open(archive, 'w:gz') as tar:
+        for i, data in enumerate([
+                resultset('1', {'/a.rb': [None, 1, 0, 2], '/b.rb': [0, None]}),
+                resultset('2', {'/a.rb': [None, 0, 3, 0, 1], '/c.rb': [None]}),
+                '{not json']):
+            info = tarfile.TarInfo('coverage/10.0.0.1/{}/.resultset.json'.format(i))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    merger = SimplecovMerger()
+    assert merger.add_archive(archive) == 2
+    assert merger.summary == {'covered_lines': 4, 'relevant_lines': 5, 'covered_percent': 80.0}
+
+    merger.write_resultset(tmpdir.join('.resultset.json').strpath)
+    merged = json.load(tmpdir.join('.resultset.json').open())
+    assert merged['merged']['coverage'] == {
+        '/a.rb': [None, 1, 3, 2, 1], '/b.rb': [0, None], '/c.rb': [None]}
+
+    merger.save(tmpdir.join('hits.npz').strpath)
+    loaded = SimplecovMerger.load(tmpdir.join('hits.npz').strpath)
+    assert loaded.summary == merger.summary
+    assert loaded.resultsets == 2
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
+import gzip
+import threading
+
+import mock
 import pytest
 
+from utils import ssh
+
 pytestmark = [
     pytest.mark.nondestructive,
     pytest.mark.skip_selenium,
@@ -26,3 +32,93 @@ def test_scp_client_can_put_a_file(appliance, tmpdir):
     assert "content" in tmpfile.read()
     # Clean up the server
     appliance.ssh_client.run_command("rm -f /tmp/{}".format(tmpfile.basename))
+
+
+def test_ssh_client_run_command_max_output(appliance):
+    # Only the end of the output is kept when it is capped
+    result = appliance.ssh_client.run_command('seq 1 1000', max_output=10)
+    assert result.rc == 0
+    assert len(result.output) == 10
+    assert result.output.endswith('999\n1000\n')
+
+
+def test_ssh_client_run_command_line_callback(appliance):
+    lines = []
+    appliance.ssh_client.run_command(
+        'echo out; echo err >&2', line_callback=lambda line, is_stderr: lines.append(
+            (line, is_stderr)))
+    assert sorted(lines) == [('err\n', True), ('out\n', False)]
+
+
+def test_ssh_client_iter_command(appliance):
+    assert list(appliance.ssh_client.iter_command('seq 1 3')) == ['1\n', '2\n', '3\n']
+
+
+def test_ssh_client_shares_pooled_transport(appliance):
+    # Clients for the same host and user reuse the transport instead of handshaking again
+    client = appliance.ssh_client()
+    other_client = appliance.ssh_client()
+    assert client.get_transport() is other_client.get_transport()
+    client.close()
+    assert other_client.run_command('true').rc == 0
+
+
+def test_ssh_client_run_many(appliance):
+    from utils.ssh import SSHClient
+    results = SSHClient.run_many([appliance, appliance.ssh_client], 'echo Testing!')
+    assert [host_result.host for host_result in results] == [appliance, appliance.ssh_client]
+    for host_result in results:
+        assert host_result.result.rc == 0
+        assert 'Testing!' in host_result.result.output
+        assert host_result.duration >= 0
+
+
+def test_ssh_client_get_command_output(appliance, tmpdir):
+    # Binary output ends up in the local file byte for byte
+    local_file = tmpdir.join('output.gz')
+    result = appliance.ssh_client.get_command_output('seq 1 1000 | gzip -c', str(local_file))
+    assert result.rc == 0
+    with gzip.open(str(local_file)) as output:
+        assert output.read() == ''.join('{}\n'.format(i) for i in range(1, 1001))
+
+
+@pytest.fixture
+def pooled_transport(monkeypatch):
+    pool = ssh.TransportPool()
+    monkeypatch.setattr(ssh, 'ssh_pool', pool)
+    transport = mock.Mock()
+    transport.is_active.return_value = True
+    pool.get_transport(('appliance', 22, 'root'), lambda: transport)
+    return transport
+
+
+def test_transport_pool_stats_threads(pooled_transport):
+    # every client reusing the transport is counted, even when they connect at once
+    def connect():
+        for _ in range(1000):
+            ssh.ssh_pool.get_transport(('appliance', 22, 'root'), mock.Mock())
+    threads = [threading.Thread(target=connect) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ssh.ssh_pool.stats['handshakes'] == 1
+    assert ssh.ssh_pool.stats['handshakes_saved'] == 8000
+
+
+def test_ssh_client_iter_command_closed_early(pooled_transport, monkeypatch):
+    session = mock.Mock()
+    monkeypatch.setattr(ssh, 'iter_channel_lines',
+        lambda session, timeout: iter([('1\n', False), ('2\n', False)]))
+    client = ssh.SSHClient.__new__(ssh.SSHClient)
+    client.get_transport = lambda: pooled_transport
+    client._exec_command = mock.Mock(return_value=session)
+
+    lines = client.iter_command('seq 1 2')
+    assert next(lines) == '1\n'
+    lines.close()
+    # the channel is closed and its slot is free again
+    session.close.assert_called_once_with()
+    slot = ssh.ssh_pool._channel_slots[pooled_transport]
+    for _ in range(ssh.MAX_CHANNELS):
+        assert slot.acquire(False)
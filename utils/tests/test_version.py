@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
+import mock
+import pickle
 import pytest
 
-from utils.version import Version
+from utils.version import LATEST, LOWEST, Version
 
 GT = '>'
 LT = '<'
@@ -29,3 +31,43 @@ def test_version(v1, op, v2):
         assert v1 < v2
     elif op == EQ:
         assert v1 == v2
+
+
+def test_version_interned():
+    assert Version('5.7.1') is Version('5.7.1')
+    assert Version(Version('5.7.1')) is Version('5.7.1')
+    assert Version([5, 7, 1]) is Version((5, 7, 1))
+    # Same value, different type must not share the cache entry
+    assert Version(1) is not Version(1.0)
+    assert pickle.loads(pickle.dumps(Version('5.7.1'), 2)) is Version('5.7.1')
+    assert len({Version('5.7.1'), Version('5.7.1'), Version('5.7.1-beta')}) == 2
+
+
+def test_version_latest_lowest():
+    assert LATEST > '5.99' > LOWEST
+    assert Version('upstream') == LATEST
+    assert '5.7' < LATEST
+    assert Version('master-nightly') < LATEST
+
+
+def test_version_comparison_does_not_parse(monkeypatch):
+    """Comparing to an already seen string uses the interned instance, nothing is parsed."""
+    version = Version('5.7.1.2')
+    Version('5.8')
+    Version('5.7')
+    monkeypatch.setattr(Version, 'component_re', mock.Mock(wraps=Version.component_re))
+    assert version < '5.8' and version >= '5.7' and version == '5.7.1.2'
+    assert Version('5.7.1.2') is version
+    assert not Version.component_re.findall.called
+    # a version which wasn't seen yet is parsed once
+    assert version < '5.99.123'
+    assert version < '5.99.123'
+    assert Version.component_re.findall.call_count == 1
+
+
+def test_version_parse_returns_new_instance():
+    version = Version('5.7.1')
+    assert version.parse('5.8.0') == Version('5.8.0')
+    # the interned instance stays as it was
+    assert version.vstring == '5.7.1'
+    assert Version('5.7.1') is version
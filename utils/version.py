@@ -157,16 +157,54 @@ def pick(v_dict):
 
 
 class Version(object):
-    """Version class based on distutil.version.LooseVersion"""
+    """Version class based on distutil.version.LooseVersion
+
+    The instances are interned, constructing a Version from the same value again returns the
+    already parsed instance. Comparisons use a sort key computed when parsing. As the instances
+    are shared, they are never changed after they are constructed.
+    """
     SUFFIXES = ('nightly', 'pre', 'alpha', 'beta', 'rc')
     SUFFIXES_STR = "|".join(r'-{}(?:\d+(?:\.\d+)?)?'.format(suff) for suff in SUFFIXES)
     component_re = re.compile(r'(?:\s*(\d+|[a-z]+|\.|(?:{})+$))'.format(SUFFIXES_STR))
     suffix_item_re = re.compile(r'^([^0-9]+)(\d+(?:\.\d+)?)?$')
+    # How many parsed versions are kept, the cache is emptied when it gets full
+    CACHE_SIZE = 4096
+    _cache = {}
+
+    def __new__(cls, vstring):
+        if isinstance(vstring, cls):
+            return vstring
+        if isinstance(vstring, list):
+            vstring = tuple(vstring)
+        # The type is a part of the key so eg. 1 and 1.0 do not end up as the same version
+        key = (cls, type(vstring), vstring)
+        try:
+            return cls._cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable, just parse it
+            key = None
+        self = super(Version, cls).__new__(cls)
+        self._parse(vstring)
+        if key is not None and cls.CACHE_SIZE:
+            if len(cls._cache) >= cls.CACHE_SIZE:
+                cls._cache.clear()
+            cls._cache[key] = self
+        return self
 
     def __init__(self, vstring):
-        self.parse(vstring)
+        # Parsed in __new__
+        pass
+
+    def __getnewargs__(self):
+        return (self.vstring, )
 
     def parse(self, vstring):
+        """Returns: The Version of ``vstring``, this (possibly shared) instance is not changed"""
+        return type(self)(vstring)
+
+    def _parse(self, vstring):
         if vstring is None:
             raise ValueError('Version string cannot be None')
         elif isinstance(vstring, (list, tuple)):
@@ -199,6 +237,18 @@ class Version(object):
 
         self.vstring = vstring
         self.version = components
+        if components == ['master'] and self.suffix is None:
+            rank = 2
+        elif components == ['lowest'] and self.suffix is None:
+            rank = 0
+        else:
+            rank = 1
+        # Versions without suffix are newer than the ones with suffix
+        if self.suffix is None:
+            suffix_key = (1, )
+        else:
+            suffix_key = (0, tuple(self.normalized_suffix))
+        self._key = (rank, tuple(components), suffix_key)
 
     @cached_property
     def normalized_suffix(self):
@@ -244,46 +294,45 @@ class Version(object):
     def __repr__(self):
         return '{}({})'.format(type(self).__name__, repr(self.vstring))
 
-    def __cmp__(self, other):
+    def _other_key(self, other):
         try:
             if not isinstance(other, type(self)):
                 other = Version(other)
         except:
             raise ValueError('Cannot compare Version to {}'.format(type(other).__name__))
+        return other._key
 
-        if self == other:
-            return 0
-        elif self == self.latest() or other == self.lowest():
-            return 1
-        elif self == self.lowest() or other == self.latest():
-            return -1
-        else:
-            result = cmp(self.version, other.version)
-            if result != 0:
-                return result
-            # Use suffixes to decide
-            if self.suffix is None and other.suffix is None:
-                # No suffix, the same
-                return 0
-            elif self.suffix is None:
-                # This does not have suffix but the other does so this is "newer"
-                return 1
-            elif other.suffix is None:
-                # This one does have suffix and the other does not so this one is older
-                return -1
-            else:
-                # Both have suffixes, so do some math
-                return cmp(self.normalized_suffix, other.normalized_suffix)
+    def __cmp__(self, other):
+        return cmp(self._key, self._other_key(other))
+
+    def __lt__(self, other):
+        return self._key < self._other_key(other)
+
+    def __le__(self, other):
+        return self._key <= self._other_key(other)
+
+    def __gt__(self, other):
+        return self._key > self._other_key(other)
+
+    def __ge__(self, other):
+        return self._key >= self._other_key(other)
 
     def __eq__(self, other):
+        if other is self:
+            return True
         try:
             if not isinstance(other, type(self)):
                 other = Version(other)
-            return (
-                self.version == other.version and self.normalized_suffix == other.normalized_suffix)
+            return self._key == other._key
         except:
             return False
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key)
+
     def __contains__(self, ver):
         """Enables to use ``in`` expression for :py:meth:`Version.is_in_series`.
 